@@ -1,17 +1,20 @@
 import logging
 from os import path as osp
 
+import numpy as np
 import torch
-from torch.utils.data import DataLoader
 
-from asdmotion.child_detector.iterable_video_dataset import IterableVideoDataset
+from asdmotion.child_detector.detections import Detections
+from asdmotion.child_detector.frame_loader import PrefetchFrameLoader
 from asdmotion.child_detector.skeleton_matcher import SkeletonMatcher
+from asdmotion.child_detector.utils import iou_matrix
 from asdmotion.utils import RESOURCES_ROOT
 
 
 class ChildDetector:
-    def __init__(self, batch_size=128, device=None):
+    def __init__(self, batch_size=128, device=None, size=640, stride=1, track_iou=0.5, track_confidence=0.5):
         model_path = osp.join(RESOURCES_ROOT, 'models', 'child_detector.pt')
+        self.model_path = model_path
         handlers = list(logging.getLogger().handlers)
         self.model = torch.hub.load('ultralytics/yolov5', 'custom', path=model_path, _verbose=False)
         self.device = torch.device(device)
@@ -19,15 +22,74 @@ class ChildDetector:
             self.model = self.model.to(self.device)
         logging.getLogger().handlers = handlers
         self.batch_size = batch_size
+        self.size = size
+        self.stride = stride
+        self.track_iou = track_iou
+        self.track_confidence = track_confidence
 
-    def detect(self, video_path):
-        dataset = IterableVideoDataset(video_path)
-        dataloader = DataLoader(dataset, batch_size=self.batch_size, collate_fn=lambda x: x)
-        dfs = []
-        for frames_batch in dataloader:
-            detections = self.model(frames_batch, size=640)
-            dfs += detections.pandas().xywh
-        return [(i, df) for i, df in enumerate(dfs)]
+    def _infer(self, loader, frames):
+        results = []
+        for i in range(0, len(frames), self.batch_size):
+            detections = self.model(frames[i:i + self.batch_size], size=self.size)
+            results += [loader.to_original(d.cpu().numpy().astype(np.float64)) for d in detections.xywh]
+        return results
+
+    def _trackable(self, d1, d2):
+        if d1.shape[0] != d2.shape[0] or not np.array_equal(np.sort(d1[:, 5]), np.sort(d2[:, 5])):
+            return None
+        children = np.concatenate([d1[d1[:, 5] == 1, 4], d2[d2[:, 5] == 1, 4]])
+        if (children < self.track_confidence).any():
+            return None
+        # Detections of other classes, and those already paired, are never candidates.
+        ious = np.where(d1[:, None, 5] == d2[None, :, 5], iou_matrix(d1[:, :4], d2[:, :4]), -np.inf)
+        pairs = []
+        for a in np.argsort(-d1[:, 4], kind='stable'):
+            b = int(np.argmax(ious[a]))
+            if ious[a, b] < self.track_iou:
+                return None
+            ious[:, b] = -np.inf
+            pairs.append((a, b))
+        return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+    @staticmethod
+    def _interpolate(d1, d2, pairs, alpha):
+        d = d1[pairs[:, 0]].copy()
+        d[:, :5] = (1 - alpha) * d1[pairs[:, 0], :5] + alpha * d2[pairs[:, 1], :5]
+        return d
+
+    def _detect_strided(self, loader):
+        results, pending, last_key, i0 = {}, [], None, 0
+        for frames_batch in loader:
+            frames = pending + list(zip(range(i0, i0 + len(frames_batch)), frames_batch))
+            keys = [i for i in range(i0, i0 + len(frames_batch)) if i % self.stride == 0]
+            points = ([last_key] if last_key is not None else []) + list(zip(keys, self._infer(loader, [frames_batch[i - i0] for i in keys])))
+            dense = []
+            for (a, d_a), (b, d_b) in zip(points[:-1], points[1:]):
+                between = [(i, f) for i, f in frames if a < i < b]
+                pairs = self._trackable(d_a, d_b)
+                if pairs is None:
+                    dense += between
+                else:
+                    for i, _ in between:
+                        results[i] = self._interpolate(d_a, d_b, pairs, (i - a) / (b - a))
+            results.update(dict(points))
+            if len(dense) > 0:
+                results.update(zip([i for i, _ in dense], self._infer(loader, [f for _, f in dense])))
+            last_key = points[-1] if len(points) > 0 else last_key
+            pending = [(i, f.copy() if i >= i0 else f) for i, f in frames if i > last_key[0]]
+            i0 += len(frames_batch)
+        if len(pending) > 0:
+            results.update(zip([i for i, _ in pending], self._infer(loader, [f for _, f in pending])))
+        return Detections.from_arrays([results[i] for i in range(i0)])
+
+    def detect(self, video_path, frames=None):
+        loader = PrefetchFrameLoader(video_path, batch_size=self.batch_size, size=self.size, frames=frames)
+        if self.stride > 1:
+            return self._detect_strided(loader)
+        results = []
+        for frames_batch in loader:
+            results += self._infer(loader, frames_batch)
+        return Detections.from_arrays(results)
 
     def match_skeleton(self, skeleton, detections, iou_threshold=0.01, conf_threshold=0.1, similarity_threshold=0.85, grace_distance=20, tolerance=100):
         m = SkeletonMatcher(iou_threshold=iou_threshold, conf_threshold=conf_threshold, similarity_threshold=similarity_threshold, grace_distance=grace_distance, tolerance=tolerance)
@@ -0,0 +1,86 @@
+from os import path as osp
+
+import numpy as np
+
+from asdmotion.utils import read_pkl
+
+DETECTION_DTYPE = np.dtype([('frame', np.int64), ('class', np.int64), ('confidence', np.float64),
+                            ('xcenter', np.float64), ('ycenter', np.float64), ('width', np.float64), ('height', np.float64)])
+BOX_FIELDS = ['xcenter', 'ycenter', 'width', 'height']
+
+
+class Detections:
+    def __init__(self, rows, frame_offsets):
+        self.rows = rows
+        self.frame_offsets = frame_offsets
+
+    def __len__(self):
+        return self.frame_offsets.shape[0] - 1
+
+    def frame(self, i, cls=None):
+        rows = self.rows[self.frame_offsets[i]:self.frame_offsets[i + 1]]
+        return rows if cls is None else rows[rows['class'] == cls]
+
+    def of_class(self, cls):
+        return self.rows[self.rows['class'] == cls]
+
+    def best(self, cls):
+        rows = self.of_class(cls)
+        best = -np.ones(len(self), dtype=np.int64)
+        if rows.shape[0] == 0:
+            return best, rows
+        order = np.lexsort((np.arange(rows.shape[0]), -rows['confidence'], rows['frame']))
+        frames, first = np.unique(rows['frame'][order], return_index=True)
+        best[frames] = order[first]
+        return best, rows
+
+    @staticmethod
+    def boxes(rows):
+        return np.stack([rows[f] for f in BOX_FIELDS], axis=-1)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        counts = np.array([a.shape[0] for a in arrays], dtype=np.int64)
+        rows = np.zeros(counts.sum(), dtype=DETECTION_DTYPE)
+        if rows.shape[0] > 0:
+            data = np.concatenate([a for a in arrays if a.shape[0] > 0])
+            rows['frame'] = np.repeat(np.arange(len(arrays)), counts)
+            for k, f in enumerate(BOX_FIELDS + ['confidence']):
+                rows[f] = data[:, k]
+            rows['class'] = data[:, 5].astype(np.int64)
+        return cls(rows, np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))
+
+    @classmethod
+    def from_dataframes(cls, detections):
+        columns = BOX_FIELDS + ['confidence', 'class']
+        return cls.from_arrays([df[columns].to_numpy(dtype=np.float64) for _, df in sorted(detections, key=lambda d: d[0])])
+
+    def to_dataframes(self):
+        import pandas as pd
+        columns = BOX_FIELDS + ['confidence', 'class']
+        return [(i, pd.DataFrame({c: self.frame(i)[c] for c in columns})) for i in range(len(self))]
+
+    def save(self, dst):
+        with open(dst, 'wb') as f:
+            np.savez(f, rows=self.rows, frame_offsets=self.frame_offsets)
+
+    @classmethod
+    def load(cls, src):
+        with np.load(src) as f:
+            return cls(f['rows'], f['frame_offsets'])
+
+
+def as_detections(detections):
+    return detections if isinstance(detections, Detections) else Detections.from_dataframes(detections)
+
+
+def legacy_detections_path(path):
+    return f'{osp.splitext(path)[0]}.pkl'
+
+
+def read_detections(src):
+    if not osp.exists(src) and osp.exists(legacy_detections_path(src)):
+        src = legacy_detections_path(src)
+    if src.endswith('.pkl'):
+        return Detections.from_dataframes(read_pkl(src))
+    return Detections.load(src)
@@ -0,0 +1,90 @@
+import threading
+from queue import Queue
+
+import cv2
+import numpy as np
+
+from asdmotion.pipeline.frame_bus import read_frames
+
+
+def inference_shape(shape, size):
+    h, w = shape[:2]
+    g = size / max(h, w)
+    return int(round(h * g)), int(round(w * g))
+
+
+def close_frames(frames):
+    # Plain iterables of frames have nothing to close, generators and frame subscriptions do.
+    close = getattr(frames, 'close', None)
+    if close is not None:
+        close()
+
+
+class PrefetchFrameLoader:
+    def __init__(self, video_path, batch_size=128, size=640, num_buffers=2, frames=None):
+        self.video_path = video_path
+        self.frames = frames
+        self.batch_size = batch_size
+        self.size = size
+        self.num_buffers = num_buffers
+        self.original_shape = None
+        self.shape = None
+        self.scale = None
+
+    def _allocate(self, shape):
+        h, w = shape
+        return [np.empty((self.batch_size, h, w, 3), dtype=np.uint8) for _ in range(self.num_buffers)]
+
+    def _decode(self, frames, frame, buffers, free, ready, stop):
+        try:
+            while frame is not None:
+                b = free.get()
+                if stop.is_set():
+                    return
+                buf, n = buffers[b], 0
+                while frame is not None and n < self.batch_size:
+                    cv2.resize(frame, (self.shape[1], self.shape[0]), dst=buf[n], interpolation=cv2.INTER_LINEAR)
+                    n += 1
+                    frame = next(frames, None)
+                ready.put((b, n))
+            ready.put(None)
+        except Exception as e:
+            ready.put(e)
+        finally:
+            close_frames(frames)
+
+    def __iter__(self):
+        frames = iter(read_frames(self.video_path) if self.frames is None else self.frames)
+        frame = next(frames, None)
+        if frame is None:
+            close_frames(frames)
+            return
+        self.original_shape = frame.shape[:2]
+        self.shape = inference_shape(self.original_shape, self.size)
+        self.scale = np.array([self.original_shape[1] / self.shape[1], self.original_shape[0] / self.shape[0]])
+        buffers = self._allocate(self.shape)
+        free, ready, stop = Queue(), Queue(), threading.Event()
+        for b in range(self.num_buffers):
+            free.put(b)
+        worker = threading.Thread(target=self._decode, args=(frames, frame, buffers, free, ready, stop), daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                b, n = item
+                yield [buffers[b][i] for i in range(n)]
+                free.put(b)
+        finally:
+            stop.set()
+            free.put(None)
+            worker.join()
+
+    def to_original(self, xywh):
+        sx, sy = self.scale
+        xywh[:, [0, 2]] *= sx
+        xywh[:, [1, 3]] *= sy
+        return xywh
@@ -1,13 +1,9 @@
 import numpy as np
-from tqdm import tqdm
 
-from asdmotion.child_detector.utils import bounding_box, get_box, get_iou, find_nearest
+from asdmotion.child_detector.detections import Detections, as_detections
+from asdmotion.child_detector.utils import bounding_boxes, iou_matrix
 
 
-def get_boxes(kp, score):
-    M = kp.shape[0]
-    return [bounding_box(kp[i].T, score[i]).reshape(-1) for i in range(M)]
-
 class SkeletonMatcher:
     def __init__(self, iou_threshold, conf_threshold, grace_distance, similarity_threshold, tolerance):
         self.iou_threshold = iou_threshold
@@ -16,66 +12,72 @@ class SkeletonMatcher:
         self.similarity_threshold = similarity_threshold
         self.tolerance = tolerance
 
-    def _straight_match(self, detections, kp, kps, cids, detected, boxes):
-        child_box = None
-        for i, df in tqdm(enumerate(detections), desc='Skeleton Matcher'):
-            children = df[df['class'] == 1]
-            if children.shape[0] == 0:
-                continue
-            elif children.shape[0] > 1 and child_box is not None:
-                candidates = [(i, get_box(b)) for i, b in children.iterrows()]
-                ious = [get_iou(get_box(child_box), b) for _, b in candidates]
-                child_box = children.loc[candidates[np.argmax(ious)][0]]
-                # if not np.equal(child_box.values, children.loc[children['confidence'].idxmax()].values).all():
-                #     print('Different child box was chosen!')
-            else:
-                child_box = children.loc[children['confidence'].idxmax()]
-            boxes[i] = get_box(child_box)
-            cid, iou = find_nearest(child_box, get_boxes(kp[:, i, :, :], kps[:, i, :]))
-            if iou < self.iou_threshold:
+    def _select_children(self, detections):
+        best, children = detections.best(1)
+        child_boxes = Detections.boxes(children)
+        starts = np.searchsorted(children['frame'], np.arange(len(detections) + 1))
+        frames = np.flatnonzero(best >= 0)
+        chosen = best.copy()
+        # With several children in a frame, follow the box chosen in the previous detected frame.
+        for k in np.flatnonzero(np.diff(starts)[frames] > 1):
+            if k == 0:
                 continue
-            detected[i] = child_box['confidence']
-            cids[i] = cid
+            i = frames[k]
+            ious = iou_matrix(child_boxes[chosen[frames[k - 1]]][None], child_boxes[starts[i]:starts[i + 1]])[0]
+            chosen[i] = starts[i] + np.argmax(ious)
+        return frames, chosen[frames], children, child_boxes
 
+    def _straight_match(self, detections, person_boxes, cids, detected, boxes):
+        frames, chosen, children, child_boxes = self._select_children(detections)
+        keep = frames < person_boxes.shape[0]
+        frames, chosen = frames[keep], chosen[keep]
+        boxes[frames] = child_boxes[chosen]
+        ious = iou_matrix(child_boxes[chosen][:, None], person_boxes[frames])[:, 0]
+        nearest = ious.argmax(axis=1)
+        matched = ious[np.arange(frames.shape[0]), nearest] >= self.iou_threshold
+        detected[frames[matched]] = children['confidence'][chosen[matched]]
+        cids[frames[matched]] = nearest[matched]
 
-    def _interpolate(self, detections, kp, kps, cids, detected, boxes):
-        env = [{} for _ in detected]
+    def _interpolate(self, detections, person_boxes, cids, detected, boxes):
+        T = detected.shape[0]
+        idx = np.arange(T)
+        hit = detected > self.conf_threshold
+        prev = np.maximum.accumulate(np.where(hit, idx, -1))
+        next = np.minimum.accumulate(np.where(hit, idx, T)[::-1])[::-1]
+        # A previous detection at frame 0 does not count towards the grace distance.
+        near = ((prev > 0) & (idx - prev < self.grace_distance)) | ((next < T) & (next - idx < self.grace_distance))
+        gaps = np.flatnonzero(~hit & near & (idx < min(len(detections), person_boxes.shape[0])))
+        if gaps.shape[0] == 0:
+            return
+        prev, next = prev[gaps], next[gaps]
+        j = np.where(next == T, prev, np.where(prev < 0, next, np.where(gaps - prev >= next - gaps, prev, next)))
+        best, children = detections.best(1)
+        child_boxes = Detections.boxes(children)[best[j]]
 
-        def scan(lst, key, reverse):
-            tmp = None
-            for i, child_conf in reversed(list(enumerate(lst))) if reverse else enumerate(lst):
-                if child_conf > self.conf_threshold:
-                    tmp = i
-                env[i][key] = tmp
+        ious = iou_matrix(child_boxes[:, None], person_boxes[gaps])[:, 0]
+        candidates = ious.argmax(axis=1)
+        candidate_ious = ious[np.arange(gaps.shape[0]), candidates]
+        matched = candidate_ious >= self.iou_threshold
 
-        scan(detected, 'prev', reverse=False)
-        scan(detected, 'next', reverse=True)
-
-        for i, df in tqdm(enumerate(detections), desc='Interpolate'):
-            if detected[i] > self.conf_threshold:
-                continue
-            prev, next = env[i]['prev'], env[i]['next']
-            if not ((prev and np.abs(prev - i) < self.grace_distance) or (next and np.abs(next - i) < self.grace_distance)):
-                continue
-            j = prev if next is None else next if prev is None else prev if abs(i - prev) >= abs(next - i) else next
-            _df = detections[j]
-            children = _df[_df['class'] == 1]
-            child_box = children.loc[children['confidence'].idxmax()]
-            candidate, candidate_iou = find_nearest(child_box, get_boxes(kp[:, i, :, :], kps[:, i, :]))
-            if candidate_iou < self.iou_threshold:
-                continue
-            adults = df[df['class'] == 0]
-            adults_matches = [(idx, find_nearest(adult_box, get_boxes(kp[:, i, :, :], kps[:, i, :]))) for idx, adult_box in adults.iterrows()]
-            conflicts = [(idx, a, iou) for idx, (a, iou) in adults_matches if a == candidate and iou > self.iou_threshold]
-            if any(rival_iou > candidate_iou and \
-                   not get_iou(get_box(child_box), get_box(adults.loc[idx])) > self.similarity_threshold for idx, _, rival_iou in conflicts):
-                continue
-            cids[i] = candidate
-            boxes[i] = get_box(child_box)
+        adults = detections.of_class(0)
+        pos = np.searchsorted(gaps, adults['frame'])
+        in_gap = pos < gaps.shape[0]
+        in_gap[in_gap] = gaps[pos[in_gap]] == adults['frame'][in_gap]
+        pos, adult_boxes = pos[in_gap], Detections.boxes(adults[in_gap])
+        if pos.shape[0] > 0:
+            adult_ious = iou_matrix(adult_boxes[:, None], person_boxes[gaps[pos]])[:, 0]
+            nearest = adult_ious.argmax(axis=1)
+            rival_ious = adult_ious[np.arange(pos.shape[0]), nearest]
+            similarity = iou_matrix(child_boxes[pos][:, None], adult_boxes[:, None])[:, 0, 0]
+            conflicts = (nearest == candidates[pos]) & (rival_ious > self.iou_threshold) & (rival_ious > candidate_ious[pos]) & ~(similarity > self.similarity_threshold)
+            matched[pos[conflicts]] = False
 
+        cids[gaps[matched]] = candidates[matched]
+        boxes[gaps[matched]] = child_boxes[matched]
 
     def match_skeleton(self, skeleton, detections):
         skeleton = skeleton.copy()
+        detections = as_detections(detections)
         kp = skeleton['keypoint']
         kps = skeleton['keypoint_score']
         _, T, _, _ = kp.shape
@@ -94,7 +96,7 @@ class SkeletonMatcher:
         cids = skeleton['child_ids']
         detected = skeleton['child_detected']
         boxes = skeleton['child_bbox']
-        _, detections = list(zip(*detections))
-        self._straight_match(detections, kp, kps, cids, detected, boxes)
-        self._interpolate(detections, kp, kps, cids, detected, boxes)
+        person_boxes = bounding_boxes(kp, kps).transpose(1, 0, 2)
+        self._straight_match(detections, person_boxes, cids, detected, boxes)
+        self._interpolate(detections, person_boxes, cids, detected, boxes)
         return skeleton
@@ -8,10 +8,9 @@ def get_box(row):
 
 
 def find_nearest(child_row, boxes):
-    cb = get_box(child_row)
-    iou = [get_iou(cb, b) for b in boxes]
+    iou = iou_matrix(get_box(child_row)[None], np.asarray(boxes))[0]
     nearest = np.argmax(iou)
-    return nearest, np.max(iou)
+    return nearest, iou[nearest]
 
 
 def get_iou(_bb1, _bb2):
@@ -47,6 +46,19 @@ def get_iou(_bb1, _bb2):
     return iou
 
 
+def iou_matrix(boxes1, boxes2):
+    # Same corner convention as get_iou (floor of half extents); degenerate pairs get 0 instead of failing.
+    b1, b2 = np.asarray(boxes1)[..., :, None, :], np.asarray(boxes2)[..., None, :, :]
+    x1_1, y1_1, x2_1, y2_1 = b1[..., 0] - b1[..., 2] // 2, b1[..., 1] - b1[..., 3] // 2, b1[..., 0] + b1[..., 2] // 2, b1[..., 1] + b1[..., 3] // 2
+    x1_2, y1_2, x2_2, y2_2 = b2[..., 0] - b2[..., 2] // 2, b2[..., 1] - b2[..., 3] // 2, b2[..., 0] + b2[..., 2] // 2, b2[..., 1] + b2[..., 3] // 2
+    x_left, y_top = np.maximum(x1_1, x1_2), np.maximum(y1_1, y1_2)
+    x_right, y_bottom = np.minimum(x2_1, x2_2), np.minimum(y2_1, y2_2)
+    intersection_area = (x_right - x_left) * (y_bottom - y_top)
+    union_area = (x2_1 - x1_1) * (y2_1 - y1_1) + (x2_2 - x1_2) * (y2_2 - y1_2) - intersection_area
+    valid = (x_right >= x_left) & (y_bottom >= y_top) & (union_area > 0)
+    return np.where(valid, intersection_area / np.where(valid, union_area, 1), 0.0)
+
+
 def box_distance(b1, b2):
     c1, _ = b1
     c2, _ = b2
@@ -64,3 +76,14 @@ def bounding_box(pose, score, epsilon=EPSILON):
         y = np.array([0])
     w, h = (np.max(x) - np.min(x)), (np.max(y) - np.min(y))
     return np.array([np.min(x) + w / 2, np.min(y) + h / 2, w, h]).reshape((2, 2))
+
+
+def bounding_boxes(kp, kps, epsilon=EPSILON):
+    # kp: (..., V, 2), kps: (..., V) -> (..., 4) boxes as (xcenter, ycenter, width, height), zeros when no joint is valid.
+    kp, valid = np.asarray(kp), np.asarray(kps) > epsilon
+    empty = ~valid.any(axis=-1)
+    lo = np.where(valid[..., None], kp, np.inf).min(axis=-2)
+    hi = np.where(valid[..., None], kp, -np.inf).max(axis=-2)
+    lo[empty], hi[empty] = 0, 0
+    wh = hi - lo
+    return np.concatenate([lo + wh / 2, wh], axis=-1)
@@ -0,0 +1,94 @@
+import os
+import time
+from argparse import ArgumentParser
+from os import path as osp
+
+from omegaconf import OmegaConf
+
+from asdmotion.detector.executor import build_predictor, build_transformer, VIDEO_PROPERTIES_FILE
+from asdmotion.logger import LogManager
+from asdmotion.pipeline.stage_graph import Stage, StageGraph
+from asdmotion.utils import load_config, probe_videos, VIDEO_PROPERTIES_CACHE
+
+logger = LogManager.APP_LOGGER
+VIDEO_EXTENSIONS = ('.avi', '.mp4')
+DEFAULT_STAGE_WORKERS = {'probe': 2, 'pose': 1, 'detection': 1, 'dataset': 2, 'inference': 1, 'aggregation': 2}
+
+
+def list_videos(videos):
+    # A directory of videos, or a manifest file with one video path per line.
+    if osp.isdir(videos):
+        return sorted(osp.join(videos, f) for f in os.listdir(videos) if f.lower().endswith(VIDEO_EXTENSIONS))
+    with open(videos) as f:
+        lines = [line.strip() for line in f.readlines()]
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def create_environments(vt, video_paths):
+    # Probes the videos in parallel, so every environment reads its properties from the cache. A video that fails, fails alone.
+    probed = probe_videos(video_paths, frame_index_paths={v: vt.frame_index_path(v) for v in video_paths})
+    environments = []
+    for v in video_paths:
+        try:
+            if isinstance(probed[v], Exception):
+                raise probed[v]
+            environments.append(vt.create_environment(v))
+        except Exception as e:
+            environments.append(e)
+    return environments
+
+
+def video_stages(vt, p, workers=None, queue_size=2, inference_batch=4, probe_batch=8):
+    workers = dict(DEFAULT_STAGE_WORKERS, **(workers or {}))
+    if p is not None and p.inference_worker and workers['inference'] > 1:
+        logger.info('The inference worker serves one request at a time, using a single inference thread.')
+        workers['inference'] = 1
+    stages = [Stage('probe', lambda states: create_environments(vt, [s['input'] for s in states]), workers['probe'], queue_size=queue_size,
+                    batch=probe_batch),
+              Stage('pose', lambda s: vt.create_skeleton_raw(s['probe']), workers['pose'], after=['probe'], queue_size=queue_size),
+              Stage('detection', lambda s: vt.create_detections(s['probe']), workers['detection'], after=['probe'], queue_size=queue_size),
+              Stage('dataset', lambda s: vt.finalize_environment(s['probe']), workers['dataset'], after=['pose', 'detection'], queue_size=queue_size)]
+    if p is not None:
+        # Datasets that are ready together are scored in one inference worker request.
+        stages += [Stage('inference', lambda states: p.score_videos([s['dataset'] for s in states]), workers['inference'], after=['dataset'],
+                         queue_size=queue_size, batch=inference_batch),
+                   Stage('aggregation', lambda s: p.annotate_video(s['dataset']), workers['aggregation'], after=['inference'], queue_size=queue_size)]
+    return stages
+
+
+def predict_videos(stages, video_paths):
+    s = time.time()
+    results = StageGraph(stages).run(video_paths)
+    failed = [v for v, (_, e) in zip(video_paths, results) if e is not None]
+    delta = time.time() - s
+    logger.info(f'Total {int(delta // 3600):02d}:{int((delta % 3600) // 60):02d}:{delta % 60:05.2f} for {len(video_paths)} videos, {len(failed)} failed.')
+    for v in failed:
+        logger.info(f'Failed: {v}')
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("-cfg", "--cfg", type=str)
+    parser.add_argument("-videos", "--videos", help='A directory of videos or a file listing one video path per line.')
+    parser.add_argument("-out", "--out_path")
+    parser.add_argument("-gpu", "--gpu", type=int, default=0)
+    args = parser.parse_args()
+
+    cfg = OmegaConf.merge(load_config(args.cfg), OmegaConf.create(vars(args)))
+    if not osp.exists(cfg.videos):
+        raise FileNotFoundError(f'Videos path {cfg.videos} does not exist.')
+    video_paths = list_videos(cfg.videos)
+    work_dir = cfg.out_path
+
+    logger.info(f'Executing ASDMotion on {len(video_paths)} videos. Results will be saved to {work_dir}')
+    VIDEO_PROPERTIES_CACHE.attach(osp.join(work_dir, VIDEO_PROPERTIES_FILE))
+    vt = build_transformer(cfg, work_dir)
+    p = build_predictor(cfg, work_dir)
+    workers = OmegaConf.to_container(cfg.batch_stage_workers) if cfg.get('batch_stage_workers') else None
+    try:
+        predict_videos(video_stages(vt, p, workers, queue_size=cfg.get('batch_queue_size', 2), inference_batch=cfg.get('batch_inference_videos', 4)),
+                       video_paths)
+    finally:
+        p.close()
+        VIDEO_PROPERTIES_CACHE.save()
@@ -1,3 +1,4 @@
+import os
 import shlex
 import subprocess
 from os import path as osp
@@ -5,16 +6,26 @@ from os import path as osp
 import numpy as np
 import pandas as pd
 
-from asdmotion.pipeline.aggregator import aggregate
+from asdmotion.pipeline.aggregator import aggregate, threshold_totals
 from asdmotion.logger import LogManager
-from asdmotion.utils import RESOURCES_ROOT, read_pkl
+from asdmotion.detector.inference_client import InferenceWorker
+from asdmotion.detector.results_store import ResultsStore, assessment_of
+from asdmotion.detector.score_cache import ScoreCache, cfg_fingerprint, window_key
+from asdmotion.pipeline.window_dataset import WindowDataset, read_intervals, read_skipped, write_annotations
+from asdmotion.utils import RESOURCES_ROOT, file_fingerprint, read_pkl, write_pkl
 
 MODELS_DIR = osp.join(RESOURCES_ROOT, 'models')
 logger = LogManager.APP_LOGGER
 
 
+def tta_clips_path(predictions_path):
+    return f'{osp.splitext(predictions_path)[0]}_clips.pkl'
+
+
 class Predictor:
-    def __init__(self, work_dir, model_name, binary_threshold, labels, mmlab_python, mmaction_root, gpu_id=None):
+    def __init__(self, work_dir, model_name, binary_threshold, labels, mmlab_python, mmaction_root, gpu_id=None, inference_worker=False, worker_batch_size=16,
+                 numpy_pipeline=False, adaptive_tta=False, tta_margin=1.0, score_cache_path=None, score_cache_size=1000000,
+                 results_store_path=None):
         self.work_dir = work_dir
         self.model_name = model_name
         self.binary_model_path = osp.join(MODELS_DIR, self.model_name)
@@ -25,37 +36,146 @@ class Predictor:
         self.mmaction_root = mmaction_root
         self.va_columns = ['video', 'video_full_name', 'video_path', 'start_time', 'end_time', 'start_frame', 'end_frame', 'movement', 'calc_date', 'annotator']
         self.gpu_id = gpu_id
+        self.inference_worker = inference_worker
+        self.worker_batch_size = worker_batch_size
+        self.numpy_pipeline = numpy_pipeline
+        if adaptive_tta and not inference_worker:
+            # mmaction's test script always scores every clip, so adaptive TTA only exists in the inference worker.
+            raise ValueError('adaptive_tta requires inference_worker.')
+        self.adaptive_tta = adaptive_tta
+        self.tta_margin = tta_margin
+        self.score_cache = ScoreCache(score_cache_path, score_cache_size) if score_cache_path else None
+        self.results_store = ResultsStore(results_store_path) if results_store_path else None
+        self.worker = None
 
-    def _predict(self, cfg_path, model_path, out_path):
-        if not osp.exists(out_path):
-            out_exec = f'\\{out_path}' if out_path.startswith('\\\\') else out_path
-            cmd = f'python "{osp.join(self.mmaction_root, "tools", "test.py")}" "{cfg_path}" "{model_path}" --out "{out_exec}"'
-            if self.gpu_id is not None:
-                cmd += f" --gpu-ids {self.gpu_id}"
-            cmd = f'{osp.join(RESOURCES_ROOT, "run_in_env.bat")} {cmd}'.replace('\\', '/')
-            logger.info(f'Executing: {cmd}')
-            subprocess.check_call(shlex.split(cmd), universal_newlines=True)
-            logger.info('Prediction complete successfully.')
-        else:
+    @staticmethod
+    def _dataset_paths(video_info):
+        dataset_path = video_info['dataset_path']
+        ann_file = video_info.get('ann_file_path')
+        if not osp.exists(dataset_path) and ann_file is not None and osp.exists(ann_file):
+            return ann_file, None
+        return dataset_path, ann_file
+
+    @staticmethod
+    def _windows(dataset_path):
+        if osp.isfile(dataset_path):
+            return read_pkl(dataset_path)['annotations']
+        return WindowDataset.load(dataset_path).to_annotations()['annotations']
+
+    def _cached(self, cfg_path, model_path, named_windows, infer):
+        # Only windows that miss the cache are passed to `infer`, which returns {name: (scores, clips)} for them.
+        if self.score_cache is None:
+            return infer(named_windows)
+        tta = f'tta:{self.threshold}:{self.tta_margin}' if self.adaptive_tta else 'tta:full'
+        context = f'{file_fingerprint(model_path)}:{cfg_fingerprint(cfg_path)}:{tta}'
+        keys = {n: [window_key(w, context) for w in windows] for n, windows in named_windows.items()}
+        hits = self.score_cache.get_many([k for n in keys for k in keys[n]])
+        missing = {n: [i for i, k in enumerate(keys[n]) if k not in hits] for n in named_windows}
+        total, computed = sum(len(k) for k in keys.values()), sum(len(i) for i in missing.values())
+        logger.info(f'Score cache: {total - computed} of {total} sequences cached.')
+        if computed > 0:
+            inferred = infer({n: [named_windows[n][i] for i in missing[n]] for n in named_windows if len(missing[n]) > 0})
+            for n, (scores, clips) in inferred.items():
+                new = {keys[n][i]: (s, c) for i, s, c in zip(missing[n], scores, clips)}
+                self.score_cache.put_many(new)
+                hits.update(new)
+        return {n: ([hits[k][0] for k in keys[n]], [hits[k][1] for k in keys[n]]) for n in named_windows}
+
+    def _write_predictions(self, out_path, scores, clips):
+        if self.adaptive_tta:
+            logger.info(f'Adaptive TTA used {np.mean(clips) if len(clips) > 0 else 0:.2f} clips per sequence on average.')
+            write_pkl(np.asarray(clips), tta_clips_path(out_path))
+        write_pkl([np.asarray(s) for s in scores], out_path)
+
+    def _worker_predict(self, cfg_path, model_path, jobs):
+        if self.worker is None:
+            self.worker = InferenceWorker(cfg_path, model_path, self.mmaction_root, gpu_id=self.gpu_id, batch_size=self.worker_batch_size,
+                                          numpy_pipeline=self.numpy_pipeline, tta_threshold=self.threshold if self.adaptive_tta else None,
+                                          tta_margin=self.tta_margin).start()
+        logger.info(f'Predicting {len(jobs)} videos with the inference worker.')
+        named_windows = {out_path: self._windows(dataset_path) for out_path, dataset_path in jobs.items()}
+        for out_path, (scores, clips) in self._cached(cfg_path, model_path, named_windows, self.worker.predict_many).items():
+            self._write_predictions(out_path, scores, clips)
+
+    def close(self):
+        if self.worker is not None:
+            self.worker.close()
+            self.worker = None
+        if self.score_cache is not None:
+            self.score_cache.close()
+            self.score_cache = None
+
+    def _run_test(self, cfg_path, model_path, out_path):
+        out_exec = f'\\{out_path}' if out_path.startswith('\\\\') else out_path
+        cmd = f'python "{osp.join(self.mmaction_root, "tools", "test.py")}" "{cfg_path}" "{model_path}" --out "{out_exec}"'
+        if self.gpu_id is not None:
+            cmd += f" --gpu-ids {self.gpu_id}"
+        cmd = f'{osp.join(RESOURCES_ROOT, "run_in_env.bat")} {cmd}'.replace('\\', '/')
+        logger.info(f'Executing: {cmd}')
+        subprocess.check_call(shlex.split(cmd), universal_newlines=True)
+        logger.info('Prediction complete successfully.')
+
+    def _test_missing(self, cfg_path, model_path, out_path, ann_file, named_windows):
+        # The cfg reads its sequences from ann_file, so it is written with the missing windows only.
+        (windows,) = named_windows.values()
+        tmp_path = f'{osp.splitext(out_path)[0]}_missing.pkl'
+        write_pkl({'split': {'test1': [w['frame_dir'] for w in windows]}, 'annotations': windows}, ann_file)
+        try:
+            self._run_test(cfg_path, model_path, tmp_path)
+            scores = read_pkl(tmp_path)
+        finally:
+            for f in [ann_file, tmp_path]:
+                if osp.exists(f):
+                    os.remove(f)
+        return {n: (scores, [None] * len(scores)) for n in named_windows}
+
+    def _predict(self, cfg_path, model_path, out_path, dataset_path=None, ann_file=None):
+        if osp.exists(out_path):
             logger.info(f'Prediction exists: {out_path}')
+        elif self.inference_worker:
+            self._worker_predict(cfg_path, model_path, {out_path: dataset_path})
+        elif self.score_cache is not None and ann_file is not None and osp.isdir(dataset_path):
+            results = self._cached(cfg_path, model_path, {out_path: self._windows(dataset_path)},
+                                   lambda named: self._test_missing(cfg_path, model_path, out_path, ann_file, named))
+            self._write_predictions(out_path, *results[out_path])
+        else:
+            if ann_file is not None and not osp.exists(ann_file):
+                logger.info(f'Materializing annotations: {ann_file}')
+                write_annotations(dataset_path, ann_file)
+            self._run_test(cfg_path, model_path, out_path)
+            if ann_file is not None and osp.isdir(dataset_path):
+                os.remove(ann_file)
         scores = read_pkl(out_path)
         return np.array(scores).T
 
     def _detect_stereotypical_movements(self, video_info):
-        dataset = read_pkl(video_info['dataset_path'])['annotations']
+        dataset_path, ann_file = self._dataset_paths(video_info)
+        intervals = read_intervals(dataset_path)
+        skipped = read_skipped(dataset_path)
         basename, fullname, path, fps = video_info['name'], video_info['fullname'], video_info['video_path'], video_info['properties']['fps']
-        logger.info(f'Binary classification in progress')
         cfg_path, model_path, out_path = video_info['binary_cfg_path'], self.binary_model_path, video_info['predictions_path']
-        binary_scores = self._predict(cfg_path, model_path, out_path)
-        pos_score = binary_scores[1]
+        if intervals.shape[0] == 0:
+            # Every sequence was dropped for lack of a matched child, so there is nothing to classify.
+            logger.info(f'No sequences to classify in {basename}.')
+            pos_score = np.zeros(0)
+        else:
+            logger.info(f'Binary classification in progress')
+            binary_scores = self._predict(cfg_path, model_path, out_path, dataset_path=dataset_path, ann_file=ann_file)
+            pos_score = binary_scores[1]
 
-        df = pd.DataFrame(columns=self.va_columns + ['stereotypical_score'])
-        for d, score in zip(dataset, pos_score):
-            s, t = d['start'], d['end']
-            df.loc[df.shape[0]] = [basename, fullname, path, s / fps, t / fps, s, t, -1, pd.Timestamp.now(), self.model_name, score]
-        return df
+        starts = np.concatenate([intervals[:, 0], skipped[:, 0]])
+        ends = np.concatenate([intervals[:, 1], skipped[:, 1]])
+        df = pd.DataFrame({'video': basename, 'video_full_name': fullname, 'video_path': path, 'start_time': starts / fps, 'end_time': ends / fps,
+                           'start_frame': starts, 'end_frame': ends,
+                           'movement': np.array([-1] * intervals.shape[0] + ['NoChild'] * skipped.shape[0], dtype=object),
+                           'calc_date': pd.Timestamp.now(), 'annotator': self.model_name,
+                           'stereotypical_score': np.concatenate([np.asarray(pos_score, dtype=np.float64).reshape(-1), np.full(skipped.shape[0], np.nan)])},
+                          columns=self.va_columns + ['stereotypical_score'])
+        if intervals.shape[0] > 0 and osp.exists(tta_clips_path(out_path)):
+            df['tta_clips'] = np.concatenate([read_pkl(tta_clips_path(out_path)), np.zeros(skipped.shape[0], dtype=np.int64)])
+        return df.sort_values(by='start_frame', kind='stable').reset_index(drop=True)
 
-    def _model_predictions(self, video_info):
+    def score_video(self, video_info):
         logger.info(f'Collecting ASDMotion predictions for {video_info["name"]}')
         scores_path = video_info['scores_path']
         if osp.exists(scores_path):
@@ -63,12 +183,16 @@ class Predictor:
         else:
             df = self._detect_stereotypical_movements(video_info)
             df.to_csv(scores_path, index=False)
-        agg = aggregate(df, self.threshold)
+        return df
+
+    def _model_predictions(self, scores):
+        agg = aggregate(scores[self.va_columns + ['stereotypical_score']].copy(), self.threshold)
         agg['source'] = self.model_name
         return agg
 
     def conclude(self, _df, video_info):
         df = _df[_df['movement'] == 'Stereotypical'].copy()
+        nochild = _df[_df['movement'] == 'NoChild']
         fps = video_info['properties']['fps']
         video_length_seconds = video_info['properties']['length']
         video_length_minute = video_length_seconds / 60
@@ -78,20 +202,59 @@ class Predictor:
         df['segment_frames'] = df['end_frame'] - df['start_frame']
         df['relative_segment_frames'] = df['segment_frames'] / valid_frames
         df['segment_length_minute'] = df['segment_frames'] / (fps * 60)
-        grp = df.groupby('video').agg({'segment_length_minute': 'sum', 'relative_segment_frames': 'sum', 'movement': 'count'}).reset_index()
+        grp = df.groupby('video').agg({'segment_length_minute': 'sum', 'relative_segment_frames': 'sum', 'movement': 'count'})
+        # A video without any stereotypical segment still gets its row, with zeros.
+        grp = grp.reindex(grp.index.union(pd.Index([video_info['name']], name='video')), fill_value=0).reset_index()
         grp.columns = ['video', 'smm_length_minute', 'smm_proportion', 'smm_count']
         grp['fps'] = fps
         grp['video_length_minute'] = video_length_minute
         grp['video_frame_count'] = video_frame_count
         grp['valid_frames'] = valid_frames
         grp['last_valid_frame'] = last_valid_frame
+        grp['skipped_frames'] = int((nochild['end_frame'] - nochild['start_frame']).sum())
+        grp['smm/min'] = grp['smm_count'] / grp['video_length_minute']
+        grp['assessment'] = grp['video'].apply(assessment_of)
+        return grp
+
+    def conclude_thresholds(self, video_info, thresholds):
+        # The conclusion of every threshold from the stored window scores, without writing annotations. Unlike conclude,
+        # thresholds without any stereotypical segment get a row of zeros.
+        df = pd.read_csv(video_info['scores_path'])
+        smm_count, smm_frames, skipped_frames = threshold_totals(df[self.va_columns + ['stereotypical_score']], thresholds)
+        props = video_info['properties']
+        fps, video_length_minute, valid_frames = props['fps'], props['length'] / 60, props['valid_frames']
+        grp = pd.DataFrame({'video': video_info['name'], 'threshold': np.asarray(thresholds, dtype=np.float64).reshape(-1),
+                            'smm_length_minute': smm_frames / (fps * 60), 'smm_proportion': smm_frames / valid_frames, 'smm_count': smm_count})
+        grp['fps'] = fps
+        grp['video_length_minute'] = video_length_minute
+        grp['video_frame_count'] = props['frame_count']
+        grp['valid_frames'] = valid_frames
+        grp['last_valid_frame'] = props['last_valid_frame']
+        grp['skipped_frames'] = skipped_frames.astype(np.int64)
         grp['smm/min'] = grp['smm_count'] / grp['video_length_minute']
-        grp['assessment'] = grp['video'].apply(lambda v: '_'.join(v.split('_')[:-2]))
+        grp['assessment'] = assessment_of(video_info['name'])
         return grp
 
+    def score_videos(self, video_infos):
+        # With the inference worker, the sequences of all the videos are sent in one request so they share batches.
+        if self.inference_worker:
+            jobs = {v['predictions_path']: self._dataset_paths(v)[0] for v in video_infos
+                    if not osp.exists(v['predictions_path']) and not osp.exists(v['scores_path'])}
+            jobs = {out_path: dataset_path for out_path, dataset_path in jobs.items() if read_intervals(dataset_path).shape[0] > 0}
+            if len(jobs) > 0:
+                self._worker_predict(video_infos[0]['binary_cfg_path'], self.binary_model_path, jobs)
+        return [self.score_video(v) for v in video_infos]
+
+    def annotate_videos(self, video_infos):
+        self.score_videos(video_infos)
+        return [self.annotate_video(v) for v in video_infos]
+
     def annotate_video(self, video_info):
-        df = self._model_predictions(video_info).sort_values(by=['video', 'start_time'])
+        scores = self.score_video(video_info)
+        df = self._model_predictions(scores).sort_values(by=['video', 'start_time'])
         conc = self.conclude(df, video_info)
         df.to_csv(video_info['annotations_path'], index=False)
         conc.to_csv(video_info['conclusion_path'], index=False)
+        if self.results_store is not None:
+            self.results_store.append_video(video_info['name'], self.model_name, scores=scores, annotations=df, conclusion=conc)
         return df
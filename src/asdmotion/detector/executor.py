@@ -7,9 +7,25 @@ from omegaconf import OmegaConf
 from asdmotion.detector.detector import Predictor
 from asdmotion.detector.preprocess import VideoTransformer
 from asdmotion.logger import LogManager
-from asdmotion.utils import load_config
+from asdmotion.utils import load_config, VIDEO_PROPERTIES_CACHE
 
 logger = LogManager.APP_LOGGER
+VIDEO_PROPERTIES_FILE = 'video_properties.json'
+
+def build_transformer(cfg, work_dir):
+    return VideoTransformer(work_dir, cfg.model_name, cfg.open_pose_path, cfg.child_detection, cfg.sequence_length, cfg.step_size, cfg.gpu, cfg.num_person_in,
+                            cfg.num_person_out, frame_ingestion=cfg.get('frame_ingestion', 'img_dir'), openpose_shards=cfg.get('openpose_shards', 1),
+                            detection_stride=cfg.get('child_detection_stride', 1), min_valid_ratio=cfg.get('min_valid_ratio', 0.0),
+                            artifact_cache_path=cfg.get('artifact_cache_path'))
+
+
+def build_predictor(cfg, work_dir):
+    return Predictor(work_dir, cfg.model_name, cfg.classification_threshold, ['NoAction', 'Stereotypical'], cfg.mmlab_python_path, cfg.mmaction_path, cfg.gpu,
+                     inference_worker=cfg.get('inference_worker', False), numpy_pipeline=cfg.get('numpy_pipeline', False),
+                     adaptive_tta=cfg.get('adaptive_tta', False), tta_margin=cfg.get('tta_margin', 1.0),
+                     score_cache_path=cfg.get('score_cache_path'), score_cache_size=cfg.get('score_cache_size', 1000000),
+                     results_store_path=cfg.get('results_store_path'))
+
 
 def predict_video(vt, vpath, p=None):
     v = osp.splitext(osp.basename(vpath))[0]
@@ -39,7 +55,12 @@ if __name__ == '__main__':
     work_dir = cfg.out_path
 
     logger.info(f'Executing ASDMotion on {video_path}. Results will be saved to {work_dir}')
-    vt = VideoTransformer(work_dir, cfg.model_name, cfg.open_pose_path, cfg.child_detection, cfg.sequence_length, cfg.step_size, cfg.gpu, cfg.num_person_in, cfg.num_person_out)
-    p = Predictor(work_dir, cfg.model_name, cfg.classification_threshold, ['NoAction', 'Stereotypical'], cfg.mmlab_python_path, cfg.mmaction_path, cfg.gpu)
+    VIDEO_PROPERTIES_CACHE.attach(osp.join(work_dir, VIDEO_PROPERTIES_FILE))
+    vt = build_transformer(cfg, work_dir)
+    p = build_predictor(cfg, work_dir)
     logger.info(f'Annotating: {video_path}')
-    predict_video(vt=vt, p=p, vpath=video_path)
+    try:
+        predict_video(vt=vt, p=p, vpath=video_path)
+    finally:
+        p.close()
+        VIDEO_PROPERTIES_CACHE.save()
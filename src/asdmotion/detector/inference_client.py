@@ -0,0 +1,111 @@
+import os
+import shlex
+import socket
+import subprocess
+import time
+from multiprocessing.connection import Client
+from os import path as osp
+
+import numpy as np
+
+from asdmotion.detector.inference_worker import AUTHKEY_ENV
+from asdmotion.logger import LogManager
+from asdmotion.utils import RESOURCES_ROOT
+
+WORKER_SCRIPT = osp.join(osp.dirname(osp.abspath(__file__)), 'inference_worker.py')
+logger = LogManager.APP_LOGGER
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class InferenceWorker:
+    def __init__(self, cfg_path, model_path, mmaction_root, gpu_id=None, batch_size=16, python_cmd=None, fake_classes=None, start_timeout=600,
+                 numpy_pipeline=False, tta_threshold=None, tta_margin=1.0, tta_step=2):
+        self.cfg_path = cfg_path
+        self.model_path = model_path
+        self.mmaction_root = mmaction_root
+        self.gpu_id = gpu_id
+        self.batch_size = batch_size
+        self.python_cmd = python_cmd if python_cmd else shlex.split(f'{osp.join(RESOURCES_ROOT, "run_in_env.bat")} python'.replace('\\', '/'))
+        self.fake_classes = fake_classes
+        self.start_timeout = start_timeout
+        self.numpy_pipeline = numpy_pipeline
+        self.tta_threshold = tta_threshold
+        self.tta_margin = tta_margin
+        self.tta_step = tta_step
+        self.authkey = os.urandom(16)
+        self.process = None
+        self.conn = None
+
+    def _command(self, port):
+        cmd = self.python_cmd + [WORKER_SCRIPT, '--port', str(port), '--batch_size', str(self.batch_size)]
+        if self.tta_threshold is not None:
+            cmd += ['--tta_threshold', str(self.tta_threshold), '--tta_margin', str(self.tta_margin), '--tta_step', str(self.tta_step)]
+        if self.fake_classes:
+            return cmd + ['--fake', str(self.fake_classes)]
+        cmd += ['--cfg', self.cfg_path, '--checkpoint', self.model_path, '--mmaction_root', self.mmaction_root]
+        cmd += ['--numpy_pipeline'] if self.numpy_pipeline else []
+        return cmd + (['--gpu', str(self.gpu_id)] if self.gpu_id is not None else [])
+
+    def start(self):
+        port = free_port()
+        cmd = self._command(port)
+        logger.info(f'Starting inference worker: {" ".join(cmd)}')
+        self.process = subprocess.Popen(cmd, env=dict(os.environ, **{AUTHKEY_ENV: self.authkey.hex()}), cwd=self.mmaction_root)
+        deadline = time.time() + self.start_timeout
+        while self.conn is None:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Inference worker exited with code {self.process.returncode}')
+            if time.time() > deadline:
+                self.close()
+                raise TimeoutError('Inference worker did not start in time.')
+            try:
+                self.conn = Client(('127.0.0.1', port), authkey=self.authkey)
+            except ConnectionRefusedError:
+                time.sleep(0.5)
+        logger.info('Inference worker is ready.')
+        return self
+
+    def _request(self, msg):
+        self.conn.send(msg)
+        reply = self.conn.recv()
+        if 'error' in reply:
+            raise RuntimeError(f'Inference worker failed: {reply["error"]}')
+        return reply
+
+    def predict(self, windows):
+        reply = self._request({'cmd': 'predict', 'windows': list(windows)})
+        return reply['scores'], reply['clips']
+
+    def predict_many(self, named_windows):
+        names = list(named_windows.keys())
+        sizes = [len(named_windows[n]) for n in names]
+        scores, clips = self.predict([w for n in names for w in named_windows[n]])
+        bounds = np.cumsum([0] + sizes)
+        return {n: (scores[s:t], clips[s:t]) for n, s, t in zip(names, bounds[:-1], bounds[1:])}
+
+    def close(self):
+        try:
+            if self.conn is not None:
+                self._request({'cmd': 'shutdown'})
+                self.conn.close()
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.conn = None
+            if self.process is not None:
+                try:
+                    self.process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                self.process = None
+
+    def __enter__(self):
+        return self.start() if self.conn is None else self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,173 @@
+# Runs inside the OpenMMLab environment, so it may only import asdmotion modules that depend on numpy alone.
+import os
+import sys
+import zlib
+from argparse import ArgumentParser
+from multiprocessing.connection import Listener
+
+import numpy as np
+
+AUTHKEY_ENV = 'ASDMOTION_WORKER_AUTHKEY'
+
+
+def view_indices(clips, num_clips, views_per_clip):
+    # mmaction's pipeline stacks every flipped clip after all the original ones.
+    return np.concatenate([np.asarray(clips) + k * num_clips for k in range(views_per_clip)])
+
+
+class FakeModel:
+    def __init__(self, num_classes=2, num_clips=10, views_per_clip=2):
+        self.num_classes = num_classes
+        self.num_clips = num_clips
+        self.views_per_clip = views_per_clip
+
+    def _views(self, window):
+        rng = np.random.default_rng(zlib.crc32(str(window.get('segment_name', window.get('frame_dir'))).encode()))
+        s = rng.random(self.num_classes) + 0.2 * rng.random((self.num_clips * self.views_per_clip, self.num_classes))
+        return (s / s.sum(axis=1, keepdims=True)).astype(np.float32)
+
+    def views(self, windows, clips):
+        order = view_indices(clips, self.num_clips, self.views_per_clip)
+        return np.stack([self._views(w)[order] for w in windows]).reshape(len(windows), order.shape[0], self.num_classes)
+
+    def __call__(self, windows):
+        return [v.mean(axis=0) for v in self.views(windows, np.arange(self.num_clips))], [self.num_clips] * len(windows)
+
+
+class PoseC3DModel:
+    def __init__(self, cfg_path, checkpoint, gpu_id=None, batch_size=16, mmaction_root=None, numpy_pipeline=False):
+        if mmaction_root:
+            sys.path.insert(0, mmaction_root)
+        import torch
+        from mmcv import Config
+        from mmcv.runner import load_checkpoint
+        from mmaction.datasets.pipelines import Compose
+        from mmaction.models import build_model
+
+        cfg = Config.fromfile(cfg_path)
+        cfg.model.backbone.pretrained = None
+        self.torch = torch
+        self.device = torch.device(f'cuda:{gpu_id}' if gpu_id is not None and torch.cuda.is_available() else 'cpu')
+        self.model = build_model(cfg.model, train_cfg=None, test_cfg=cfg.get('test_cfg'))
+        load_checkpoint(self.model, checkpoint, map_location='cpu')
+        self.model = self.model.to(self.device).eval()
+        self.pipeline = Compose(cfg.data.test.pipeline)
+        steps = {step['type']: step for step in cfg.data.test.pipeline}
+        self.num_clips = steps['UniformSampleFrames'].get('num_clips', 1)
+        self.views_per_clip = 2 if steps['GeneratePoseTarget'].get('double', False) else 1
+        self.generator = None
+        if numpy_pipeline:
+            sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+            from asdmotion.pipeline.pose_target import PoseTargetGenerator
+            prefix, self.generator = PoseTargetGenerator.from_config(cfg.data.test.pipeline)
+            self.pipeline = Compose(prefix)
+        self.batch_size = batch_size
+
+    def _imgs(self, window, clips=None):
+        data = self.pipeline(dict(window, modality='Pose', start_index=0))
+        if self.generator is not None:
+            return self.torch.from_numpy(self.generator(data, clips))
+        if clips is None:
+            return data['imgs']
+        return data['imgs'][self.torch.from_numpy(view_indices(clips, self.num_clips, self.views_per_clip))]
+
+    def views(self, windows, clips):
+        # Every view is fed as its own sample, so the model returns its softmax scores unaveraged.
+        probs = []
+        for i in range(0, len(windows), self.batch_size):
+            batch = windows[i:i + self.batch_size]
+            imgs = self.torch.stack([self._imgs(w, clips) for w in batch])
+            with self.torch.no_grad():
+                out = self.model(imgs.reshape((-1, 1) + imgs.shape[2:]).to(self.device), return_loss=False)
+            probs.append(out.reshape(len(batch), imgs.shape[1], -1))
+        return np.concatenate(probs)
+
+    def __call__(self, windows):
+        scores = []
+        for i in range(0, len(windows), self.batch_size):
+            imgs = self.torch.stack([self._imgs(w) for w in windows[i:i + self.batch_size]]).to(self.device)
+            with self.torch.no_grad():
+                scores.extend(self.model(imgs, return_loss=False))
+        return scores, [self.num_clips] * len(windows)
+
+
+class AdaptiveTTA:
+    # Scores `step` clips (with their flips) at a time and records, per window, after how many clips the remaining ones
+    # could no longer move its mean across the threshold, or the running mean was at least `margin` away from it. The
+    # remaining clips are still scored, so every window reports the mean of all of them, as with full TTA.
+    def __init__(self, model, threshold, margin=1.0, step=2, positive=1):
+        self.model = model
+        self.threshold = threshold
+        self.margin = margin
+        self.step = step
+        self.positive = positive
+
+    def __call__(self, windows):
+        if len(windows) == 0:
+            return [], []
+        num_clips, views_per_clip = self.model.num_clips, self.model.views_per_clip
+        total = num_clips * views_per_clip
+        views = None
+        used = np.full(len(windows), num_clips, dtype=np.int64)
+        undecided = np.ones(len(windows), dtype=bool)
+        for start in range(0, num_clips, self.step):
+            clips = np.arange(start, min(start + self.step, num_clips))
+            order = view_indices(clips, num_clips, views_per_clip)
+            probs = self.model.views(windows, clips)
+            if views is None:
+                views = np.zeros((len(windows), total, probs.shape[-1]), dtype=probs.dtype)
+            views[:, order] = probs
+            scored = start + clips.shape[0]
+            pos, done = views[:, view_indices(np.arange(scored), num_clips, views_per_clip), self.positive].sum(axis=1), scored * views_per_clip
+            may_cross = (pos / total <= self.threshold) & ((pos + total - done) / total > self.threshold) & (np.abs(pos / done - self.threshold) < self.margin)
+            used[undecided & ~may_cross] = scored
+            undecided &= may_cross
+        return [v.mean(axis=0) for v in views], used.tolist()
+
+
+def serve(model, port):
+    authkey = bytes.fromhex(os.environ[AUTHKEY_ENV])
+    with Listener(('127.0.0.1', port), authkey=authkey) as listener:
+        while True:
+            with listener.accept() as conn:
+                while True:
+                    try:
+                        msg = conn.recv()
+                    except EOFError:
+                        break
+                    if msg['cmd'] == 'shutdown':
+                        conn.send({'ok': True})
+                        return
+                    try:
+                        if msg['cmd'] == 'predict':
+                            scores, clips = model(msg['windows'])
+                            conn.send({'scores': [np.asarray(s) for s in scores], 'clips': clips})
+                        else:
+                            conn.send({'ok': True})
+                    except Exception as e:
+                        conn.send({'error': repr(e)})
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--cfg', type=str)
+    parser.add_argument('--checkpoint', type=str)
+    parser.add_argument('--mmaction_root', type=str)
+    parser.add_argument('--gpu', type=int, default=None)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--numpy_pipeline', action='store_true', help='Build the heatmap volumes with asdmotion.pipeline.pose_target instead of mmaction.')
+    parser.add_argument('--tta_threshold', type=float, default=None, help='Enables adaptive test-time augmentation around this threshold.')
+    parser.add_argument('--tta_margin', type=float, default=1.0)
+    parser.add_argument('--tta_step', type=int, default=2)
+    parser.add_argument('--fake', type=int, default=None, help='Serve random scores for this many classes instead of loading PoseC3D.')
+    args = parser.parse_args()
+    if args.fake:
+        model = FakeModel(args.fake)
+    else:
+        # Adaptive TTA renders only the clips it scores, which mmaction's pipeline cannot do.
+        model = PoseC3DModel(args.cfg, args.checkpoint, gpu_id=args.gpu, batch_size=args.batch_size, mmaction_root=args.mmaction_root,
+                             numpy_pipeline=args.numpy_pipeline or args.tta_threshold is not None)
+    if args.tta_threshold is not None:
+        model = AdaptiveTTA(model, args.tta_threshold, margin=args.tta_margin, step=args.tta_step)
+    serve(model, args.port)
@@ -1,64 +1,120 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 from os import path as osp
 
 import numpy as np
 from mmcv import Config
 
 from asdmotion.child_detector.child_detector import ChildDetector
+from asdmotion.child_detector.detections import read_detections, legacy_detections_path
+from asdmotion.detector.detector import tta_clips_path
 from asdmotion.logger import LogManager
+from asdmotion.pipeline.artifact_cache import ArtifactCache
+from asdmotion.pipeline.frame_bus import FrameBus
 from asdmotion.pipeline.openpose_executor import OpenposeInitializer
 from asdmotion.pipeline.skeleton_layout import BODY_25_LAYOUT, COCO_LAYOUT
-from asdmotion.pipeline.splitter import Splitter
-from asdmotion.utils import read_pkl, write_pkl, get_video_properties, init_directories, create_config, save_config, RESOURCES_ROOT
+from asdmotion.pipeline.skeleton_store import read_skeleton, write_skeleton, resolve_skeleton_path
+from asdmotion.pipeline.window_dataset import WindowDataset, read_skipped
+from asdmotion.utils import get_video_properties, set_frame_count, init_directories, create_config, save_config, load_config, file_fingerprint, RESOURCES_ROOT
 
 CFG_DIR = osp.join(RESOURCES_ROOT, 'mmaction_template')
 logger = LogManager.APP_LOGGER
+MATCH_PARAMS = {'iou_threshold': 0.01, 'conf_threshold': 0.1, 'similarity_threshold': 0.85, 'grace_distance': 20, 'tolerance': 200}
+# Per-video outputs that are derived from the windows dataset.
+DATASET_OUTPUTS = ['ann_file_path', 'predictions_path', 'scores_path', 'annotations_path', 'conclusion_path']
+ARTIFACT_PATHS = {'raw_skeleton': 'raw_skeleton_path', 'detections': 'detections_path', 'skeleton': 'skeleton_path', 'dataset': 'dataset_path'}
 
 class VideoTransformer:
-    def __init__(self, work_dir, binary_model_name, openpose_root, detect_child, sequence_length, step_size, gpu_id, num_person_in, num_person_out):
+    def __init__(self, work_dir, binary_model_name, openpose_root, detect_child, sequence_length, step_size, gpu_id, num_person_in, num_person_out, frame_ingestion='img_dir',
+                 openpose_shards=1, detection_stride=1, frame_queue_size=16, min_valid_ratio=0.0,
+                 artifact_cache_path=None):
         self.default_cfgs = {
             'binary': osp.join(CFG_DIR, 'binary_cfg_template.py'),
         }
         self.work_dir = osp.join(work_dir)
         self.gpu_id = gpu_id
         self.initializer = OpenposeInitializer(sequence_length=sequence_length, num_person_in=num_person_in, num_person_out=num_person_out,
-                                               open_pose_path=openpose_root, as_img_dir=True, gpu_id=self.gpu_id)
+                                               open_pose_path=openpose_root, gpu_id=self.gpu_id, ingestion=frame_ingestion,
+                                               num_shards=openpose_shards, stream_json=True)
+        self.frame_queue_size = frame_queue_size
+        self.min_valid_ratio = min_valid_ratio
+        self.artifacts = ArtifactCache(artifact_cache_path) if artifact_cache_path else None
         self.binary_model_name, self.detect_child, self.sequence_length, self.step_size = binary_model_name, detect_child, sequence_length, step_size
         if self.detect_child:
-            self.child_detector = ChildDetector(device=self.gpu_id)
+            self.child_detector = ChildDetector(device=self.gpu_id, stride=detection_stride)
+
+    def _decode_video(self, video_info, skeleton_needed, detections_needed):
+        video_path = video_info['video_path']
+        bus = FrameBus(video_path, queue_size=self.frame_queue_size)
+        pose_frames = bus.subscribe() if skeleton_needed and self.initializer.accepts_frames() else None
+        detector_frames = bus.subscribe() if detections_needed else None
+        if len(bus.subscriptions) > 0:
+            bus.start()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            skeleton_job = pool.submit(self.initializer.prepare_skeleton, video_path, frames=pose_frames,
+                                       frame_index_path=video_info['frame_index_path']) if skeleton_needed else None
+            detections_job = pool.submit(self.child_detector.detect, video_path, frames=detector_frames) if detections_needed else None
+            try:
+                skeleton_json = skeleton_job.result() if skeleton_job else None
+                detections = detections_job.result() if detections_job else None
+            except Exception:
+                bus.stop()
+                raise
+        if len(bus.subscriptions) > 0:
+            bus.join()
+            self._resolve_frame_count(video_info, bus.frame_count)
+        return skeleton_json, detections
+
+    @staticmethod
+    def _resolve_frame_count(video_info, counted=None):
+        if video_info['properties']['frame_count'] is not None:
+            return
+        video_path = video_info['video_path']
+        properties = set_frame_count(video_path, counted) if counted else get_video_properties(video_path)
+        video_info['properties']['frame_count'], video_info['properties']['length'] = properties[2], properties[3]
 
     def _create_skeleton(self, video_info):
         video_path = video_info['video_path']
-        skeleton_path = video_info['skeleton_path']
-        raw_path = video_info['raw_skeleton_path']
-        if osp.exists(skeleton_path):
+        skeleton_path = resolve_skeleton_path(video_info['skeleton_path'])
+        raw_path = resolve_skeleton_path(video_info['raw_skeleton_path'])
+        if skeleton_path is not None:
             logger.info(f'Skeleton already exists: {skeleton_path}')
-            skeleton = read_pkl(skeleton_path)
+            skeleton = read_skeleton(skeleton_path)
+            self._resolve_frame_count(video_info)
         else:
-            if osp.exists(raw_path):
+            detections_path = video_info['detections_path'] if self.detect_child else None
+            detections_exist = self.detect_child and (osp.exists(detections_path) or osp.exists(legacy_detections_path(detections_path)))
+            if raw_path is not None:
                 logger.info(f'Raw skeleton already exists: {raw_path}')
-                skeleton = read_pkl(raw_path)
             else:
-                logger.info(f'Initializing new skeleton: {skeleton_path}')
-                skeleton_json = self.initializer.prepare_skeleton(video_path)
+                logger.info(f'Initializing new skeleton: {video_info["skeleton_path"]}')
+            if self.detect_child and not detections_exist:
+                logger.info(f'Child detection in process: {video_path} , {video_info["skeleton_path"]}')
+            skeleton_json, detections = self._decode_video(video_info, raw_path is None, self.detect_child and not detections_exist)
+            self._resolve_frame_count(video_info)
+            if raw_path is not None:
+                skeleton = read_skeleton(raw_path)
+            else:
                 skeleton = self.initializer.to_poseC3D(skeleton_json,
                                                        in_layout=BODY_25_LAYOUT, out_layout=COCO_LAYOUT)
-                write_pkl(skeleton, raw_path)
+                write_skeleton(skeleton, video_info['raw_skeleton_path'])
+                self._record(video_info, 'raw_skeleton')
             if self.detect_child:
-                detections_path = video_info['detections_path']
-                if osp.exists(detections_path):
+                if detections_exist:
                     logger.info(f'Detections already exists: {detections_path}')
-                    detections = read_pkl(detections_path)
+                    detections = read_detections(detections_path)
                 else:
-                    logger.info(f'Child detection in process: {video_path} , {skeleton_path}')
-                    detections = self.child_detector.detect(video_path)
-                    write_pkl(detections, detections_path)
-                logger.info(f'Child detection - skeleton match in process: {video_path} , {skeleton_path}')
-                skeleton = self.child_detector.match_skeleton(skeleton, detections, tolerance=200)
+                    detections.save(detections_path)
+                    self._record(video_info, 'detections')
+                logger.info(f'Child detection - skeleton match in process: {video_path} , {video_info["skeleton_path"]}')
+                skeleton = self.child_detector.match_skeleton(skeleton, detections, **MATCH_PARAMS)
             else:
                 T = video_info['properties']['frame_count']
                 skeleton['child_ids'] = -np.ones(T)
                 skeleton['child_detected'] = np.zeros(T)
                 skeleton['child_bbox'] = np.zeros((T, 4))
+            write_skeleton(skeleton, video_info['skeleton_path'])
+            self._record(video_info, 'skeleton')
         cids = skeleton['child_ids']
         if np.all(cids == -1):
             raise ValueError(f'No children detected in {video_info["name"]}')
@@ -66,7 +122,6 @@ class VideoTransformer:
         last_valid_frame = int(np.where(cids != -1)[0][-1])
         video_info['properties']['valid_frames'] = valid_frames
         video_info['properties']['last_valid_frame'] = last_valid_frame
-        write_pkl(skeleton, skeleton_path)
         return skeleton
 
     def prepare_dataset(self, video_info):
@@ -75,13 +130,21 @@ class VideoTransformer:
 
         logger.info(f'Creating new skeleton for {basename}')
         skeleton = self._create_skeleton(video_info)
+        if self.artifacts is not None and self.artifacts.contains(video_info['artifacts']['dataset']['key']):
+            logger.info(f'Dataset already exists: {dataset_output}')
+            skipped = read_skipped(dataset_output)
+            video_info['properties']['skipped_frames'] = int((skipped[:, 1] - skipped[:, 0]).sum())
+            return
         logger.info('Writing Dataset.')
-        dataset = Splitter(skeleton, sequence_length=self.sequence_length, step_size=self.step_size, min_length=self.step_size*2).collect()
-        out = {
-            'split': {'test1': [f'{x["frame_dir"]}' for x in dataset]},
-            'annotations': dataset
-        }
-        write_pkl(out, dataset_output)
+        dataset = WindowDataset.from_skeleton(skeleton, sequence_length=self.sequence_length, step_size=self.step_size, min_length=self.step_size*2,
+                                              min_valid_ratio=self.min_valid_ratio)
+        if dataset.skipped.shape[0] > 0:
+            logger.info(f'Skipping {dataset.skipped_frames} frames in {dataset.skipped.shape[0]} spans without a matched child.')
+        video_info['properties']['skipped_frames'] = dataset.skipped_frames
+        dataset.save(dataset_output)
+        self._record(video_info, 'dataset')
+        if osp.exists(video_info['ann_file_path']):
+            os.remove(video_info['ann_file_path'])
         logger.info('Data initialized successfully.')
 
     def init_cfg(self, video_info, name, ann_file, model_type):
@@ -97,22 +160,103 @@ class VideoTransformer:
         cfg = ''.join(lines)
         with open(video_info[f'{model_type}_cfg_path'], 'w') as f:
             f.write(cfg)
+
+    def _artifact_specs(self):
+        # (kind, params, input kinds, extension) of every preprocessing artifact, in dependency order.
+        specs = [('raw_skeleton', {'openpose': self.initializer.open_pose_path, 'openpose_bin': self.initializer.openpose_bin, 'layout': 'COCO',
+                                   'num_person_in': self.initializer.num_person_in, 'num_person_out': self.initializer.num_person_out}, ['video'], '')]
+        if self.detect_child:
+            d = self.child_detector
+            specs.append(('detections', {'model': file_fingerprint(d.model_path), 'size': d.size, 'stride': d.stride, 'track_iou': d.track_iou,
+                                         'track_confidence': d.track_confidence}, ['video'], '.npz'))
+            specs.append(('skeleton', dict(MATCH_PARAMS, detect_child=True), ['raw_skeleton', 'detections'], ''))
+        else:
+            specs.append(('skeleton', {'detect_child': False}, ['raw_skeleton'], ''))
+        specs.append(('dataset', {'sequence_length': self.sequence_length, 'step_size': self.step_size, 'min_length': self.step_size * 2,
+                                  'min_valid_ratio': self.min_valid_ratio}, ['skeleton'], ''))
+        return specs
+
+    def _use_artifacts(self, video_info):
+        # Points the preprocessing paths at content-addressed artifacts, so they are shared by every video with the same
+        # content and rebuilt exactly when the video or a parameter they depend on changes.
+        artifacts = {'video': file_fingerprint(video_info['video_path'])}
+        self.artifacts.record(artifacts['video'], 'video', video_info['video_path'], {}, source=video_info['video_path'])
+        keys = {'video': artifacts['video']}
+        for kind, params, inputs, ext in self._artifact_specs():
+            keys[kind] = self.artifacts.key(kind, params, [keys[i] for i in inputs])
+            artifacts[kind] = {'key': keys[kind], 'params': params, 'inputs': [keys[i] for i in inputs]}
+            video_info[ARTIFACT_PATHS[kind]] = self.artifacts.path(kind, keys[kind], ext)
+            if not self.artifacts.contains(keys[kind]):
+                self.artifacts.discard(video_info[ARTIFACT_PATHS[kind]])
+        video_info['artifacts'] = artifacts
+        # Outputs of an earlier run of this video on a different dataset (other parameters) are stale.
+        previous = load_config(video_info['self_path']).get('artifacts') if osp.exists(video_info['self_path']) else None
+        if previous is None or previous.get('dataset', {}).get('key') != keys['dataset']:
+            for p in [video_info[k] for k in DATASET_OUTPUTS] + [tta_clips_path(video_info['predictions_path'])]:
+                if osp.exists(p):
+                    logger.info(f'Removing stale output: {p}')
+                    os.remove(p)
+
+    def _record(self, video_info, kind):
+        if self.artifacts is not None:
+            spec = video_info['artifacts'][kind]
+            self.artifacts.record(spec['key'], kind, video_info[ARTIFACT_PATHS[kind]], dict(spec['params']), list(spec['inputs']), source=video_info['video_path'])
+
+    def create_skeleton_raw(self, video_info):
+        # Pose stage of the batch runner. Decodes the video on its own rather than sharing the frames with the child detector.
+        if resolve_skeleton_path(video_info['skeleton_path']) is not None or resolve_skeleton_path(video_info['raw_skeleton_path']) is not None:
+            return
+        logger.info(f'Initializing new skeleton: {video_info["skeleton_path"]}')
+        skeleton_json = self.initializer.prepare_skeleton(video_info['video_path'], frame_index_path=video_info['frame_index_path'])
+        write_skeleton(self.initializer.to_poseC3D(skeleton_json, in_layout=BODY_25_LAYOUT, out_layout=COCO_LAYOUT), video_info['raw_skeleton_path'])
+        self._record(video_info, 'raw_skeleton')
+
+    def create_detections(self, video_info):
+        # Child detection stage of the batch runner.
+        if not self.detect_child or resolve_skeleton_path(video_info['skeleton_path']) is not None:
+            return
+        detections_path = video_info['detections_path']
+        if osp.exists(detections_path) or osp.exists(legacy_detections_path(detections_path)):
+            return
+        logger.info(f'Child detection in process: {video_info["video_path"]}')
+        self.child_detector.detect(video_info['video_path']).save(detections_path)
+        self._record(video_info, 'detections')
+
+    def finalize_environment(self, video_info):
+        self.prepare_dataset(video_info)
+        save_config(video_info, video_info['self_path'])
+        return video_info
+
     def prepare_environment(self, video_path):
+        return self.finalize_environment(self.create_environment(video_path))
+
+    def video_work_dir(self, video_path):
+        name = osp.splitext(osp.basename(video_path))[0]
+        # With the artifact cache, different videos that share a file name get separate work dirs.
+        return osp.join(self.work_dir, name if self.artifacts is None else f'{name}_{file_fingerprint(video_path)[:8]}')
+
+    def frame_index_path(self, video_path):
+        return osp.join(self.video_work_dir(video_path), f'{osp.splitext(osp.basename(video_path))[0]}_frames.npz')
+
+    def create_environment(self, video_path):
         fullname = osp.basename(video_path)
         name, ext = osp.splitext(fullname)
-        work_dir = osp.join(self.work_dir, name)
+        work_dir = self.video_work_dir(video_path)
         jordi_dir = osp.join(work_dir, 'asdmotion')
         model_dir = osp.join(jordi_dir, self.binary_model_name)
-        resolution, fps, frame_count, length = get_video_properties(video_path)
+        frame_index_path = self.frame_index_path(video_path)
+        resolution, fps, frame_count, length = get_video_properties(video_path, count_frames=False, frame_index_path=frame_index_path)
         video_info = {
             'name': name,
             'fullname': fullname,
             'video_path': video_path,
             'work_dir': work_dir,
             'jordi_dir': jordi_dir,
-            'skeleton_path': osp.join(jordi_dir, f'{name}.pkl'),
-            'raw_skeleton_path': osp.join(jordi_dir, f'{name}_raw.pkl'),
-            'dataset_path': osp.join(model_dir, f'{name}_dataset_{self.sequence_length}.pkl'),
+            'skeleton_path': osp.join(jordi_dir, f'{name}.skeleton'),
+            'raw_skeleton_path': osp.join(jordi_dir, f'{name}_raw.skeleton'),
+            'frame_index_path': frame_index_path,
+            'dataset_path': osp.join(model_dir, f'{name}_dataset_{self.sequence_length}.windows'),
+            'ann_file_path': osp.join(model_dir, f'{name}_dataset_{self.sequence_length}.pkl'),
             'binary_cfg_path':  osp.join(model_dir, f'{name}_binary_config.py'),
             'annotations_path': osp.join(model_dir, f'{name}_annotations.csv'),
             'conclusion_path': osp.join(model_dir, f'{name}_conclusion.csv'),
@@ -128,10 +272,10 @@ class VideoTransformer:
         }
         if self.detect_child:
             video_info['child_detect'] = True
-            video_info['detections_path'] = osp.join(work_dir, f'{name}_detections.pkl')
+            video_info['detections_path'] = osp.join(work_dir, f'{name}_detections.npz')
         init_directories(work_dir, jordi_dir, model_dir)
+        if self.artifacts is not None:
+            self._use_artifacts(video_info)
         video_info = create_config(video_info)
-        self.init_cfg(video_info, name, video_info['dataset_path'], 'binary')
-        self.prepare_dataset(video_info)
-        save_config(video_info, video_info['self_path'])
+        self.init_cfg(video_info, name, video_info['ann_file_path'], 'binary')
         return video_info
@@ -0,0 +1,86 @@
+import os
+import time
+import uuid
+from os import path as osp
+
+import pandas as pd
+
+TABLES = ['scores', 'annotations', 'conclusions']
+PARTITIONS = ['assessment', 'model']
+CONCLUSION_METRICS = ['smm_count', 'smm_length_minute', 'smm_proportion', 'smm/min', 'skipped_frames', 'video_length_minute', 'valid_frames']
+UNKNOWN = 'unknown'
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError('The results store requires pyarrow (pip install pyarrow).') from e
+    return pa, ds, pq
+
+
+def assessment_of(video_name):
+    # Video names are <assessment>_<x>_<y>. Conclusions and the store's partitions both use this.
+    return '_'.join(video_name.split('_')[:-2]) or UNKNOWN
+
+
+class ResultsStore:
+    # Append-only Parquet tables under root/<table>/assessment=<assessment>/model=<model>/. Every write adds a new file;
+    # re-annotated videos are resolved at read time by keeping their latest write.
+    def __init__(self, root):
+        _pyarrow()
+        self.root = root
+
+    def _partition_dir(self, table, assessment, model):
+        return osp.join(self.root, table, f'assessment={assessment}', f'model={model}')
+
+    def append(self, table, df, assessment, model, written_at=None):
+        if table not in TABLES:
+            raise ValueError(f'Unknown results table: {table}')
+        pa, _, pq = _pyarrow()
+        df = df.drop(columns=[c for c in PARTITIONS if c in df.columns])
+        if 'calc_date' in df.columns:
+            df['calc_date'] = pd.to_datetime(df['calc_date'])
+        if 'movement' in df.columns:
+            df['movement'] = df['movement'].astype(str)
+        df['written_at'] = pd.Timestamp.now() if written_at is None else written_at
+        out_dir = self._partition_dir(table, assessment, model)
+        os.makedirs(out_dir, exist_ok=True)
+        out_path = osp.join(out_dir, f'part-{time.time_ns()}-{uuid.uuid4().hex}.parquet')
+        # Written under a temporary name so readers never see a partial file.
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), f'{out_path}.tmp')
+        os.replace(f'{out_path}.tmp', out_path)
+        return out_path
+
+    def append_video(self, video_name, model, scores=None, annotations=None, conclusion=None):
+        assessment, written_at = assessment_of(video_name), pd.Timestamp.now()
+        for table, df in zip(TABLES, [scores, annotations, conclusion]):
+            if df is not None:
+                self.append(table, df, assessment, model, written_at=written_at)
+
+    def read(self, table, columns=None, assessments=None, models=None, latest=False):
+        # With latest, only the rows of the last write of every (video, model) are kept.
+        pa, ds, _ = _pyarrow()
+        table_dir = osp.join(self.root, table)
+        if not osp.isdir(table_dir):
+            return pd.DataFrame(columns=columns)
+        partitioning = ds.partitioning(pa.schema([(p, pa.string()) for p in PARTITIONS]), flavor='hive')
+        dataset = ds.dataset(table_dir, format='parquet', partitioning=partitioning, exclude_invalid_files=True)
+        condition = None
+        for field, values in zip(PARTITIONS, [assessments, models]):
+            if values is not None:
+                c = ds.field(field).isin(list(values))
+                condition = c if condition is None else condition & c
+        read_columns = columns if columns is None or not latest else list(dict.fromkeys(list(columns) + ['video', 'model', 'written_at']))
+        df = dataset.to_table(columns=read_columns, filter=condition).to_pandas()
+        if latest:
+            df = df[df['written_at'] == df.groupby(['video', 'model'])['written_at'].transform('max')]
+            df = df[columns] if columns is not None else df
+        return df.reset_index(drop=True)
+
+    def cohort_conclusions(self, metrics=CONCLUSION_METRICS, assessments=None, models=None):
+        # One row per (video, model) with its latest conclusion, reading only the requested metric columns.
+        df = self.read('conclusions', columns=['video'] + PARTITIONS + list(metrics), assessments=assessments, models=models, latest=True)
+        return df.sort_values(['assessment', 'video', 'model']).reset_index(drop=True)
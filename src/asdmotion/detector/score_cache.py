@@ -0,0 +1,69 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+WINDOW_KEY_FIELDS = ['keypoint', 'keypoint_score', 'child_ids', 'child_detected', 'img_shape', 'original_shape', 'total_frames']
+# Lines that init_cfg fills in per video and that do not affect the scores.
+CFG_VOLATILE_PREFIXES = ('ann_file = ', 'gpu_ids = ', 'work_dir = ')
+
+
+def cfg_fingerprint(cfg_path):
+    with open(cfg_path) as f:
+        lines = [line for line in f.readlines() if not line.startswith(CFG_VOLATILE_PREFIXES)]
+    return hashlib.sha1(''.join(lines).encode()).hexdigest()
+
+
+def window_key(window, context):
+    # Names and frame offsets are left out, so renamed videos and re-split windows hit the cache.
+    h = hashlib.sha1(context.encode())
+    for k in WINDOW_KEY_FIELDS:
+        if k in window:
+            v = np.ascontiguousarray(window[k])
+            h.update(f'{k}:{v.dtype.str}:{v.shape}'.encode())
+            h.update(v.tobytes())
+    return h.hexdigest()
+
+
+class ScoreCache:
+    def __init__(self, path, max_entries=1000000):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, scores BLOB, clips INTEGER, used REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS scores_used ON scores (used)')
+        self.conn.commit()
+
+    def get_many(self, keys, chunk_size=500):
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self.lock:
+            for i in range(0, len(keys), chunk_size):
+                chunk = keys[i:i + chunk_size]
+                marks = ','.join('?' * len(chunk))
+                for key, scores, clips in self.conn.execute(f'SELECT key, scores, clips FROM scores WHERE key IN ({marks})', chunk):
+                    found[key] = (np.frombuffer(scores, dtype=np.float32).copy(), clips)
+                self.conn.execute(f'UPDATE scores SET used = ? WHERE key IN ({marks})', [time.time()] + chunk)
+            self.conn.commit()
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        rows = [(k, np.asarray(s, dtype=np.float32).tobytes(), None if c is None else int(c), now) for k, (s, c) in items.items()]
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)', rows)
+            excess = self.conn.execute('SELECT COUNT(*) FROM scores').fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute('DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY used LIMIT ?)', (excess,))
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
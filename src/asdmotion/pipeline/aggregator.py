@@ -1,64 +1,190 @@
 import numpy as np
 import pandas as pd
 
+SEGMENT_COLUMNS = ['video', 'video_full_name', 'video_path', 'start_time', 'end_time', 'start_frame', 'end_frame', 'movement', 'calc_date', 'annotator',
+                   'stereotypical_score']
+NOACTION, STEREOTYPICAL, NOCHILD = 0, 1, 2
+MOVEMENTS = np.array(['NoAction', 'Stereotypical', 'NoChild'], dtype=object)
+
+
+def run_bounds(codes, groups=None):
+    # First and last row of every run of equal codes. Runs never span two groups.
+    n = codes.shape[0]
+    change = np.ones(n, dtype=bool)
+    change[1:] = codes[1:] != codes[:-1]
+    if groups is not None:
+        change[1:] |= groups[1:] != groups[:-1]
+    firsts = np.flatnonzero(change)
+    return firsts, np.concatenate([firsts[1:], [n]]).astype(np.int64) - 1
+
+
+def chain_ends(link):
+    # Last row reached from every row by following links two rows at a time.
+    ends = np.arange(link.shape[0])
+    for p in (0, 1):
+        seq = link[p::2]
+        first_false = np.minimum.accumulate(np.where(seq, seq.shape[0], np.arange(seq.shape[0]))[::-1])[::-1]
+        ends[p::2] = p + 2 * first_false
+    return ends
+
+
+def group_sums(values, firsts, lasts, step=1):
+    # Sums values[f], values[f + step], ..., values[l] for every (f, l) pair.
+    if firsts.shape[0] == 0:
+        return np.zeros(0)
+    counts = (lasts - firsts) // step + 1
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    members = np.repeat(firsts, counts) + step * (np.arange(counts.sum()) - np.repeat(offsets, counts))
+    return np.add.reduceat(values[members], offsets)
+
+
+def _group_edges(groups):
+    firsts, lasts = run_bounds(groups)
+    sizes = lasts - firsts + 1
+    return np.repeat(firsts, sizes), np.repeat(lasts, sizes)
+
+
+def unify_bounds(start_frame, end_frame, stereotypical, group_last):
+    # A stereotypical segment absorbs the segment two rows later while they overlap. The last row of a group is never absorbed.
+    n = start_frame.shape[0]
+    idx = np.arange(n)
+    link = np.zeros(n, dtype=bool)
+    r = idx[:max(n - 2, 0)]
+    link[r] = (r + 2 < group_last[r]) & (start_frame[r + 2] < end_frame[r])
+    ends = chain_ends(link)
+    # Rows swallowed by an earlier chain are skipped. Which chains start depends on the earlier ones, so the set is refined to
+    # its fixed point; each pass settles at least one more stereotypical row.
+    started = stereotypical.copy()
+    while True:
+        cover = np.concatenate([[-1], np.maximum.accumulate(np.where(started, ends, -1))[:-1]])
+        refined = stereotypical & (idx > cover)
+        if np.array_equal(refined, started):
+            break
+        started = refined
+    firsts = np.flatnonzero(idx > cover)
+    return firsts, np.where(stereotypical[firsts], ends[firsts], firsts)
+
+
+def _unify(start_time, end_time, start_frame, end_frame, stereotypical, score, groups):
+    group_first, group_last = _group_edges(groups)
+    firsts, lasts = unify_bounds(start_frame, end_frame, stereotypical, group_last)
+    merged = stereotypical[firsts]
+    inner = firsts < group_last[firsts]
+    nxt = np.minimum(firsts + 1, start_frame.shape[0] - 1)
+    _end_time = np.where(merged, end_time[lasts], np.where(inner, start_time[nxt], end_time[firsts]))
+    _end_frame = np.where(merged, end_frame[lasts], np.where(inner, start_frame[nxt], end_frame[firsts]))
+    # Other segments fill the gap between the previous output segment and the next input segment.
+    gap = ~merged & (firsts > group_first[firsts])
+    _start_time, _start_frame = start_time[firsts].copy(), start_frame[firsts].copy()
+    _start_time[gap], _start_frame[gap] = np.roll(_end_time, 1)[gap], np.roll(_end_frame, 1)[gap]
+    lengths = (end_frame - start_frame).astype(np.float64)
+    _score = score[firsts].copy()
+    _score[merged] = group_sums(lengths * score, firsts[merged], lasts[merged], step=2) / group_sums(lengths, firsts[merged], lasts[merged], step=2)
+    return firsts, {'start_time': _start_time, 'end_time': _end_time, 'start_frame': _start_frame, 'end_frame': _end_frame, 'stereotypical_score': _score}
+
 
 def unify(df):
-    _df = pd.DataFrame(columns=df.columns)
-
-    def calc_weighted_mean_score(rows):
-        weights = [(row['end_frame'] - row['start_frame']) / (rows[-1]['end_frame'] - rows[0]['start_frame']) for row in rows]
-        scores = [row['stereotypical_score'] for row in rows]
-        return np.average(scores, weights=weights)
-
-    n = df.shape[0]
-    i = 0
-    while i < n:
-        curr = df.iloc[i]
-        if curr['movement'] == 'Stereotypical':
-            merge = [curr]
-            j = i + 2
-            while j < df.shape[0] - 1:
-                next_row = df.iloc[j]
-                if next_row['start_frame'] < curr['end_frame']:
-                    merge.append(next_row)
-                    curr = next_row
-                    j += 2
-                    i += 2
-                else:
-                    break
-            _df.loc[_df.shape[0]] = [merge[0]['video'], merge[0]['video_full_name'], merge[0]['video_path'], merge[0]['start_time'], merge[-1]['end_time'], merge[0]['start_frame'], merge[-1]['end_frame'],
-                                     merge[0]['movement'], merge[0]['calc_date'], merge[0]['annotator'], calc_weighted_mean_score(merge)]
-        else:
-            start_time = _df.iloc[_df.shape[0] - 1]['end_time'] if i > 0 else curr['start_time']
-            end_time = df.iloc[i + 1]['start_time'] if i < n - 1 else curr['end_time']
-            start_frame = _df.iloc[_df.shape[0] - 1]['end_frame'] if i > 0 else curr['start_frame']
-            end_frame = df.iloc[i + 1]['start_frame'] if i < n - 1 else curr['end_frame']
-            _df.loc[_df.shape[0]] = [curr['video'], curr['video_full_name'], curr['video_path'], start_time, end_time, start_frame, end_frame,
-                                     curr['movement'], curr['calc_date'], curr['annotator'], curr['stereotypical_score']]
-        i += 1
+    if df.shape[0] == 0:
+        return pd.DataFrame(columns=df.columns)
+    firsts, values = _unify(df['start_time'].to_numpy(), df['end_time'].to_numpy(), df['start_frame'].to_numpy(), df['end_frame'].to_numpy(),
+                            (df['movement'] == 'Stereotypical').to_numpy(), df['stereotypical_score'].to_numpy(dtype=np.float64),
+                            np.zeros(df.shape[0], dtype=np.int64))
+    _df = df.iloc[firsts].reset_index(drop=True)
+    for k, v in values.items():
+        _df[k] = v
+    return _df
+
+
+def _run_bounds_for(score, nochild, thresholds):
+    # Windows i and i + 1 fall in different runs exactly for the thresholds in [lo, hi), so the runs of all (ascending)
+    # thresholds are read off the window pairs without thresholding every window again.
+    n, k = score.shape[0], thresholds.shape[0]
+    score = np.where(np.isnan(score), -np.inf, score)
+    lo, hi = np.minimum(score[:-1], score[1:]), np.maximum(score[:-1], score[1:])
+    either = nochild[:-1] | nochild[1:]
+    lo = np.where(either, np.where(nochild[:-1] != nochild[1:], -np.inf, np.inf), lo)
+    hi = np.where(either, np.inf, hi)
+    a, b = np.searchsorted(thresholds, lo, side='left'), np.searchsorted(thresholds, hi, side='left')
+    counts = np.maximum(b - a, 0)
+    groups = np.concatenate([np.arange(k), np.repeat(a, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)])
+    windows = np.concatenate([np.zeros(k, dtype=np.int64), np.repeat(np.arange(1, n), counts)])
+    order = np.lexsort((windows, groups))
+    groups, firsts = groups[order], windows[order]
+    lasts = np.concatenate([firsts[1:], [n]]) - 1
+    lasts[np.concatenate([groups[1:] != groups[:-1], [True]])] = n - 1
+    return firsts, lasts, groups
+
+
+def _segments(df, thresholds):
+    # Aggregates and unifies the windows for every threshold at once; each threshold is a separate group of runs.
+    score = df['stereotypical_score'].to_numpy(dtype=np.float64)
+    nochild = (df['movement'] == 'NoChild').to_numpy()
+    window_first, window_last, run_groups = _run_bounds_for(score, nochild, thresholds)
+    run_codes = np.where(nochild[window_first], NOCHILD, score[window_first] > thresholds[run_groups])
+    # Run means come from one prefix sum shared by all thresholds.
+    cumulative = np.concatenate([[0], np.cumsum(np.where(np.isnan(score), 0, score))])
+    means = (cumulative[window_last + 1] - cumulative[window_first]) / (window_last - window_first + 1)
+    means[run_codes == NOCHILD] = np.nan
+    start_frame, end_frame = df['start_frame'].to_numpy(), df['end_frame'].to_numpy()
+    start_time, end_time = df['start_time'].to_numpy(), df['end_time'].to_numpy()
+    rows, values = _unify(start_time[window_first], end_time[window_last], start_frame[window_first], end_frame[window_last],
+                          run_codes == STEREOTYPICAL, means, run_groups)
+    return window_first[rows], run_codes[rows], run_groups[rows], values
+
+
+def _frame(df, windows, codes, values):
+    _df = df.iloc[windows].reset_index(drop=True)
+    for k, v in values.items():
+        _df[k] = v
+    _df['movement'] = MOVEMENTS[codes]
+    _df['calc_date'] = pd.Timestamp.now()
     return _df
 
 
 def aggregate(df, threshold):
-    _df = pd.DataFrame(columns=df.columns)
-    df['prediction'] = np.where(df['stereotypical_score'] > threshold, 'Stereotypical', 'NoAction')
-    i = 0
-    while i < df.shape[0]:
-        r = df.iloc[i]
-        s, t, c, p = r['start_frame'], r['end_frame'], r['stereotypical_score'], r['prediction']
-        _s, _t = r['start_time'], r['end_time']
-        score = [c]
-        j = i + 1
-        while j < df.shape[0]:
-            rr = df.iloc[j]
-            ss, tt, cc, pp = rr['start_frame'], rr['end_frame'], rr['stereotypical_score'], rr['prediction']
-            if p == pp:
-                t = tt
-                _t = rr['end_time']
-                score.append(cc)
-            else:
-                break
-            j += 1
-        _df.loc[_df.shape[0]] = [r['video'], r['video_full_name'], r['video_path'], _s, _t, s, t, p, pd.Timestamp.now(), NET_NAME, np.mean(score)]
-        i = j
-    return unify(_df)
+    columns = list(df.columns)
+    df['prediction'] = np.where(df['movement'] == 'NoChild', 'NoChild', np.where(df['stereotypical_score'] > threshold, 'Stereotypical', 'NoAction'))
+    if df.shape[0] == 0:
+        return pd.DataFrame(columns=columns)
+    windows, codes, _, values = _segments(df, np.array([threshold], dtype=np.float64))
+    return _frame(df[columns], windows, codes, values)
+
+
+def _cuts(df, thresholds):
+    # Thresholds that fall between the same pair of sorted scores give identical predictions, so each distinct cut is
+    # aggregated once. Returns one representative threshold per cut and the cut of every requested threshold.
+    score = df['stereotypical_score'].to_numpy(dtype=np.float64)
+    sorted_scores = np.sort(score[~np.isnan(score)])
+    _, first_threshold, inverse = np.unique(np.searchsorted(sorted_scores, thresholds, side='right'), return_index=True, return_inverse=True)
+    return thresholds[first_threshold], inverse.reshape(-1)
+
+
+def aggregate_thresholds(df, thresholds):
+    # Same segments as calling aggregate once per threshold, stacked with a 'threshold' column.
+    thresholds = np.asarray(thresholds, dtype=np.float64).reshape(-1)
+    if df.shape[0] == 0 or thresholds.shape[0] == 0:
+        return pd.DataFrame(columns=list(df.columns) + ['threshold'])
+    cuts, inverse = _cuts(df, thresholds)
+    windows, codes, groups, values = _segments(df, cuts)
+    counts = np.bincount(groups, minlength=cuts.shape[0])
+    offsets = np.cumsum(counts) - counts
+    sizes = counts[inverse]
+    take = np.repeat(offsets[inverse], sizes) + np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    _df = _frame(df, windows[take], codes[take], {k: v[take] for k, v in values.items()})
+    _df['threshold'] = np.repeat(thresholds, sizes)
+    return _df
+
+
+def threshold_totals(df, thresholds):
+    # Per threshold: number of stereotypical segments, their total frames and the frames of NoChild segments.
+    thresholds = np.asarray(thresholds, dtype=np.float64).reshape(-1)
+    if df.shape[0] == 0 or thresholds.shape[0] == 0:
+        return np.zeros(thresholds.shape[0], dtype=np.int64), np.zeros(thresholds.shape[0]), np.zeros(thresholds.shape[0])
+    cuts, inverse = _cuts(df, thresholds)
+    _, codes, groups, values = _segments(df, cuts)
+    frames = (values['end_frame'] - values['start_frame']).astype(np.float64)
+    smm = codes == STEREOTYPICAL
+    smm_count = np.bincount(groups[smm], minlength=cuts.shape[0])
+    smm_frames = np.bincount(groups[smm], weights=frames[smm], minlength=cuts.shape[0])
+    skipped_frames = np.bincount(groups[codes == NOCHILD], weights=frames[codes == NOCHILD], minlength=cuts.shape[0])
+    return smm_count[inverse], smm_frames[inverse], skipped_frames[inverse]
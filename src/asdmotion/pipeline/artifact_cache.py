@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from os import path as osp
+
+# Bump when the format of a stored artifact changes, so older artifacts are never reused.
+ARTIFACT_VERSION = 1
+
+
+class ArtifactCache:
+    # Content-addressed store of preprocessing artifacts. An artifact's key hashes its kind, the parameters that affect it
+    # and the keys of its inputs, so any change upstream yields new keys downstream while unchanged artifacts are shared
+    # across videos, runs and models. The index records every artifact with its parameters and inputs (its lineage).
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(osp.join(root, 'index.db'), check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS artifacts (key TEXT PRIMARY KEY, kind TEXT, path TEXT, params TEXT, inputs TEXT, source TEXT, '
+                          'created REAL)')
+        self.conn.commit()
+
+    @staticmethod
+    def key(kind, params, inputs=()):
+        spec = {'kind': kind, 'version': ARTIFACT_VERSION, 'params': params, 'inputs': list(inputs)}
+        return hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+    def path(self, kind, key, ext=''):
+        return osp.join(self.root, kind, key[:2], f'{key}{ext}')
+
+    def contains(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT path FROM artifacts WHERE key = ?', (key,)).fetchone()
+        return row is not None and osp.exists(row[0])
+
+    def discard(self, path):
+        # Leftovers of an interrupted run are never trusted, since only finished artifacts are recorded.
+        if osp.isdir(path):
+            shutil.rmtree(path)
+        elif osp.exists(path):
+            os.remove(path)
+
+    def record(self, key, kind, path, params, inputs=(), source=None):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (key, kind, path, json.dumps(params, sort_keys=True, default=str), json.dumps(list(inputs)), source, time.time()))
+            self.conn.commit()
+
+    def lineage(self, key):
+        # The artifact and everything it was derived from, newest first.
+        records, stack, seen = [], [key], set()
+        while stack:
+            k = stack.pop()
+            if k in seen:
+                continue
+            seen.add(k)
+            with self.lock:
+                row = self.conn.execute('SELECT key, kind, path, params, inputs, source, created FROM artifacts WHERE key = ?', (k,)).fetchone()
+            if row is None:
+                records.append({'key': k})
+                continue
+            records.append({'key': row[0], 'kind': row[1], 'path': row[2], 'params': json.loads(row[3]), 'inputs': json.loads(row[4]),
+                            'source': row[5], 'created': row[6]})
+            stack += json.loads(row[4])
+        return records
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,145 @@
+import os
+import threading
+from fractions import Fraction
+from queue import Queue, Empty, Full
+
+import cv2
+
+from asdmotion.logger import LogManager
+
+logger = LogManager.APP_LOGGER
+_END = object()
+
+
+def read_frames(video_path):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+    finally:
+        cap.release()
+
+
+class FrameSubscription:
+    def __init__(self, maxsize):
+        self.queue = Queue(maxsize=maxsize)
+        self.closed = threading.Event()
+
+    def put(self, item):
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def close(self):
+        self.closed.set()
+
+    def __iter__(self):
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=0.1)
+                except Empty:
+                    if self.closed.is_set():
+                        return
+                    continue
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+
+class FrameBus:
+    # Decodes a video once and hands every frame to all subscribers. Frames are shared, so consumers must not modify them in place.
+    def __init__(self, video_path, queue_size=16):
+        self.video_path = video_path
+        self.queue_size = queue_size
+        self.subscriptions = []
+        self.frame_count = 0
+        self.error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def subscribe(self, queue_size=None):
+        if self._thread.is_alive():
+            raise RuntimeError('Cannot subscribe to a running frame bus.')
+        subscription = FrameSubscription(queue_size if queue_size else self.queue_size)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def start(self):
+        logger.info(f'Decoding {self.video_path} for {len(self.subscriptions)} consumers.')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        for s in self.subscriptions:
+            s.close()
+
+    def join(self):
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.frame_count
+
+    def _publish(self, item):
+        delivered = [s.put(item) for s in self.subscriptions if not s.closed.is_set()]
+        return any(delivered)
+
+    def _run(self):
+        try:
+            for frame in read_frames(self.video_path):
+                if not self._publish(frame):
+                    return
+                self.frame_count += 1
+            self._publish(_END)
+        except Exception as e:
+            self.error = e
+            self._publish(e)
+
+
+def y4m_header(shape, fps):
+    h, w = shape[:2]
+    rate = Fraction(fps).limit_denominator(1001) if fps else Fraction(30)
+    return f'YUV4MPEG2 W{w + w % 2} H{h + h % 2} F{rate.numerator}:{rate.denominator} Ip A1:1 C420jpeg\n'.encode()
+
+
+def write_y4m(frames, path, fps, shape=None):
+    # Without any frames, the header is still written from `shape`, so the reader sees an empty video instead of a broken one.
+    with open(path, 'wb') as f:
+        empty = True
+        for frame in frames:
+            if empty:
+                f.write(y4m_header(frame.shape, fps))
+                empty = False
+            h, w = frame.shape[:2]
+            if h % 2 or w % 2:
+                frame = cv2.copyMakeBorder(frame, 0, h % 2, 0, w % 2, cv2.BORDER_REPLICATE)
+            f.write(b'FRAME\n')
+            f.write(cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420).tobytes())
+        if empty and shape is not None:
+            f.write(y4m_header(shape, fps))
+
+
+def release_fifo(path, writer, poll=0.1):
+    # Holds the read end open and drains it until the writer thread finishes, so a writer that has not reached open()
+    # yet, or is blocked on a full pipe, can proceed and end instead of waiting for a reader forever.
+    fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        while writer.is_alive():
+            try:
+                while os.read(fd, 1 << 16):
+                    pass
+            except BlockingIOError:
+                pass
+            writer.join(poll)
+    finally:
+        os.close(fd)
@@ -0,0 +1,73 @@
+import subprocess
+from os import path as osp
+
+import numpy as np
+
+from asdmotion.utils import file_fingerprint, init_directories
+
+
+def read_video_packets(video_path, stream='v:0'):
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', stream,
+           '-show_entries', 'packet=pts_time,dts_time,pos,flags', '-of', 'csv=p=0', video_path]
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    rows = [line.split(',') for line in out.splitlines() if line.strip()]
+    if len(rows) == 0:
+        raise ValueError(f'No video packets found in {video_path}')
+    pts_time, dts_time, pos, flags = zip(*[r[:4] for r in rows])
+
+    def to_float(values):
+        return np.array([np.nan if v in ('', 'N/A') else float(v) for v in values], dtype=np.float64)
+
+    pts = to_float(pts_time)
+    pts = np.where(np.isnan(pts), to_float(dts_time), pts)
+    pos = np.array([-1 if v in ('', 'N/A') else int(v) for v in pos], dtype=np.int64)
+    keyframe = np.array(['K' in f for f in flags], dtype=bool)
+    return pts, pos, keyframe
+
+
+class FrameIndex:
+    def __init__(self, pts, pos, keyframe, fingerprint=None):
+        self.pts = pts
+        self.pos = pos
+        self.keyframe = keyframe
+        self.fingerprint = fingerprint
+        self._key_frames = np.flatnonzero(keyframe)
+
+    @classmethod
+    def build(cls, video_path):
+        pts, pos, keyframe = read_video_packets(video_path)
+        order = np.argsort(pts, kind='stable')
+        return cls(pts[order], pos[order], keyframe[order], fingerprint=file_fingerprint(video_path))
+
+    @classmethod
+    def load(cls, index_path):
+        with np.load(index_path) as f:
+            return cls(f['pts'], f['pos'], f['keyframe'], fingerprint=str(f['fingerprint']))
+
+    def save(self, index_path):
+        init_directories(osp.dirname(osp.abspath(index_path)))
+        with open(index_path, 'wb') as f:
+            np.savez(f, pts=self.pts, pos=self.pos, keyframe=self.keyframe, fingerprint=np.array(self.fingerprint))
+
+    def __len__(self):
+        return self.pts.shape[0]
+
+    def timestamp(self, frame):
+        return self.pts[frame]
+
+    def seek_point(self, frame):
+        if len(self._key_frames) == 0:
+            return 0, int(self.pos[0]), float(self.pts[0])
+        k = self._key_frames[max(np.searchsorted(self._key_frames, frame, side='right') - 1, 0)]
+        return int(k), int(self.pos[k]), float(self.pts[k])
+
+
+def load_frame_index(video_path, index_path=None):
+    if index_path is not None and osp.exists(index_path):
+        index = FrameIndex.load(index_path)
+        if index.fingerprint == file_fingerprint(video_path):
+            return index
+    index = FrameIndex.build(video_path)
+    if index_path is not None:
+        index.save(index_path)
+    return index
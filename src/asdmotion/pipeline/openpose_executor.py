@@ -2,17 +2,21 @@ import os
 import shlex
 import shutil
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from itertools import chain
 from os import path as osp
 
 import cv2
+import ffmpeg
 import numpy as np
-from tqdm import tqdm
 
 from asdmotion.logger import LogManager
-from asdmotion.pipeline.skeleton_layout import convert_layout, BODY_25_LAYOUT, COCO_LAYOUT
-from asdmotion.utils import init_directories, get_video_properties, write_pkl, read_json
+from asdmotion.pipeline.frame_bus import read_frames, release_fifo, write_y4m
+from asdmotion.pipeline.frame_index import load_frame_index
+from asdmotion.pipeline.openpose_parser import OpenposeStreamConsumer, parse_openpose_dir, as_pose_sequence, shard_dirs, stitch_shards
+from asdmotion.pipeline.skeleton_layout import layout_index, BODY_25_LAYOUT, COCO_LAYOUT
+from asdmotion.utils import init_directories, get_video_properties, write_pkl, file_fingerprint
 
 logger = LogManager.APP_LOGGER
 
@@ -23,33 +27,134 @@ class SkeletonSource(Enum):
     WEBCAM = 'camera'
 
 
+class Ingestion(Enum):
+    VIDEO = 'video'
+    IMAGE_DIR = 'img_dir'
+    PIPE = 'pipe'
+
+
+class FramePipe:
+    def __init__(self, video_path, pipe_dir, name=None, start_frame=None, end_frame=None, frames=None, fps=None, frame_index=None, resolution=None):
+        self.video_path = video_path
+        name = name if name else osp.splitext(osp.basename(video_path))[0]
+        self.path = osp.join(pipe_dir, f'{name}.y4m')
+        self.start_frame, self.end_frame = start_frame, end_frame
+        self.frames, self.fps, self.resolution = frames, fps, resolution
+        self.frame_index = frame_index
+        self.process = None
+        self.writer = None
+        self.error = None
+
+    @staticmethod
+    def available():
+        return hasattr(os, 'mkfifo') and shutil.which('ffmpeg') is not None
+
+    def _write(self):
+        try:
+            shape = (int(self.resolution[1]), int(self.resolution[0])) if self.resolution else None
+            write_y4m(self.frames, self.path, self.fps, shape=shape)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.frames.close()
+
+    def __enter__(self):
+        init_directories(osp.dirname(self.path))
+        os.mkfifo(self.path)
+        if self.frames is not None:
+            self.writer = threading.Thread(target=self._write, daemon=True)
+            self.writer.start()
+            logger.info(f'Streaming decoded frames of {self.video_path} through {self.path}')
+            return self.path
+        stream, offset = ffmpeg.input(self.video_path), 0
+        if self.start_frame and self.frame_index is not None:
+            # Seeks to the last keyframe at or before start_frame, so only the frames from there on are decoded and trimmed.
+            # The seek time lies between that keyframe and the frame before it, so the first frame out is the keyframe.
+            offset = self.frame_index.seek_point(self.start_frame)[0]
+            if offset > 0:
+                seek_time = (self.frame_index.timestamp(offset - 1) + self.frame_index.timestamp(offset)) / 2
+                stream = ffmpeg.input(self.video_path, ss=seek_time, seek_timestamp=1)
+        stream = stream['v:0']
+        if self.start_frame is not None or self.end_frame is not None:
+            trim = {k: v - offset for k, v in [('start_frame', self.start_frame), ('end_frame', self.end_frame)] if v is not None}
+            stream = stream.trim(**trim)
+        self.process = stream.output(self.path, format='yuv4mpegpipe', vsync='passthrough', strict='-1') \
+            .global_args('-nostdin', '-loglevel', 'error') \
+            .run_async(overwrite_output=True)
+        logger.info(f'Streaming frames of {self.video_path} through {self.path}')
+        return self.path
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.writer is not None:
+            try:
+                if exc_type is not None:
+                    self.frames.close()
+                    release_fifo(self.path, self.writer)
+                self.writer.join()
+                if exc_type is None and self.error is not None:
+                    raise self.error
+            finally:
+                os.remove(self.path)
+            return
+        try:
+            if exc_type is not None:
+                self.process.kill()
+            retcode = self.process.wait()
+            if exc_type is None and retcode != 0:
+                raise subprocess.CalledProcessError(retcode, 'ffmpeg')
+        finally:
+            if osp.exists(self.path):
+                os.remove(self.path)
+
+
+def shard_ranges(frame_count, num_shards):
+    bounds = np.linspace(0, frame_count, num_shards + 1).astype(int)
+    return [(int(s), int(t)) for s, t in zip(bounds[:-1], bounds[1:]) if t > s]
+
+
 class OpenposeInitializer:
-    def __init__(self, sequence_length, num_person_in, num_person_out, open_pose_path, as_img_dir=False, gpu_id=None):
+    def __init__(self, sequence_length, num_person_in, num_person_out, open_pose_path, as_img_dir=False, gpu_id=None, ingestion=None,
+                 num_shards=1, gpu_ids=None, openpose_bin=None, num_workers=None, stream_json=False):
         self.layout = BODY_25_LAYOUT
         self.C, self.T, self.V = 3, sequence_length, len(self.layout)
         self.num_person_in, self.num_person_out = num_person_in, num_person_out
         self.open_pose_path = open_pose_path
-        self.as_img_dir = as_img_dir
+        self.ingestion = Ingestion(ingestion) if ingestion else Ingestion.IMAGE_DIR if as_img_dir else Ingestion.VIDEO
+        if self.ingestion == Ingestion.PIPE and not FramePipe.available():
+            logger.warning('Named pipes or ffmpeg are unavailable, falling back to image dir ingestion.')
+            self.ingestion = Ingestion.IMAGE_DIR
+        self.as_img_dir = self.ingestion == Ingestion.IMAGE_DIR
         self.gpu_id = gpu_id
+        self.num_shards = num_shards
+        self.gpu_ids = gpu_ids if gpu_ids else [gpu_id]
+        self.openpose_bin = openpose_bin
+        self.num_workers = num_workers
+        self.stream_json = stream_json
 
-    def _video2img(self, video_path, out_path):
+    def _video2img(self, video_path, out_path, frames=None):
         name = osp.splitext(osp.basename(video_path))[0]
         logger.info(f'Converting video to image dir. Results will be written to: {out_path}')
         init_directories(out_path)
         cap = cv2.VideoCapture(video_path)
         n = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        cap.release()
         d = len(str(n))
-        i, ret = 0, True
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+        for i, frame in enumerate(read_frames(video_path) if frames is None else frames):
             cv2.imwrite(osp.join(out_path, f'{name}_{str(i).zfill(d)}.jpg'), frame)
-            i += 1
-        cap.release()
 
-    def _exec_openpose(self, src_path, skeleton_dst, source_type=SkeletonSource.VIDEO):
+    def accepts_frames(self, source_type=SkeletonSource.VIDEO):
+        return source_type == SkeletonSource.VIDEO and self.num_shards <= 1 and self.ingestion in (Ingestion.IMAGE_DIR, Ingestion.PIPE)
+
+    def _openpose_executable(self):
+        if self.openpose_bin:
+            return osp.join(self.open_pose_path, self.openpose_bin)
+        if osp.exists(osp.join(self.open_pose_path, 'build_windows')):
+            return osp.join(self.open_pose_path, 'build_windows', 'x64', 'Release', 'OpenPoseDemo.exe')
+        return osp.join(self.open_pose_path, 'bin', 'OpenPoseDemo.exe')
+
+    def _exec_openpose(self, src_path, skeleton_dst, source_type=SkeletonSource.VIDEO, frame_first=None, frame_last=None, gpu_id=None):
         init_directories(skeleton_dst)
+        gpu_id = self.gpu_id if gpu_id is None else gpu_id
         if src_path.startswith('\\\\'):
             src_path = f'\\{src_path}'
         params = {
@@ -67,41 +172,90 @@ class OpenposeInitializer:
             params['hand'] = ''
         if self.layout.name == 'BODY_21A':
             params['tracking'] = 1
-        if self.gpu_id is not None:
+        if gpu_id is not None:
             params['num_gpu'] = 1
-            params['num_gpu_start'] = self.gpu_id
+            params['num_gpu_start'] = gpu_id
+        if frame_first is not None:
+            params['frame_first'] = frame_first
+        if frame_last is not None:
+            params['frame_last'] = frame_last
 
         args = ' '.join([f'--{k} {v}' for k, v in params.items()])
 
-        cwd = os.getcwd()
-        os.chdir(self.open_pose_path)
-        cmd = f'build_windows/x64/Release/OpenPoseDemo.exe {args}' if osp.exists('build_windows') else f'bin/OpenPoseDemo.exe {args}'
+        cmd = f'\"{self._openpose_executable()}\" {args}'
         logger.info(f'Executing: {cmd}')
         try:
-            subprocess.check_call(shlex.split(cmd), universal_newlines=True)
+            subprocess.check_call(shlex.split(cmd), cwd=self.open_pose_path, universal_newlines=True)
         finally:
-            os.chdir(cwd)
             logger.info('OpenPose finished.')
 
-    def prepare_skeleton(self, src_path, result_skeleton_dir=None, source_type=SkeletonSource.VIDEO, out_name=None):
+    def _exec_openpose_sharded(self, src_path, skeleton_dst, frame_count, source_type=SkeletonSource.VIDEO, pipe_dir=None, frame_index=None):
+        shards = shard_ranges(frame_count, self.num_shards)
+        logger.info(f'Executing OpenPose on {len(shards)} shards of {src_path}')
+
+        def run(k, shard):
+            s, t = shard
+            shard_dst = osp.join(skeleton_dst, f'shard_{s:09d}')
+            gpu_id = self.gpu_ids[k % len(self.gpu_ids)]
+            last = k == len(shards) - 1
+            if pipe_dir is not None:
+                name = f'{osp.splitext(osp.basename(src_path))[0]}_{k}'
+                with FramePipe(src_path, pipe_dir, name=name, start_frame=s, end_frame=None if last else t, frame_index=frame_index) as pipe_path:
+                    self._exec_openpose(pipe_path, shard_dst, source_type=SkeletonSource.VIDEO, gpu_id=gpu_id)
+            else:
+                self._exec_openpose(src_path, shard_dst, source_type=source_type, frame_first=s, frame_last=None if last else t - 1, gpu_id=gpu_id)
+
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            for f in [pool.submit(run, k, shard) for k, shard in enumerate(shards)]:
+                f.result()
+
+    def prepare_skeleton(self, src_path, result_skeleton_dir=None, source_type=SkeletonSource.VIDEO, out_name=None, frames=None, frame_index_path=None):
         basename = osp.basename(src_path)
         basename_no_ext = osp.splitext(basename)[0] if source_type == SkeletonSource.VIDEO else basename
 
-        process_dir = osp.join(self.open_pose_path, 'runs', basename_no_ext) if result_skeleton_dir is None else osp.join(result_skeleton_dir, basename_no_ext)
+        # Keyed by the file too, so concurrent runs of different videos with the same name do not share (and remove) it.
+        run_name = f'{basename_no_ext}_{file_fingerprint(src_path)[:8]}' if osp.isfile(src_path) else basename_no_ext
+        process_dir = osp.join(self.open_pose_path, 'runs', run_name) if result_skeleton_dir is None else osp.join(result_skeleton_dir, run_name)
         openpose_output_path = osp.join(process_dir, 'openpose')
 
+        consumer = None
         try:
-            resolution, fps, frame_count, length = get_video_properties(src_path)
+            resolution, fps, frame_count, length = get_video_properties(src_path, count_frames=frames is None, frame_index_path=frame_index_path)
+            if frames is not None and not self.accepts_frames(source_type):
+                raise ValueError(f'{self.ingestion.value} ingestion with {self.num_shards} shards cannot consume decoded frames.')
+            sharded = self.num_shards > 1 and source_type != SkeletonSource.WEBCAM
+            if self.stream_json:
+                consumer = OpenposeStreamConsumer(openpose_output_path).start()
             if self.as_img_dir:
                 img_out_path = osp.join(process_dir, 'img_dirs')
-                self._video2img(src_path, img_out_path)
+                self._video2img(src_path, img_out_path, frames=frames)
                 if frame_count is None or length is None:
                     frame_count = len(os.listdir(img_out_path))
                     length = frame_count / fps
-                self._exec_openpose(img_out_path, openpose_output_path, source_type=SkeletonSource.IMAGE)
+                if sharded:
+                    self._exec_openpose_sharded(img_out_path, openpose_output_path, len(os.listdir(img_out_path)), source_type=SkeletonSource.IMAGE)
+                else:
+                    self._exec_openpose(img_out_path, openpose_output_path, source_type=SkeletonSource.IMAGE)
+            elif sharded and frame_count:
+                pipe_dir, frame_index = None, None
+                if self.ingestion == Ingestion.PIPE and source_type == SkeletonSource.VIDEO:
+                    # Piped shards seek through the packet index, which also gives the exact frame count to split.
+                    pipe_dir, frame_index = osp.join(process_dir, 'pipe'), load_frame_index(src_path, frame_index_path)
+                    frame_count = len(frame_index)
+                self._exec_openpose_sharded(src_path, openpose_output_path, frame_count, source_type=source_type, pipe_dir=pipe_dir, frame_index=frame_index)
+            elif self.ingestion == Ingestion.PIPE and source_type == SkeletonSource.VIDEO:
+                with FramePipe(src_path, osp.join(process_dir, 'pipe'), name=basename_no_ext, frames=frames, fps=fps, resolution=resolution) as pipe_path:
+                    self._exec_openpose(pipe_path, openpose_output_path, source_type=SkeletonSource.VIDEO)
             else:
                 self._exec_openpose(src_path, openpose_output_path, source_type=source_type)
-            data = self.openpose_to_json(openpose_output_path)
+            if consumer is not None:
+                consumer.stop()
+                data = consumer.result()
+            else:
+                data = self.openpose_to_numpy(openpose_output_path)
+            if frame_count is None or length is None:
+                frame_count = len(data)
+                length = frame_count / fps
             skeleton = {
                 'name': basename,
                 'video_path': src_path,
@@ -119,65 +273,47 @@ class OpenposeInitializer:
             logger.error(f'Error creating skeleton from {src_path}: {e}')
             raise e
         finally:
+            if consumer is not None:
+                consumer.stop()
             if osp.exists(process_dir):
                 shutil.rmtree(process_dir)
 
+    def openpose_to_numpy(self, openpose_dir):
+        shards = shard_dirs(openpose_dir)
+        if len(shards) == 0:
+            return parse_openpose_dir(openpose_dir, num_workers=self.num_workers)
+        return stitch_shards([(start, parse_openpose_dir(d, num_workers=self.num_workers)) for start, d in shards])
+
     def openpose_to_json(self, openpose_dir):
-        file_names = [osp.join(openpose_dir, f) for f in os.listdir(openpose_dir) if osp.isfile(osp.join(openpose_dir, f)) and f.endswith('json')]
-
-        def collect_data(lst):
-            k = np.array([float(c) for c in lst])
-            x = np.round(k[::3], 8)
-            y = np.round(k[1::3], 8)
-            c = np.round(k[2::3], 8).tolist()
-            return list(chain(*[(_x, _y) for (_x, _y) in zip(x, y)])), c
-
-        result = []
-        for i, file in tqdm(enumerate(file_names), ascii=True, desc='Openpose to JSON'):
-            skeletons = []
-            frame_info = read_json(file)
-            people = frame_info['people']
-            for pdx, p in enumerate(people):
-                skeleton = {'person_id': p['person_id'] if p['person_id'] != [-1] else pdx}
-                pose, score = collect_data(p['pose_keypoints_2d'])
-                skeleton['pose'] = pose
-                skeleton[f'pose_score'] = score
-                skeletons.append(skeleton)
-            result.append({'frame_index': i,
-                           'skeleton': skeletons})
-        return result
+        return self.openpose_to_numpy(openpose_dir).to_frames()
 
     def to_numpy(self, skeleton):
+        seq = as_pose_sequence(skeleton['data'])
+        T = min(len(seq), self.T)
+        n = seq.frame_offsets[T]
+        kp, frames, pids = seq.keypoints[:n], seq.person_frames[:n], seq.person_ids[:n] % self.num_person_in
         data_numpy = np.zeros((self.C, self.T, self.V, self.num_person_in))
-        for i, frame_info in tqdm(enumerate(skeleton['data']), ascii=True, desc='To numpy'):
-            if i == self.T:
-                break
-            for m, skeleton_info in enumerate(frame_info["skeleton"]):
-                pid = m if ('person_id' not in skeleton_info.keys()) else skeleton_info['person_id']
-                if type(pid) == list:
-                    pid = m if pid[0] < 0 else pid[0]
-                pid %= self.num_person_in
-                pose = skeleton_info['pose']
-                score = skeleton_info['score'] if 'score' in skeleton_info.keys() else skeleton_info['pose_score']
-                data_numpy[0, i, :, pid] = pose[0::2]
-                data_numpy[1, i, :, pid] = pose[1::2]
-                data_numpy[2, i, :, pid] = score
+        data_numpy[:, frames, :, pids] = kp.transpose((0, 2, 1))
 
         sort_index = (-data_numpy[2, :, :, :].sum(axis=1)).argsort(axis=1)
-        for t, s in enumerate(sort_index):
-            data_numpy[:, t, :, :] = data_numpy[:, t, :, s].transpose((1, 2, 0))
+        data_numpy = np.take_along_axis(data_numpy, sort_index[None, :, None, :], axis=3)
         return data_numpy[:, :, :, 0:self.num_person_out]
 
     def _to_posec3d_numpy(self, skeleton_data, in_layout, out_layout):
-        keypoints = np.zeros((self.num_person_out, len(skeleton_data), len(out_layout), self.C - 1))
-        scores = np.zeros((self.num_person_out, len(skeleton_data), len(out_layout)))
-
-        for i, frame_info in enumerate(skeleton_data):
-            skeletons = sorted(frame_info['skeleton'], key=lambda s: np.mean(s['pose_score']), reverse=True)[:self.num_person_out]
-            for j, skeleton in enumerate(skeletons):
-                keypoint, score = np.array([skeleton['pose'][::2], skeleton['pose'][1::2]]).T, np.array(skeleton['pose_score'])
-                keypoints[j, i, :, :] = convert_layout(keypoint, in_layout, out_layout)
-                scores[j, i, :] = convert_layout(score, in_layout, out_layout)
+        seq = as_pose_sequence(skeleton_data)
+        M, T, P = self.num_person_out, len(seq), seq.keypoints.shape[0]
+        keypoints = np.zeros((M, T, len(out_layout), self.C - 1), dtype=np.float32)
+        scores = np.zeros((M, T, len(out_layout)), dtype=np.float32)
+        if P == 0:
+            return keypoints, scores
+
+        frames = seq.person_frames
+        order = np.lexsort((-seq.pose_score.mean(axis=1), frames))
+        rank = np.arange(P) - seq.frame_offsets[frames[order]]
+        order, rank = order[rank < M], rank[rank < M]
+        converted = seq.keypoints[order][:, layout_index(in_layout, out_layout)]
+        keypoints[rank, frames[order]] = converted[..., :2]
+        scores[rank, frames[order]] = converted[..., 2]
         return keypoints, scores
 
     def to_poseC3D(self, json_file, label=None, label_index=None, in_layout=BODY_25_LAYOUT, out_layout=COCO_LAYOUT):
@@ -193,7 +329,7 @@ class OpenposeInitializer:
             'fps': json_file['fps'],
             'length_seconds': json_file['length_seconds'],
             'frame_count': json_file['frame_count'],
-            'adjust': json_file['adjust'],
+            'adjust': json_file.get('adjust'),
             'total_frames': len(json_file['data']),
         }
         if label is not None and label_index is not None:
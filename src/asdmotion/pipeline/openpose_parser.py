@@ -0,0 +1,200 @@
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from os import path as osp
+
+import numpy as np
+
+from asdmotion.logger import LogManager
+from asdmotion.utils import read_json
+
+FRAME_PATTERN = re.compile(r'(\d+)(?:_keypoints)?\.json$')
+logger = LogManager.APP_LOGGER
+
+
+class PoseSequence:
+    def __init__(self, keypoints, frame_offsets, person_ids):
+        self.keypoints = keypoints
+        self.frame_offsets = frame_offsets
+        self.person_ids = person_ids
+
+    def __len__(self):
+        return self.frame_offsets.shape[0] - 1
+
+    @property
+    def pose(self):
+        return self.keypoints[..., :2]
+
+    @property
+    def pose_score(self):
+        return self.keypoints[..., 2]
+
+    @property
+    def person_counts(self):
+        return np.diff(self.frame_offsets)
+
+    @property
+    def person_frames(self):
+        return np.repeat(np.arange(len(self)), self.person_counts)
+
+    def frame(self, i):
+        s, t = self.frame_offsets[i], self.frame_offsets[i + 1]
+        return self.keypoints[s:t], self.person_ids[s:t]
+
+    @classmethod
+    def empty(cls, num_joints=0):
+        return cls(np.zeros((0, num_joints, 3), dtype=np.float32), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    @classmethod
+    def concatenate(cls, sequences):
+        sequences = list(sequences)
+        if len(sequences) == 0:
+            return cls.empty()
+        num_joints = max(s.keypoints.shape[1] for s in sequences)
+        keypoints = np.concatenate([s.keypoints for s in sequences if s.keypoints.shape[0] > 0] or [np.zeros((0, num_joints, 3), dtype=np.float32)])
+        counts = np.concatenate([s.person_counts for s in sequences])
+        frame_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        person_ids = np.concatenate([s.person_ids for s in sequences]).astype(np.int64)
+        return cls(keypoints, frame_offsets, person_ids)
+
+    @classmethod
+    def from_frames(cls, frames):
+        counts, keypoints, person_ids = [], [], []
+        for frame_info in frames:
+            counts.append(len(frame_info['skeleton']))
+            for m, skeleton in enumerate(frame_info['skeleton']):
+                pose, score = np.array(skeleton['pose'], dtype=np.float32), np.array(skeleton.get('score', skeleton.get('pose_score')), dtype=np.float32)
+                keypoints.append(np.concatenate([pose.reshape(-1, 2), score[:, None]], axis=1))
+                person_ids.append(_person_id(skeleton.get('person_id', m), m))
+        keypoints = np.stack(keypoints) if len(keypoints) > 0 else np.zeros((0, 0, 3), dtype=np.float32)
+        frame_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(keypoints, frame_offsets, np.array(person_ids, dtype=np.int64))
+
+    def to_frames(self):
+        result = []
+        for i in range(len(self)):
+            kp, pids = self.frame(i)
+            result.append({'frame_index': i,
+                           'skeleton': [{'person_id': int(pid), 'pose': k[:, :2].reshape(-1).tolist(), 'pose_score': k[:, 2].tolist()} for k, pid in zip(kp, pids)]})
+        return result
+
+
+def as_pose_sequence(data):
+    return data if isinstance(data, PoseSequence) else PoseSequence.from_frames(data)
+
+
+def frame_number(file_name):
+    m = FRAME_PATTERN.search(osp.basename(file_name))
+    return int(m.group(1)) if m else -1
+
+
+def list_openpose_files(openpose_dir):
+    file_names = [osp.join(openpose_dir, f) for f in os.listdir(openpose_dir) if osp.isfile(osp.join(openpose_dir, f)) and f.endswith('json')]
+    return sorted(file_names, key=lambda f: (frame_number(f), f))
+
+
+def _person_id(pid, default):
+    if isinstance(pid, list):
+        pid = pid[0] if len(pid) > 0 else -1
+    return default if pid < 0 else pid
+
+
+def parse_openpose_files(file_names):
+    counts = np.zeros(len(file_names), dtype=np.int64)
+    keypoints, person_ids = [], []
+    for i, file in enumerate(file_names):
+        people = read_json(file)['people']
+        counts[i] = len(people)
+        for pdx, p in enumerate(people):
+            keypoints.append(p['pose_keypoints_2d'])
+            person_ids.append(_person_id(p.get('person_id', -1), pdx))
+    keypoints = np.array(keypoints, dtype=np.float32)
+    keypoints = keypoints.reshape(keypoints.shape[0], -1, 3) if keypoints.shape[0] > 0 else np.zeros((0, 0, 3), dtype=np.float32)
+    frame_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return PoseSequence(keypoints, frame_offsets, np.array(person_ids, dtype=np.int64))
+
+
+def parse_openpose_dir(openpose_dir, num_workers=None, chunk_size=1024):
+    file_names = list_openpose_files(openpose_dir)
+    chunks = [file_names[i:i + chunk_size] for i in range(0, len(file_names), chunk_size)]
+    if len(chunks) <= 1 or num_workers == 0:
+        return PoseSequence.concatenate([parse_openpose_files(c) for c in chunks])
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        return PoseSequence.concatenate(pool.map(parse_openpose_files, chunks))
+
+
+def shard_dirs(openpose_dir):
+    if not osp.isdir(openpose_dir):
+        return []
+    shards = sorted(d for d in os.listdir(openpose_dir) if d.startswith('shard_') and osp.isdir(osp.join(openpose_dir, d)))
+    return [(int(d.split('_')[-1]), osp.join(openpose_dir, d)) for d in shards]
+
+
+def stitch_shards(shards):
+    sequences, stitched = [], 0
+    for start, seq in shards:
+        if start != stitched:
+            logger.warning(f'Shard starting at frame {start} follows {stitched} stitched frames.')
+        sequences.append(seq)
+        stitched += len(seq)
+    return PoseSequence.concatenate(sequences)
+
+
+class OpenposeStreamConsumer:
+    def __init__(self, openpose_dir, poll_interval=1.0, delete_consumed=True):
+        self.openpose_dir = openpose_dir
+        self.poll_interval = poll_interval
+        self.delete_consumed = delete_consumed
+        self.consumed = 0
+        self.error = None
+        self._sequences = {}
+        self._seen = set()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop_event.wait(self.poll_interval):
+                self._consume(final=False)
+            self._consume(final=True)
+        except Exception as e:
+            self.error = e
+
+    def _consume(self, final):
+        if not osp.isdir(self.openpose_dir):
+            return
+        for d in [self.openpose_dir] + [d for _, d in shard_dirs(self.openpose_dir)]:
+            files = [f for f in list_openpose_files(d) if f not in self._seen]
+            # OpenPose writes frames in order, so every file except the newest one is complete.
+            files = files if final else files[:-1]
+            if len(files) == 0:
+                continue
+            try:
+                seq = parse_openpose_files(files)
+            except ValueError:
+                if final:
+                    raise
+                continue
+            self._sequences.setdefault(d, []).append(seq)
+            self._seen.update(files)
+            self.consumed += len(files)
+            if self.delete_consumed:
+                for f in files:
+                    os.remove(f)
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        shards = shard_dirs(self.openpose_dir)
+        if len(shards) == 0:
+            return PoseSequence.concatenate(self._sequences.get(self.openpose_dir, []))
+        return stitch_shards([(start, PoseSequence.concatenate(self._sequences.get(d, []))) for start, d in shards])
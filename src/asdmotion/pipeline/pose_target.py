@@ -0,0 +1,190 @@
+# Batched re-implementation of mmaction2's test-time pose preprocessing (UniformSampleFrames, PoseDecode, PoseCompact,
+# Resize, CenterCrop, GeneratePoseTarget and FormatShape). The inference worker imports it inside the OpenMMLab
+# environment, so it must depend on numpy alone. Dtypes follow numpy 1.x promotion, as used by mmaction2 0.x.
+import numpy as np
+
+POSE_TARGET_STEPS = ['UniformSampleFrames', 'PoseDecode', 'PoseCompact', 'Resize', 'CenterCrop', 'GeneratePoseTarget', 'FormatShape', 'Collect', 'ToTensor']
+EPSILON = 1e-4
+
+
+def _pair(x):
+    return tuple(x) if isinstance(x, (tuple, list)) else (x, x)
+
+
+def _rescale_size(old_size, scale):
+    w, h = old_size
+    if isinstance(scale, (float, int)):
+        scale_factor = scale
+    else:
+        scale_factor = min(max(scale) / max(h, w), min(scale) / min(h, w))
+    return int(w * float(scale_factor) + 0.5), int(h * float(scale_factor) + 0.5)
+
+
+def uniform_sample_indices(num_frames, clip_len, num_clips, seed=255):
+    rng = np.random.RandomState(seed)
+    if num_frames < clip_len:
+        starts = np.arange(num_clips) if num_frames < num_clips else np.arange(num_clips) * num_frames // num_clips
+        inds = (starts[:, None] + np.arange(clip_len)).reshape(-1)
+    elif num_frames < clip_len * 2:
+        all_inds = []
+        for _ in range(num_clips):
+            offset = np.zeros(clip_len + 1, dtype=np.int64)
+            offset[rng.choice(clip_len + 1, num_frames - clip_len, replace=False)] = 1
+            all_inds.append(np.arange(clip_len) + np.cumsum(offset)[:-1])
+        inds = np.concatenate(all_inds)
+    else:
+        bids = np.arange(clip_len + 1) * num_frames // clip_len
+        inds = np.concatenate([bids[:clip_len] + rng.randint(np.diff(bids)) for _ in range(num_clips)])
+    return np.mod(inds, num_frames)
+
+
+class PoseTargetGenerator:
+    def __init__(self, clip_len=48, num_clips=10, seed=255, padding=0.25, threshold=10, hw_ratio=1., allow_imgpad=True, scale=(-1, 56), crop_size=56,
+                 sigma=0.6, use_score=True, double=True, left_kp=(1, 3, 5, 7, 9, 11, 13, 15), right_kp=(2, 4, 6, 8, 10, 12, 14, 16)):
+        self.clip_len = clip_len
+        self.num_clips = num_clips
+        self.seed = seed
+        self.padding = padding
+        self.threshold = threshold
+        self.hw_ratio = _pair(hw_ratio) if hw_ratio is not None else None
+        self.allow_imgpad = allow_imgpad
+        if isinstance(scale, (tuple, list)):
+            scale = tuple(scale)
+            if min(scale) == -1:
+                scale = (np.inf, max(scale))
+        self.scale = scale
+        self.crop_size = _pair(crop_size)
+        self.sigma = sigma
+        self.use_score = use_score
+        self.double = double
+        self.left_kp = left_kp
+        self.right_kp = right_kp
+        self._indices = {}
+
+    @classmethod
+    def from_config(cls, pipeline):
+        # Steps ahead of the frame sampling (e.g. ChildDetect) are returned untouched, for the caller to run with mmaction.
+        types = [step['type'] for step in pipeline]
+        if 'UniformSampleFrames' not in types or types[types.index('UniformSampleFrames'):] != POSE_TARGET_STEPS:
+            raise ValueError(f'Unsupported pose pipeline: {types}')
+        first = types.index('UniformSampleFrames')
+        args = {step['type']: {k: v for k, v in step.items() if k != 'type'} for step in pipeline[first:]}
+        sample, compact, resize, target = args['UniformSampleFrames'], args['PoseCompact'], args['Resize'], args['GeneratePoseTarget']
+        if not sample.get('test_mode', False) or not resize.get('keep_ratio', True) or target.get('with_limb', False) or not target.get('with_kp', True) \
+                or args['FormatShape'].get('input_format') != 'NCTHW' or args['FormatShape'].get('collapse', False):
+            raise ValueError(f'Unsupported pose pipeline arguments: {args}')
+        generator = cls(clip_len=sample['clip_len'], num_clips=sample.get('num_clips', 1), seed=sample.get('seed', 255),
+                        padding=compact.get('padding', 0.25), threshold=compact.get('threshold', 10), hw_ratio=compact.get('hw_ratio'),
+                        allow_imgpad=compact.get('allow_imgpad', True), scale=resize['scale'], crop_size=args['CenterCrop']['crop_size'],
+                        sigma=target.get('sigma', 0.6), use_score=target.get('use_score', True), double=target.get('double', False),
+                        left_kp=target.get('left_kp', (1, 3, 5, 7, 9, 11, 13, 15)), right_kp=target.get('right_kp', (2, 4, 6, 8, 10, 12, 14, 16)))
+        return pipeline[:first], generator
+
+    def sample(self, num_frames):
+        if num_frames not in self._indices:
+            self._indices[num_frames] = uniform_sample_indices(num_frames, self.clip_len, self.num_clips, self.seed)
+        return self._indices[num_frames]
+
+    def compact(self, kp, img_shape):
+        # Kept scalar, as in PoseCompact, so the box is rounded exactly the same way.
+        h, w = img_shape
+        kp[np.isnan(kp)] = 0.
+        kp_x, kp_y = kp[..., 0], kp[..., 1]
+        min_x = np.min(kp_x[kp_x != 0], initial=np.inf)
+        min_y = np.min(kp_y[kp_y != 0], initial=np.inf)
+        max_x = np.max(kp_x[kp_x != 0], initial=-np.inf)
+        max_y = np.max(kp_y[kp_y != 0], initial=-np.inf)
+        if max_x - min_x < self.threshold or max_y - min_y < self.threshold:
+            return kp, img_shape
+        center = ((max_x + min_x) / 2, (max_y + min_y) / 2)
+        half_width = (max_x - min_x) / 2 * (1 + self.padding)
+        half_height = (max_y - min_y) / 2 * (1 + self.padding)
+        if self.hw_ratio is not None:
+            half_height = max(self.hw_ratio[0] * half_width, half_height)
+            half_width = max(1 / self.hw_ratio[1] * half_height, half_width)
+        min_x, max_x = center[0] - half_width, center[0] + half_width
+        min_y, max_y = center[1] - half_height, center[1] + half_height
+        if self.allow_imgpad:
+            min_x, min_y, max_x, max_y = int(min_x), int(min_y), int(max_x), int(max_y)
+        else:
+            min_x, min_y = int(max(0, min_x)), int(max(0, min_y))
+            max_x, max_y = int(min(w, max_x)), int(min(h, max_y))
+        kp_x[kp_x != 0] -= min_x
+        kp_y[kp_y != 0] -= min_y
+        return kp, (max_y - min_y, max_x - min_x)
+
+    def resize(self, kp, img_shape):
+        img_h, img_w = img_shape
+        new_w, new_h = _rescale_size((img_w, img_h), self.scale)
+        return kp * np.array([new_w / img_w, new_h / img_h], dtype=np.float32), (new_h, new_w)
+
+    def center_crop(self, kp, img_shape):
+        img_h, img_w = img_shape
+        crop_w, crop_h = self.crop_size
+        return kp - np.array([(img_w - crop_w) // 2, (img_h - crop_h) // 2]), (crop_h, crop_w)
+
+    def flip(self, kp, score, img_w):
+        kp = kp.copy()
+        kp_x = kp[..., 0]
+        kp_x[kp_x != 0] = img_w - kp_x[kp_x != 0]
+        order = list(range(kp.shape[2]))
+        for left, right in zip(self.left_kp, self.right_kp):
+            order[left], order[right] = right, left
+        return kp[:, :, order], score[:, :, order]
+
+    def heatmaps(self, kp, score, img_shape):
+        # Returns (joints, frames, H, W). Every (person, frame, joint) Gaussian is evaluated on the same small grid.
+        # Stamps of one person never overlap each other, so they are composited person by person with a plain max.
+        img_h, img_w = img_shape
+        num_frames, num_kp = kp.shape[1:3]
+        max_values = score if self.use_score else np.ones(score.shape, dtype=np.float32)
+        radius = 3 * self.sigma
+        grid = np.arange(int(2 * radius) + 2)
+        mu = kp.astype(np.float64)
+        st = np.maximum((mu - radius).astype(np.int64), 0)
+        ed = np.minimum((mu + radius).astype(np.int64) + 1, [img_w, img_h])
+        xs, ys = st[..., 0, None] + grid, st[..., 1, None] + grid
+        mu = kp.astype(np.float32)
+        dx = (xs.astype(np.float32) - mu[..., 0, None]) ** 2
+        dy = (ys.astype(np.float32) - mu[..., 1, None]) ** 2
+        patches = np.exp(-(dx[..., None, :] + dy[..., :, None]) / 2 / self.sigma ** 2) * max_values[..., None, None]
+        valid = (ys < ed[..., 1, None])[..., :, None] & (xs < ed[..., 0, None])[..., None, :] & (max_values.astype(np.float64) >= EPSILON)[..., None, None]
+        frames = np.arange(num_frames)[:, None, None, None]
+        joints = np.arange(num_kp)[None, :, None, None]
+        heatmaps = np.zeros((num_kp, num_frames, img_h, img_w), dtype=np.float32)
+        flat = heatmaps.reshape(-1)
+        for m in range(kp.shape[0]):
+            index = (((joints * num_frames + frames) * img_h + ys[m][..., :, None]) * img_w + xs[m][..., None, :])[valid[m]]
+            flat[index] = np.maximum(flat[index], patches[m][valid[m]])
+        return heatmaps
+
+    @property
+    def views_per_clip(self):
+        return 2 if self.double else 1
+
+    def __call__(self, results, clips=None):
+        frame_inds = self.sample(results['total_frames']) + results.get('start_index', 0) + results.get('offset', 0)
+        # Clips share most of their frames, so every sampled frame is rendered once and gathered into the clips using it.
+        frames, inverse = np.unique(frame_inds, return_inverse=True)
+        kp = results['keypoint'][:, frames].astype(np.float32)
+        if 'keypoint_score' in results:
+            score = results['keypoint_score'][:, frames].astype(np.float32)
+        else:
+            score = np.ones(kp.shape[:-1], dtype=np.float32)
+        # The compact box spans all clips, so it is computed before narrowing down to the requested ones.
+        kp, img_shape = self.compact(kp, results['img_shape'])
+        kp, img_shape = self.resize(kp, img_shape)
+        kp, img_shape = self.center_crop(kp, img_shape)
+        inverse = inverse.reshape(self.num_clips, self.clip_len)
+        if clips is not None:
+            needed, inverse = np.unique(inverse[clips], return_inverse=True)
+            inverse = inverse.reshape(-1, self.clip_len)
+            kp, score = kp[:, needed], score[:, needed]
+        heatmaps = [self.heatmaps(kp, score, img_shape)]
+        if self.double:
+            heatmaps.append(self.heatmaps(*self.flip(kp, score, img_shape[1]), img_shape))
+        # Written straight into the NCTHW layout, with the flipped clips after the original ones.
+        imgs = np.empty((len(heatmaps) * inverse.shape[0], kp.shape[2], self.clip_len) + tuple(img_shape), dtype=np.float32)
+        for k, (heatmap, clip) in enumerate((h, c) for h in heatmaps for c in inverse):
+            np.take(heatmap, clip, axis=1, out=imgs[k])
+        return imgs
@@ -1,3 +1,8 @@
+from functools import lru_cache
+
+import numpy as np
+
+
 class GraphLayout:
     def __init__(self, name, center, joints, pairs, face=False, hand=False, model_pose=None):
         self.name = name
@@ -32,10 +37,16 @@ class GraphLayout:
         return []
 
 
-def convert_layout(np_data, l1, l2):
+@lru_cache(maxsize=None)
+def layout_index(l1, l2):
     assert len(l2) <= len(l1)
-    joints = [l1.joint(i) for i in l2.joints().values()]
-    return np_data[joints]
+    index = np.array([l1.joint(i) for i in l2.joints().values()], dtype=np.int64)
+    index.flags.writeable = False
+    return index
+
+
+def convert_layout(np_data, l1, l2):
+    return np_data[layout_index(l1, l2)]
 
 
 BODY_25_LAYOUT = GraphLayout(
@@ -0,0 +1,65 @@
+import os
+import shutil
+from os import path as osp
+
+import numpy as np
+
+from asdmotion.utils import read_json, write_json, read_pkl, init_directories
+
+FLOAT_COLUMNS = ('keypoint', 'keypoint_score', 'child_ids', 'child_detected', 'child_bbox')
+META_FILE = 'meta.json'
+
+
+def _to_json(v):
+    if isinstance(v, np.generic):
+        return v.item()
+    if isinstance(v, (tuple, list)):
+        return [_to_json(x) for x in v]
+    if isinstance(v, dict):
+        return {k: _to_json(x) for k, x in v.items()}
+    return v
+
+
+def write_skeleton(skeleton, dst):
+    tmp = f'{dst}.tmp'
+    if osp.exists(tmp):
+        shutil.rmtree(tmp)
+    init_directories(tmp)
+    columns, meta = {}, {}
+    for k, v in skeleton.items():
+        if isinstance(v, np.ndarray):
+            v = v.astype(np.float32) if k in FLOAT_COLUMNS else v
+            np.save(osp.join(tmp, f'{k}.npy'), np.ascontiguousarray(v))
+            columns[k] = {'dtype': v.dtype.str, 'shape': list(v.shape)}
+        else:
+            meta[k] = _to_json(v)
+    write_json({'columns': columns, 'meta': meta}, osp.join(tmp, META_FILE))
+    if osp.exists(dst):
+        shutil.rmtree(dst)
+    os.replace(tmp, dst)
+
+
+def read_skeleton_meta(src):
+    return read_json(osp.join(src, META_FILE))
+
+
+def read_skeleton(src, mmap=True, columns=None):
+    if osp.isfile(src):
+        return read_pkl(src)
+    header = read_skeleton_meta(src)
+    skeleton = dict(header['meta'])
+    for k in header['columns'].keys():
+        if columns is None or k in columns:
+            skeleton[k] = np.load(osp.join(src, f'{k}.npy'), mmap_mode='r' if mmap else None)
+    return skeleton
+
+
+def legacy_skeleton_path(path):
+    return f'{osp.splitext(path)[0]}.pkl'
+
+
+def resolve_skeleton_path(path):
+    for p in (path, legacy_skeleton_path(path)):
+        if osp.exists(p):
+            return p
+    return None
@@ -0,0 +1,156 @@
+import queue
+import threading
+
+from asdmotion.logger import LogManager
+
+logger = LogManager.APP_LOGGER
+_STOP = object()
+
+
+class Stage:
+    # `fn` receives the job state, a dict holding the job's input under 'input' and the output of every finished stage
+    # under the stage's name. Whatever it returns is stored under its own name. With batch > 1, `fn` receives a list of
+    # up to `batch` states that are ready together and returns one output per state. An exception returned as an output
+    # fails only its own job, while one raised fails the whole batch.
+    def __init__(self, name, fn, workers=1, after=(), queue_size=2, batch=1):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.after = tuple(after)
+        self.queue_size = max(queue_size, batch)
+        self.batch = batch
+
+
+class StageGraph:
+    # Runs many jobs through a DAG of stages. Every stage has its own bounded queue and worker threads, so different
+    # jobs overlap in different stages while a slow stage holds back its producers instead of piling up work.
+    def __init__(self, stages):
+        self.stages = {s.name: s for s in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError('Stage names must be unique.')
+        for s in stages:
+            missing = [d for d in s.after if d not in self.stages]
+            if missing:
+                raise ValueError(f'Stage {s.name} depends on unknown stages: {missing}')
+        self.order = self._topological_order()
+        self.downstream = {n: [s.name for s in stages if n in s.after] for n in self.stages}
+
+    def _topological_order(self):
+        order, done = [], set()
+        while len(order) < len(self.stages):
+            ready = [n for n, s in self.stages.items() if n not in done and all(d in done for d in s.after)]
+            if not ready:
+                raise ValueError('Stages form a cycle.')
+            order += ready
+            done.update(ready)
+        return order
+
+    def run(self, inputs):
+        # Returns one (state, error) pair per input, in input order. A failed job skips the stages that depend on it.
+        inputs = list(inputs)
+        states = [{'input': x} for x in inputs]
+        errors = [None] * len(inputs)
+        pending = [{n: len(self.stages[n].after) for n in self.stages} for _ in inputs]
+        settled = [set() for _ in inputs]
+        lock = threading.Lock()
+        all_done = threading.Event()
+        unfinished = [len(inputs)]
+        queues = {n: queue.Queue(maxsize=max(self.stages[n].queue_size, 1)) for n in self.stages}
+
+        def settle(job, names):
+            with lock:
+                new = set(names) - settled[job]
+                settled[job] |= new
+                if new and len(settled[job]) == len(self.stages):
+                    unfinished[0] -= 1
+                    if unfinished[0] == 0:
+                        all_done.set()
+
+        def skip(job, name):
+            # Settles `name` and everything downstream of it without running them.
+            skipped, stack = set(), [name]
+            while stack:
+                n = stack.pop()
+                if n not in skipped:
+                    skipped.add(n)
+                    stack += self.downstream[n]
+            settle(job, skipped)
+
+        def release(job, name):
+            ready = []
+            with lock:
+                for n in self.downstream[name]:
+                    if n not in settled[job]:
+                        pending[job][n] -= 1
+                        if pending[job][n] == 0:
+                            ready.append(n)
+            for n in ready:
+                queues[n].put(job)
+
+        def take(stage):
+            # Blocks for one job, then adds whatever else is already waiting, up to the stage's batch size.
+            jobs = [queues[stage.name].get()]
+            while jobs[0] is not _STOP and len(jobs) < stage.batch:
+                try:
+                    job = queues[stage.name].get_nowait()
+                except queue.Empty:
+                    break
+                if job is _STOP:
+                    queues[stage.name].put(job)
+                    break
+                jobs.append(job)
+            return jobs
+
+        def work(stage):
+            while True:
+                jobs = take(stage)
+                if jobs[0] is _STOP:
+                    return
+                with lock:
+                    failed = [j for j in jobs if errors[j] is not None]
+                for job in failed:
+                    skip(job, stage.name)
+                jobs = [j for j in jobs if j not in failed]
+                if len(jobs) == 0:
+                    continue
+                try:
+                    if stage.batch > 1:
+                        outputs = stage.fn([states[j] for j in jobs])
+                    else:
+                        outputs = [stage.fn(states[jobs[0]])]
+                except Exception as e:
+                    outputs = [e] * len(jobs)
+                for job, output in zip(jobs, outputs):
+                    if isinstance(output, Exception):
+                        logger.error(f'Stage {stage.name} failed for {inputs[job]}: {output}')
+                        with lock:
+                            errors[job] = output
+                        skip(job, stage.name)
+                        continue
+                    states[job][stage.name] = output
+                    release(job, stage.name)
+                    settle(job, [stage.name])
+
+        threads = [threading.Thread(target=work, args=(s,), daemon=True, name=f'{s.name}-{i}')
+                   for s in self.stages.values() for i in range(max(s.workers, 1))]
+        for t in threads:
+            t.start()
+        if len(inputs) == 0:
+            all_done.set()
+        roots = [n for n in self.order if len(self.stages[n].after) == 0]
+
+        def feed():
+            for job in range(len(inputs)):
+                for n in roots:
+                    queues[n].put(job)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        all_done.wait()
+        feeder.join()
+        for s in self.stages.values():
+            for _ in range(max(s.workers, 1)):
+                queues[s.name].put(_STOP)
+        for t in threads:
+            t.join()
+        return list(zip(states, errors))
@@ -0,0 +1,134 @@
+import os
+from os import path as osp
+
+import numpy as np
+
+from asdmotion.pipeline.skeleton_store import read_skeleton, write_skeleton
+from asdmotion.utils import read_json, write_json, read_pkl, write_pkl
+
+INTERVALS_FILE = 'intervals.npy'
+SKIPPED_FILE = 'skipped.npy'
+WINDOWS_FILE = 'windows.json'
+WINDOW_EXCLUDED = ['keypoint', 'keypoint_score', 'total_frames', 'frame_dir', 'child_detected', 'child_ids']
+
+
+def split_intervals(T, sequence_length, step_size, min_length):
+    starts = np.arange(0, max(T, T - sequence_length + step_size), step_size, dtype=np.int64)
+    ends = np.minimum(starts + sequence_length, T)
+    keep = (ends - starts) >= min_length
+    starts, ends = starts[keep], ends[keep]
+    return np.stack([starts, ends, np.arange(starts.shape[0], dtype=np.int64)], axis=1)
+
+
+def valid_ratios(child_ids, intervals, child_detected=None):
+    # A frame is valid when a person is matched to the child and, where detections are recorded, the child was detected.
+    valid = np.asarray(child_ids) != -1
+    if child_detected is not None:
+        valid &= np.asarray(child_detected) > 0
+    valid = np.concatenate([[0], np.cumsum(valid)])
+    return (valid[intervals[:, 1]] - valid[intervals[:, 0]]) / np.maximum(intervals[:, 1] - intervals[:, 0], 1)
+
+
+def coverage(intervals, T):
+    d = np.zeros(T + 1, dtype=np.int64)
+    np.add.at(d, intervals[:, 0], 1)
+    np.add.at(d, intervals[:, 1], -1)
+    return np.cumsum(d[:-1]) > 0
+
+
+def spans(mask):
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return np.stack([np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)], axis=1).astype(np.int64)
+
+
+def make_window(skeleton, template, s, t, index):
+    basename, _ = osp.splitext(template['basename'])
+    out = {**dict(template),
+           **{'keypoint': skeleton['keypoint'][:, s:t, :, :],
+              'keypoint_score': skeleton['keypoint_score'][:, s:t, :],
+              'frame_dir': f'{basename}_{index}',
+              'total_frames': t - s,
+              'segment_name': f'{basename}_{s}_{t}',
+              'start': s,
+              'end': t,
+              'label': -1}}
+    if 'child_detected' in skeleton.keys():
+        out['child_detected'] = skeleton['child_detected'][s:t]
+        out['child_ids'] = skeleton['child_ids'][s:t]
+    return out
+
+
+class WindowDataset:
+    def __init__(self, skeleton, intervals, params=None, skipped=None):
+        self.skeleton = skeleton
+        self.intervals = intervals
+        self.skipped = skipped if skipped is not None else np.zeros((0, 2), dtype=np.int64)
+        self.params = params if params else {}
+        self.template = {k: v for k, v in skeleton.items() if k not in WINDOW_EXCLUDED}
+        self.template['basename'] = skeleton['frame_dir']
+
+    @classmethod
+    def from_skeleton(cls, skeleton, sequence_length, step_size, min_length, min_valid_ratio=0.0):
+        T = skeleton['keypoint'].shape[1]
+        params = {'sequence_length': sequence_length, 'step_size': step_size, 'min_length': min_length, 'min_valid_ratio': min_valid_ratio}
+        intervals = split_intervals(T, sequence_length, step_size, min_length)
+        if min_valid_ratio <= 0 or 'child_ids' not in skeleton.keys():
+            return cls(skeleton, intervals, params)
+        keep = valid_ratios(skeleton['child_ids'], intervals, skeleton.get('child_detected')) >= min_valid_ratio
+        # Frames of dropped windows that no kept window covers are reported as skipped.
+        skipped = spans(coverage(intervals[~keep], T) & ~coverage(intervals[keep], T))
+        return cls(skeleton, intervals[keep], params, skipped)
+
+    def __len__(self):
+        return self.intervals.shape[0]
+
+    def __getitem__(self, index):
+        s, t, i = self.intervals[index]
+        return make_window(self.skeleton, self.template, int(s), int(t), int(i))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def skipped_frames(self):
+        return int((self.skipped[:, 1] - self.skipped[:, 0]).sum())
+
+    @property
+    def starts(self):
+        return self.intervals[:, 0]
+
+    @property
+    def ends(self):
+        return self.intervals[:, 1]
+
+    def to_annotations(self):
+        annotations = [{k: np.asarray(v) if isinstance(v, np.ndarray) else v for k, v in w.items()} for w in self]
+        return {'split': {'test1': [f'{x["frame_dir"]}' for x in annotations]}, 'annotations': annotations}
+
+    def save(self, dst):
+        write_skeleton(self.skeleton, dst)
+        np.save(osp.join(dst, INTERVALS_FILE), self.intervals)
+        np.save(osp.join(dst, SKIPPED_FILE), self.skipped)
+        write_json(self.params, osp.join(dst, WINDOWS_FILE))
+
+    @classmethod
+    def load(cls, src, mmap=True):
+        return cls(read_skeleton(src, mmap=mmap), read_intervals(src), read_json(osp.join(src, WINDOWS_FILE)), read_skipped(src))
+
+
+def read_intervals(src):
+    if osp.isfile(src):
+        return np.array([(d['start'], d['end'], i) for i, d in enumerate(read_pkl(src)['annotations'])], dtype=np.int64).reshape(-1, 3)
+    return np.load(osp.join(src, INTERVALS_FILE))
+
+
+def read_skipped(src):
+    if osp.isfile(src) or not osp.exists(osp.join(src, SKIPPED_FILE)):
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.load(osp.join(src, SKIPPED_FILE))
+
+
+def write_annotations(src, dst):
+    tmp = f'{dst}.tmp'
+    write_pkl(WindowDataset.load(src).to_annotations(), tmp)
+    os.replace(tmp, dst)
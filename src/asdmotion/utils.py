@@ -1,5 +1,10 @@
+import hashlib
 import json
+import os
 import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from json import JSONDecodeError
 from os import path as osp
 from pathlib import Path
@@ -39,7 +44,108 @@ def load_config(file):
         return OmegaConf.load(fp.name)
 
 
-def get_video_properties(filename):
+_FINGERPRINTS = OrderedDict()
+_FINGERPRINTS_LOCK = threading.Lock()
+FINGERPRINT_CACHE_SIZE = 4096
+
+
+def file_fingerprint(filename, chunk_size=1 << 20):
+    # Hash of the file's content and size, so renamed or copied files share it. Digests are remembered by path, size and
+    # modification time, keeping the most recently used FINGERPRINT_CACHE_SIZE files, so a file is read once per process.
+    filename = osp.abspath(filename)
+    stat = os.stat(filename)
+    token = (filename, stat.st_size, stat.st_mtime_ns)
+    with _FINGERPRINTS_LOCK:
+        if token in _FINGERPRINTS:
+            _FINGERPRINTS.move_to_end(token)
+            return _FINGERPRINTS[token]
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    digest = f'{h.hexdigest()}{stat.st_size:x}'
+    with _FINGERPRINTS_LOCK:
+        _FINGERPRINTS[token] = digest
+        while len(_FINGERPRINTS) > FINGERPRINT_CACHE_SIZE:
+            _FINGERPRINTS.popitem(last=False)
+    return digest
+
+
+class VideoPropertiesCache:
+    def __init__(self, cache_path=None):
+        self.cache_path = None
+        self._entries = {}
+        self._lock = threading.Lock()
+        if cache_path is not None:
+            self.attach(cache_path)
+
+    def attach(self, cache_path):
+        # Loads the properties saved at cache_path, which later saves write back to.
+        self.cache_path = cache_path
+        if osp.exists(cache_path):
+            entries = {k: (tuple(resolution) if resolution else resolution, fps, frame_count, length)
+                       for k, (resolution, fps, frame_count, length) in read_json(cache_path).items()}
+            with self._lock:
+                self._entries.update(entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, filename, count_frames=True, frame_index_path=None):
+        key = file_fingerprint(filename)
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+        properties = _probe_video_properties(filename, count_frames=count_frames, frame_index_path=frame_index_path)
+        if properties[2] is not None:
+            self.set(filename, properties, key=key)
+        return properties
+
+    def set(self, filename, properties, key=None):
+        key = key if key else file_fingerprint(filename)
+        with self._lock:
+            self._entries[key] = tuple(properties)
+
+    def save(self, cache_path=None):
+        cache_path = cache_path if cache_path else self.cache_path
+        with self._lock:
+            entries = dict(self._entries)
+        init_directories(osp.dirname(osp.abspath(cache_path)))
+        write_json(entries, cache_path)
+
+
+VIDEO_PROPERTIES_CACHE = VideoPropertiesCache()
+
+
+def get_video_properties(filename, cache=VIDEO_PROPERTIES_CACHE, count_frames=True, frame_index_path=None):
+    if cache is None:
+        return _probe_video_properties(filename, count_frames=count_frames, frame_index_path=frame_index_path)
+    return cache.get(filename, count_frames=count_frames, frame_index_path=frame_index_path)
+
+
+def set_frame_count(filename, frame_count, cache=VIDEO_PROPERTIES_CACHE):
+    resolution, fps, _, _ = get_video_properties(filename, cache=cache, count_frames=False)
+    properties = (resolution, fps, frame_count, frame_count / fps if fps else None)
+    if cache is not None:
+        cache.set(filename, properties)
+    return properties
+
+
+def probe_videos(filenames, num_workers=8, cache=VIDEO_PROPERTIES_CACHE, frame_index_paths=None):
+    # A video that cannot be probed maps to the error raised for it instead of failing the others.
+    frame_index_paths = frame_index_paths or {}
+
+    def probe(filename):
+        try:
+            return get_video_properties(filename, cache=cache, frame_index_path=frame_index_paths.get(filename))
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(min(num_workers, len(filenames)), 1)) as pool:
+        return dict(zip(filenames, pool.map(probe, filenames)))
+
+
+def _probe_video_properties(filename, count_frames=True, frame_index_path=None):
     try:
         vinf = ffmpeg.probe(filename)
 
@@ -58,7 +164,9 @@ def get_video_properties(filename):
             estimated_frame = length * fps
         frame_candidates = [eval(vinf['streams'][i]['nb_frames']) for i in range(len(vinf['streams'])) if 'nb_frames' in vinf['streams'][i].keys()]
         frame_candidates = [f for f in frame_candidates if np.abs(f - estimated_frame) < np.min((50, estimated_frame * 0.1))]
-        frame_count = int(np.max(frame_candidates)) if len(frame_candidates) > 0 else int(np.ceil(length * fps)) if length and fps else None
+        frame_count = int(np.max(frame_candidates)) if len(frame_candidates) > 0 else _count_frames(filename, frame_index_path)
+        if frame_count is None and length and fps:
+            frame_count = int(np.ceil(length * fps))
     except Exception:
         try:
             cap = cv2.VideoCapture(filename)
@@ -66,13 +174,15 @@ def get_video_properties(filename):
             fps = cap.get(cv2.CAP_PROP_FPS)
             frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
             if frame_count > 6e5:
+                frame_count = _count_frames(filename, frame_index_path)
+            if frame_count is None and count_frames:
                 frame_count = 0
                 while True:
                     ret, _ = cap.read()
                     if not ret:
                         break
                     frame_count += 1
-            length = frame_count / fps
+            length = frame_count / fps if frame_count is not None else None
         except Exception as e:
             raise e
         finally:
@@ -80,6 +190,15 @@ def get_video_properties(filename):
     return resolution, fps, frame_count, length
 
 
+def _count_frames(filename, frame_index_path=None):
+    # Counted from the video's frame index, which is saved at frame_index_path for the shards and pipes to reuse.
+    from asdmotion.pipeline.frame_index import load_frame_index
+    try:
+        return len(load_frame_index(filename, frame_index_path))
+    except Exception:
+        return None
+
+
 def read_pkl(file):
     try:
         with open(file, 'rb') as p:
@@ -0,0 +1,275 @@
+from os import path
+
+import numpy as np
+import pandas as pd
+from torch.utils.data import Dataset
+from tqdm import tqdm
+
+from asdmotion.utils import EPSILON
+
+# The row-by-row implementations that the vectorized code replaced, copied unchanged from the first commit. The equivalence
+# tests compare against them, so only the test inputs may be adapted to them.
+
+
+# asdmotion/child_detector/utils.py
+def get_box(row):
+    return np.array([row['xcenter'], row['ycenter'], row['width'], row['height']])
+
+
+def find_nearest(child_row, boxes):
+    cb = get_box(child_row)
+    iou = [get_iou(cb, b) for b in boxes]
+    nearest = np.argmax(iou)
+    return nearest, np.max(iou)
+
+
+def get_iou(_bb1, _bb2):
+    def convert(bb):
+        return {'x1': bb[0] - bb[2] // 2,
+                'y1': bb[1] - bb[3] // 2,
+                'x2': bb[0] + bb[2] // 2,
+                'y2': bb[1] + bb[3] // 2}
+
+    bb1 = convert(_bb1)
+    bb2 = convert(_bb2)
+
+    assert bb1['x1'] <= bb1['x2']
+    assert bb1['y1'] <= bb1['y2']
+    assert bb2['x1'] <= bb2['x2']
+    assert bb2['y1'] <= bb2['y2']
+
+    x_left = max(bb1['x1'], bb2['x1'])
+    y_top = max(bb1['y1'], bb2['y1'])
+    x_right = min(bb1['x2'], bb2['x2'])
+    y_bottom = min(bb1['y2'], bb2['y2'])
+
+    if x_right < x_left or y_bottom < y_top:
+        return 0.0
+
+    intersection_area = (x_right - x_left) * (y_bottom - y_top)
+    bb1_area = (bb1['x2'] - bb1['x1']) * (bb1['y2'] - bb1['y1'])
+    bb2_area = (bb2['x2'] - bb2['x1']) * (bb2['y2'] - bb2['y1'])
+
+    iou = intersection_area / float(bb1_area + bb2_area - intersection_area)
+    assert iou >= 0.0
+    assert iou <= 1.0
+    return iou
+
+
+def bounding_box(pose, score, epsilon=EPSILON):
+    pose, score = np.array(pose), np.array(score)
+    if pose.shape[1] == 2:
+        pose = pose.T
+    x, y = pose[0][score > epsilon], pose[1][score > epsilon]
+    if not any(x):
+        x = np.array([0])
+    if not any(y):
+        y = np.array([0])
+    w, h = (np.max(x) - np.min(x)), (np.max(y) - np.min(y))
+    return np.array([np.min(x) + w / 2, np.min(y) + h / 2, w, h]).reshape((2, 2))
+
+
+# asdmotion/child_detector/skeleton_matcher.py
+def get_boxes(kp, score):
+    M = kp.shape[0]
+    return [bounding_box(kp[i].T, score[i]).reshape(-1) for i in range(M)]
+
+class SkeletonMatcher:
+    def __init__(self, iou_threshold, conf_threshold, grace_distance, similarity_threshold, tolerance):
+        self.iou_threshold = iou_threshold
+        self.conf_threshold = conf_threshold
+        self.grace_distance = grace_distance
+        self.similarity_threshold = similarity_threshold
+        self.tolerance = tolerance
+
+    def _straight_match(self, detections, kp, kps, cids, detected, boxes):
+        child_box = None
+        for i, df in tqdm(enumerate(detections), desc='Skeleton Matcher'):
+            children = df[df['class'] == 1]
+            if children.shape[0] == 0:
+                continue
+            elif children.shape[0] > 1 and child_box is not None:
+                candidates = [(i, get_box(b)) for i, b in children.iterrows()]
+                ious = [get_iou(get_box(child_box), b) for _, b in candidates]
+                child_box = children.loc[candidates[np.argmax(ious)][0]]
+                # if not np.equal(child_box.values, children.loc[children['confidence'].idxmax()].values).all():
+                #     print('Different child box was chosen!')
+            else:
+                child_box = children.loc[children['confidence'].idxmax()]
+            boxes[i] = get_box(child_box)
+            cid, iou = find_nearest(child_box, get_boxes(kp[:, i, :, :], kps[:, i, :]))
+            if iou < self.iou_threshold:
+                continue
+            detected[i] = child_box['confidence']
+            cids[i] = cid
+
+
+    def _interpolate(self, detections, kp, kps, cids, detected, boxes):
+        env = [{} for _ in detected]
+
+        def scan(lst, key, reverse):
+            tmp = None
+            for i, child_conf in reversed(list(enumerate(lst))) if reverse else enumerate(lst):
+                if child_conf > self.conf_threshold:
+                    tmp = i
+                env[i][key] = tmp
+
+        scan(detected, 'prev', reverse=False)
+        scan(detected, 'next', reverse=True)
+
+        for i, df in tqdm(enumerate(detections), desc='Interpolate'):
+            if detected[i] > self.conf_threshold:
+                continue
+            prev, next = env[i]['prev'], env[i]['next']
+            if not ((prev and np.abs(prev - i) < self.grace_distance) or (next and np.abs(next - i) < self.grace_distance)):
+                continue
+            j = prev if next is None else next if prev is None else prev if abs(i - prev) >= abs(next - i) else next
+            _df = detections[j]
+            children = _df[_df['class'] == 1]
+            child_box = children.loc[children['confidence'].idxmax()]
+            candidate, candidate_iou = find_nearest(child_box, get_boxes(kp[:, i, :, :], kps[:, i, :]))
+            if candidate_iou < self.iou_threshold:
+                continue
+            adults = df[df['class'] == 0]
+            adults_matches = [(idx, find_nearest(adult_box, get_boxes(kp[:, i, :, :], kps[:, i, :]))) for idx, adult_box in adults.iterrows()]
+            conflicts = [(idx, a, iou) for idx, (a, iou) in adults_matches if a == candidate and iou > self.iou_threshold]
+            if any(rival_iou > candidate_iou and \
+                   not get_iou(get_box(child_box), get_box(adults.loc[idx])) > self.similarity_threshold for idx, _, rival_iou in conflicts):
+                continue
+            cids[i] = candidate
+            boxes[i] = get_box(child_box)
+
+
+    def match_skeleton(self, skeleton, detections):
+        skeleton = skeleton.copy()
+        kp = skeleton['keypoint']
+        kps = skeleton['keypoint_score']
+        _, T, _, _ = kp.shape
+        adj = len(detections) - T
+        if np.abs(adj) > self.tolerance:
+            raise IndexError(f'Length mismatch: skeleton({T}) - video({len(detections)})')
+        # if adj <= 0:
+        #     detections = detections + [detections[-1]] * np.abs(adj)
+        # else:
+        #     detections = detections[adj:]
+
+        skeleton['child_ids'] = np.ones(T) * -1
+        skeleton['child_detected'] = np.zeros(T)
+        skeleton['child_bbox'] = np.zeros((T, 4))
+
+        cids = skeleton['child_ids']
+        detected = skeleton['child_detected']
+        boxes = skeleton['child_bbox']
+        _, detections = list(zip(*detections))
+        self._straight_match(detections, kp, kps, cids, detected, boxes)
+        self._interpolate(detections, kp, kps, cids, detected, boxes)
+        return skeleton
+
+
+# asdmotion/pipeline/splitter.py
+class Splitter(Dataset):
+    def __init__(self, skeleton, sequence_length, step_size, min_length):
+        self.skeleton = skeleton
+        self.sequence_length = sequence_length
+        self.step_size = step_size
+        self.min_length = min_length
+        self.N, self.T, self.J, self.C = self.skeleton['keypoint'].shape
+
+        self.intervals = [(x, min(x + self.sequence_length, self.T))
+                          for x in range(0, max(self.T, self.T - self.sequence_length + self.step_size), self.step_size)
+                          if (min(x + self.sequence_length, self.T) - x) >= self.min_length]
+        self.template = {k: v for k, v in self.skeleton.items() if k not in ['keypoint', 'keypoint_score', 'total_frames', 'frame_dir', 'child_detected', 'child_ids']}
+        self.template['basename'] = self.skeleton['frame_dir']
+
+    def __getitem__(self, index):
+        s, t = self.intervals[index]
+        kp = self.skeleton['keypoint'][:, s:t, :, :]
+        kps = self.skeleton['keypoint_score'][:, s:t, :]
+        basename, _ = path.splitext(self.template["basename"])
+        out = {**dict(self.template),
+               **{'keypoint': kp,
+                  'keypoint_score': kps,
+                  'frame_dir': f'{basename}_{index}',
+                  'total_frames': t - s,
+                  'segment_name': f'{basename}_{s}_{t}',
+                  'start': s,
+                  'end': t,
+                  'label': -1}}
+        if 'child_detected' in self.skeleton.keys():
+            out['child_detected'] = self.skeleton['child_detected'][s:t]
+            out['child_ids'] = self.skeleton['child_ids'][s:t]
+
+        return out
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def collect(self):
+        return [x for x in self]
+
+
+# asdmotion/pipeline/aggregator.py
+# The module never defined NET_NAME, the annotator of every segment, so the tests set it.
+NET_NAME = None
+
+
+def unify(df):
+    _df = pd.DataFrame(columns=df.columns)
+
+    def calc_weighted_mean_score(rows):
+        weights = [(row['end_frame'] - row['start_frame']) / (rows[-1]['end_frame'] - rows[0]['start_frame']) for row in rows]
+        scores = [row['stereotypical_score'] for row in rows]
+        return np.average(scores, weights=weights)
+
+    n = df.shape[0]
+    i = 0
+    while i < n:
+        curr = df.iloc[i]
+        if curr['movement'] == 'Stereotypical':
+            merge = [curr]
+            j = i + 2
+            while j < df.shape[0] - 1:
+                next_row = df.iloc[j]
+                if next_row['start_frame'] < curr['end_frame']:
+                    merge.append(next_row)
+                    curr = next_row
+                    j += 2
+                    i += 2
+                else:
+                    break
+            _df.loc[_df.shape[0]] = [merge[0]['video'], merge[0]['video_full_name'], merge[0]['video_path'], merge[0]['start_time'], merge[-1]['end_time'], merge[0]['start_frame'], merge[-1]['end_frame'],
+                                     merge[0]['movement'], merge[0]['calc_date'], merge[0]['annotator'], calc_weighted_mean_score(merge)]
+        else:
+            start_time = _df.iloc[_df.shape[0] - 1]['end_time'] if i > 0 else curr['start_time']
+            end_time = df.iloc[i + 1]['start_time'] if i < n - 1 else curr['end_time']
+            start_frame = _df.iloc[_df.shape[0] - 1]['end_frame'] if i > 0 else curr['start_frame']
+            end_frame = df.iloc[i + 1]['start_frame'] if i < n - 1 else curr['end_frame']
+            _df.loc[_df.shape[0]] = [curr['video'], curr['video_full_name'], curr['video_path'], start_time, end_time, start_frame, end_frame,
+                                     curr['movement'], curr['calc_date'], curr['annotator'], curr['stereotypical_score']]
+        i += 1
+    return _df
+
+
+def aggregate(df, threshold):
+    _df = pd.DataFrame(columns=df.columns)
+    df['prediction'] = np.where(df['stereotypical_score'] > threshold, 'Stereotypical', 'NoAction')
+    i = 0
+    while i < df.shape[0]:
+        r = df.iloc[i]
+        s, t, c, p = r['start_frame'], r['end_frame'], r['stereotypical_score'], r['prediction']
+        _s, _t = r['start_time'], r['end_time']
+        score = [c]
+        j = i + 1
+        while j < df.shape[0]:
+            rr = df.iloc[j]
+            ss, tt, cc, pp = rr['start_frame'], rr['end_frame'], rr['stereotypical_score'], rr['prediction']
+            if p == pp:
+                t = tt
+                _t = rr['end_time']
+                score.append(cc)
+            else:
+                break
+            j += 1
+        _df.loc[_df.shape[0]] = [r['video'], r['video_full_name'], r['video_path'], _s, _t, s, t, p, pd.Timestamp.now(), NET_NAME, np.mean(score)]
+        i = j
+    return unify(_df)
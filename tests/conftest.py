@@ -0,0 +1,8 @@
+import os
+import sys
+from os import path as osp
+
+ROOT = osp.dirname(osp.dirname(osp.abspath(__file__)))
+sys.path.insert(0, osp.join(ROOT, 'src'))
+# The application logger writes to resources/logs and fails when it is missing.
+os.makedirs(osp.join(ROOT, 'resources', 'logs'), exist_ok=True)
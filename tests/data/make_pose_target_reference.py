@@ -0,0 +1,59 @@
+# Regenerates pose_target_reference.npz with mmaction2 0.x (on numpy 1.x): random windows and the heatmap volumes that
+# mmaction's own pipeline makes from them. A small pipeline is kept whole; for the model's pipeline only digests are kept.
+import hashlib
+from os import path as osp
+
+import numpy as np
+from mmaction.datasets.pipelines import CenterCrop, FormatShape, GeneratePoseTarget, PoseCompact, PoseDecode, Resize, UniformSampleFrames
+
+LEFT_KP = [1, 3, 5, 7, 9, 11, 13, 15]
+RIGHT_KP = [2, 4, 6, 8, 10, 12, 14, 16]
+PIPELINES = {'small': dict(clip_len=4, num_clips=2, size=12, lengths=[2, 3, 4, 5, 7, 30, 61], trials=8),
+             'model': dict(clip_len=48, num_clips=10, size=56, lengths=[30, 47, 96], trials=3)}
+
+
+def pipeline(clip_len, num_clips, size):
+    return [UniformSampleFrames(clip_len=clip_len, num_clips=num_clips, test_mode=True), PoseDecode(), PoseCompact(hw_ratio=1., allow_imgpad=True),
+            Resize(scale=(-1, size)), CenterCrop(crop_size=size),
+            GeneratePoseTarget(sigma=0.6, use_score=True, with_kp=True, with_limb=False, double=True, left_kp=LEFT_KP, right_kp=RIGHT_KP),
+            FormatShape(input_format='NCTHW')]
+
+
+def random_window(rng, trial, lengths):
+    M, T = int(rng.integers(1, 6)), int(rng.choice(lengths))
+    W, H = int(rng.choice([640, 1280, 1920])), int(rng.choice([360, 720, 1080]))
+    kp = np.stack([rng.uniform(0, W, (M, T, 17)), rng.uniform(0, H, (M, T, 17))], -1)
+    if trial % 3 == 0:
+        kp = kp * rng.uniform(0.05, 0.3) + rng.uniform(0, 300)
+    score = rng.uniform(0, 1, (M, T, 17)).astype(np.float32)
+    drop = rng.random((M, T, 17)) < 0.3
+    kp[drop], score[drop] = 0, 0
+    if trial % 7 == 0:
+        # A tiny horizontal extent, for which PoseCompact leaves the keypoints as they are.
+        kp[..., 0] *= 0.001
+    score[rng.random((M, T, 17)) < 0.05] = 5e-5
+    return dict(keypoint=kp.astype(np.float32), keypoint_score=score, total_frames=T, img_shape=(H, W), start_index=0, modality='Pose')
+
+
+def main():
+    rng, out = np.random.default_rng(0), {}
+    for name, p in PIPELINES.items():
+        steps = pipeline(p['clip_len'], p['num_clips'], p['size'])
+        for trial in range(p['trials']):
+            window = random_window(rng, trial, p['lengths'])
+            results = dict(window, keypoint=window['keypoint'].copy())
+            for step in steps:
+                results = step(results)
+            prefix = f'{name}_{trial}_'
+            out[prefix + 'keypoint'], out[prefix + 'keypoint_score'] = window['keypoint'], window['keypoint_score']
+            out[prefix + 'img_shape'] = np.array(window['img_shape'])
+            if name == 'small':
+                out[prefix + 'imgs'] = results['imgs']
+            else:
+                out[prefix + 'digest'] = np.array(hashlib.sha1(np.ascontiguousarray(results['imgs']).tobytes()).hexdigest())
+                out[prefix + 'shape'] = np.array(results['imgs'].shape)
+    np.savez_compressed(osp.join(osp.dirname(osp.abspath(__file__)), 'pose_target_reference.npz'), **out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+import time
+from os import path as osp
+
+# Stands in for OpenPoseDemo: writes one BODY_25 JSON file per frame into --write_json, one after the other, as OpenPose
+# does while it runs. The number of frames and the delay after each one come from the environment.
+FRAMES_ENV = 'STUB_OPENPOSE_FRAMES'
+DELAY_ENV = 'STUB_OPENPOSE_DELAY'
+NUM_JOINTS = 25
+
+
+def people(frame):
+    return [{'person_id': [-1], 'pose_keypoints_2d': [float((frame * 7 + p * 3 + j) % 100) for j in range(NUM_JOINTS * 3)]} for p in range(frame % 3)]
+
+
+def write_frames(out_dir, first, last, delay=0.0, name='video'):
+    os.makedirs(out_dir, exist_ok=True)
+    for i in range(first, last + 1):
+        with open(osp.join(out_dir, f'{name}_{i:012d}_keypoints.json'), 'w') as f:
+            json.dump({'version': 1.3, 'people': people(i)}, f)
+        time.sleep(delay)
+
+
+def parse_args(argv):
+    args, key = {}, None
+    for a in argv:
+        if a.startswith('--'):
+            key = a[2:]
+            args[key] = ''
+        elif key is not None:
+            args[key] = a
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    first = int(args.get('frame_first') or 0)
+    last = int(args['frame_last']) if args.get('frame_last') else int(os.environ.get(FRAMES_ENV, 30)) - 1
+    write_frames(args['write_json'], first, last, delay=float(os.environ.get(DELAY_ENV, 0)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import baseline
+from asdmotion.pipeline.aggregator import aggregate, aggregate_thresholds, threshold_totals
+from asdmotion.pipeline.window_dataset import coverage, spans, split_intervals
+
+COLUMNS = ['video', 'video_full_name', 'video_path', 'start_time', 'end_time', 'start_frame', 'end_frame', 'movement', 'calc_date', 'annotator',
+           'stereotypical_score']
+# The baseline labels every segment with its module's NET_NAME, where the windows carry the annotator themselves.
+baseline.NET_NAME = 'm'
+
+
+def window_scores(rng, T, sequence_length, step_size, nochild=False):
+    intervals = split_intervals(T, sequence_length, step_size, 30)
+    skipped = np.zeros((0, 2), dtype=np.int64)
+    if nochild:
+        # Windows are dropped in runs, and the frames that only dropped windows cover become NoChild rows.
+        keep = np.repeat(rng.random(intervals.shape[0] // 5 + 1) > 0.3, 5)[:intervals.shape[0]]
+        skipped = spans(coverage(intervals[~keep], T) & ~coverage(intervals[keep], T))
+        intervals = intervals[keep]
+    rows = [['v', 'v.mp4', '/v', s / 30, t / 30, s, t, -1, pd.Timestamp.now(), 'm', score]
+            for (s, t, _), score in zip(intervals.tolist(), rng.beta(0.5, 0.5, intervals.shape[0]))]
+    rows += [['v', 'v.mp4', '/v', s / 30, t / 30, s, t, 'NoChild', pd.Timestamp.now(), 'm', np.nan] for s, t in skipped.tolist()]
+    return pd.DataFrame(rows, columns=COLUMNS).sort_values(by='start_frame', kind='stable').reset_index(drop=True)
+
+
+def assert_same_segments(expected, actual):
+    assert expected.shape == actual.shape
+    for c in ['start_time', 'end_time', 'start_frame', 'end_frame']:
+        np.testing.assert_array_equal(expected[c].to_numpy(dtype=float), actual[c].to_numpy(dtype=float))
+    for c in ['movement', 'annotator']:
+        np.testing.assert_array_equal(expected[c].astype(str).to_numpy(), actual[c].astype(str).to_numpy())
+    np.testing.assert_allclose(expected['stereotypical_score'].to_numpy(dtype=float), actual['stereotypical_score'].to_numpy(dtype=float),
+                               rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_aggregate_matches_baseline(seed):
+    rng = np.random.default_rng(seed)
+    for trial in range(40):
+        df = window_scores(rng, int(rng.integers(1, 3000)), int(rng.choice([100, 200])), int(rng.choice([30, 60, 200, 250])))
+        threshold = float(rng.choice([0.2, 0.5, 0.85]))
+        expected, actual = baseline.aggregate(df.copy(), threshold), aggregate(df.copy(), threshold)
+        assert list(expected.columns) == list(actual.columns)
+        assert_same_segments(expected, actual)
+
+
+def test_nochild_rows_form_their_own_segments():
+    rng = np.random.default_rng(0)
+    for trial in range(20):
+        df = window_scores(rng, int(rng.integers(500, 3000)), 200, 30, nochild=True)
+        segments = aggregate(df.copy(), float(rng.choice([0.2, 0.5, 0.85])))
+        nochild = segments[segments['movement'] == 'NoChild']
+        expected = df[df['movement'] == 'NoChild']
+        np.testing.assert_array_equal(nochild[['start_frame', 'end_frame']].to_numpy(dtype=float), expected[['start_frame', 'end_frame']].to_numpy(dtype=float))
+        assert nochild['stereotypical_score'].isna().all()
+        assert not segments['stereotypical_score'][segments['movement'] != 'NoChild'].isna().any()
+
+
+def thresholds_for(rng, df):
+    # Scores themselves are included, since a threshold equal to a score is where predictions flip.
+    return np.concatenate([rng.random(int(rng.integers(1, 8))), df['stereotypical_score'].dropna().to_numpy()[:3]])
+
+
+def stacked(aggregate_fn, df, thresholds):
+    expected = []
+    for t in thresholds:
+        segments = aggregate_fn(df.copy(), t)
+        segments['threshold'] = t
+        expected.append(segments)
+    return pd.concat(expected, ignore_index=True)
+
+
+def test_aggregate_thresholds_matches_per_threshold_baseline():
+    rng = np.random.default_rng(0)
+    for trial in range(15):
+        df = window_scores(rng, int(rng.integers(1, 3000)), 200, int(rng.choice([30, 60, 250])))
+        thresholds = thresholds_for(rng, df)
+        expected, actual = stacked(baseline.aggregate, df, thresholds), aggregate_thresholds(df.copy(), thresholds)
+        assert_same_segments(expected, actual)
+        np.testing.assert_array_equal(expected['threshold'].to_numpy(dtype=float), actual['threshold'].to_numpy(dtype=float))
+
+
+def test_aggregate_thresholds_matches_aggregate_with_nochild_rows():
+    rng = np.random.default_rng(1)
+    for trial in range(15):
+        df = window_scores(rng, int(rng.integers(500, 3000)), 200, 30, nochild=True)
+        thresholds = thresholds_for(rng, df)
+        expected, actual = stacked(aggregate, df, thresholds), aggregate_thresholds(df.copy(), thresholds)
+        assert_same_segments(expected, actual)
+        np.testing.assert_array_equal(expected['threshold'].to_numpy(dtype=float), actual['threshold'].to_numpy(dtype=float))
+
+
+def test_threshold_totals_match_segments():
+    rng = np.random.default_rng(1)
+    df = window_scores(rng, 5000, 200, 30, nochild=True)
+    thresholds = np.linspace(0, 1, 11)
+    smm_count, smm_frames, skipped_frames = threshold_totals(df.copy(), thresholds)
+    for i, t in enumerate(thresholds):
+        segments = aggregate(df.copy(), t)
+        frames = segments['end_frame'] - segments['start_frame']
+        assert smm_count[i] == (segments['movement'] == 'Stereotypical').sum()
+        assert smm_frames[i] == frames[segments['movement'] == 'Stereotypical'].sum()
+        assert skipped_frames[i] == frames[segments['movement'] == 'NoChild'].sum()
+
+
+def test_aggregate_empty():
+    df = pd.DataFrame(columns=COLUMNS)
+    assert aggregate(df.copy(), 0.5).shape[0] == 0
+    assert aggregate_thresholds(df.copy(), [0.5]).shape[0] == 0
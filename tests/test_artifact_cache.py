@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from asdmotion import utils
+from asdmotion.pipeline.artifact_cache import ArtifactCache
+from asdmotion.utils import file_fingerprint
+
+
+@pytest.fixture
+def cache(tmp_path):
+    c = ArtifactCache(str(tmp_path / 'artifacts'))
+    yield c
+    c.close()
+
+
+def test_key_follows_kind_params_and_inputs():
+    key = ArtifactCache.key('skeleton', {'layout': 'coco', 'num_person_out': 5}, ['video'])
+    assert key == ArtifactCache.key('skeleton', {'num_person_out': 5, 'layout': 'coco'}, ['video'])
+    assert len({key, ArtifactCache.key('detections', {'layout': 'coco', 'num_person_out': 5}, ['video']),
+                ArtifactCache.key('skeleton', {'layout': 'coco', 'num_person_out': 3}, ['video']),
+                ArtifactCache.key('skeleton', {'layout': 'coco', 'num_person_out': 5}, ['other video'])}) == 4
+
+
+def test_fingerprint_follows_content(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'FINGERPRINT_CACHE_SIZE', 2)
+    a, b = tmp_path / 'a.mp4', tmp_path / 'b.mp4'
+    a.write_bytes(b'frames' * 1000)
+    b.write_bytes(b'frames' * 1000)
+    assert file_fingerprint(str(a)) == file_fingerprint(str(b))
+    b.write_bytes(b'other frames' * 1000)
+    assert file_fingerprint(str(a)) != file_fingerprint(str(b))
+    assert len(utils._FINGERPRINTS) <= 2
+
+
+def test_record_and_lineage(tmp_path, cache):
+    video = file_fingerprint(__file__)
+    raw_key = ArtifactCache.key('skeleton_raw', {'openpose': 'BODY_25'}, [video])
+    raw_path = cache.path('skeleton_raw', raw_key, '.skeleton')
+    assert raw_path.startswith(cache.root) and raw_key in raw_path
+    assert not cache.contains(raw_key)
+    os.makedirs(raw_path)
+    cache.record(raw_key, 'skeleton_raw', raw_path, {'openpose': 'BODY_25'}, [video], source=__file__)
+    assert cache.contains(raw_key)
+    skeleton_key = ArtifactCache.key('skeleton', {'matched': True}, [raw_key])
+    cache.record(skeleton_key, 'skeleton', cache.path('skeleton', skeleton_key), {'matched': True}, [raw_key])
+    # A recorded artifact whose file is gone is not reused.
+    assert not cache.contains(skeleton_key)
+
+    lineage = cache.lineage(skeleton_key)
+    assert [r['key'] for r in lineage] == [skeleton_key, raw_key, video]
+    assert lineage[0]['params'] == {'matched': True} and lineage[0]['inputs'] == [raw_key]
+    assert lineage[1]['kind'] == 'skeleton_raw' and lineage[1]['source'] == __file__
+    assert lineage[2] == {'key': video}
+
+
+def test_discard_removes_leftovers(tmp_path, cache):
+    d, f = tmp_path / 'partial.skeleton', tmp_path / 'partial.npz'
+    d.mkdir()
+    (d / 'keypoint.npy').write_bytes(b'')
+    f.write_bytes(b'')
+    for p in (d, f, tmp_path / 'missing'):
+        cache.discard(str(p))
+        assert not p.exists()
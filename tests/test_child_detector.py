@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+import torch
+
+from asdmotion.child_detector.child_detector import ChildDetector
+from asdmotion.child_detector.detections import BOX_FIELDS
+
+
+class FakeResults:
+    def __init__(self, xywh):
+        self.xywh = xywh
+
+
+class FakeModel:
+    # Detects a child and an adult moving linearly. Past `jump`, the child moves elsewhere and an extra adult appears.
+    def __init__(self, jump=None):
+        self.jump = jump
+        self.calls = []
+
+    def detect(self, i):
+        child = [100 + i, 80 + 0.5 * i, 50, 120, 0.9, 1]
+        adult = [400 - i, 60, 90, 200, 0.8, 0]
+        rows = [child, adult]
+        if self.jump is not None and i >= self.jump:
+            rows = [[child[0] + 300, *child[1:]], adult, [50, 50, 40, 40, 0.6, 0]]
+        return torch.tensor(rows, dtype=torch.float32)
+
+    def __call__(self, frames, size):
+        indices = [int(f[0]) for f in frames]
+        self.calls += indices
+        return FakeResults([self.detect(i) for i in indices])
+
+
+class FakeLoader:
+    def __init__(self, num_frames, batch_size):
+        self.num_frames = num_frames
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        for s in range(0, self.num_frames, self.batch_size):
+            yield [np.array([i]) for i in range(s, min(s + self.batch_size, self.num_frames))]
+
+    def to_original(self, xywh):
+        return xywh
+
+
+def detector(model, stride, batch_size=16):
+    d = ChildDetector.__new__(ChildDetector)
+    d.model, d.batch_size, d.size, d.stride, d.track_iou, d.track_confidence = model, batch_size, 640, stride, 0.5, 0.5
+    return d
+
+
+def detect(model, stride, num_frames, batch_size=16):
+    return detector(model, stride, batch_size)._detect_strided(FakeLoader(num_frames, batch_size))
+
+
+def assert_same_detections(expected, actual):
+    assert len(expected) == len(actual)
+    for i in range(len(expected)):
+        e, a = np.sort(expected.frame(i), order=['class', 'xcenter']), np.sort(actual.frame(i), order=['class', 'xcenter'])
+        np.testing.assert_array_equal(e['class'], a['class'])
+        for f in BOX_FIELDS + ['confidence']:
+            np.testing.assert_allclose(e[f], a[f], atol=1e-4)
+
+
+@pytest.mark.parametrize('stride, num_frames', [(2, 50), (4, 50), (5, 37), (8, 16)])
+def test_strided_matches_dense_on_linear_motion(stride, num_frames):
+    dense_model, strided_model = FakeModel(), FakeModel()
+    dense = detect(dense_model, 1, num_frames)
+    strided = detect(strided_model, stride, num_frames)
+    assert_same_detections(dense, strided)
+    assert len(strided_model.calls) < len(dense_model.calls) == num_frames
+
+
+def test_strided_redetects_frames_around_a_track_break():
+    model = FakeModel(jump=21)
+    strided = detect(model, 4, 50)
+    assert_same_detections(detect(FakeModel(jump=21), 1, 50), strided)
+    # The key frames 20 and 24 cannot be tracked from one to the other, so the frames between them are detected.
+    assert {21, 22, 23} <= set(model.calls)
+    assert not {25, 26, 27} & set(model.calls)
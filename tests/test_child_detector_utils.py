@@ -0,0 +1,31 @@
+import numpy as np
+
+import baseline
+from asdmotion.child_detector.utils import bounding_boxes, iou_matrix
+
+
+def test_iou_matrix_matches_get_iou():
+    rng = np.random.default_rng(0)
+    a = np.concatenate([rng.uniform(0, 300, (40, 2)), rng.uniform(4, 200, (40, 2))], axis=1).round()
+    b = np.concatenate([rng.uniform(0, 300, (30, 2)), rng.uniform(4, 200, (30, 2))], axis=1)
+    ious = iou_matrix(a, b)
+    assert ious.shape == (40, 30)
+    np.testing.assert_allclose(ious, [[baseline.get_iou(x, y) for y in b] for x in a], rtol=1e-12)
+
+
+def test_iou_matrix_of_degenerate_boxes_is_zero():
+    boxes = np.array([[10, 10, 0, 0], [10, 10, 1, 1]], dtype=np.float64)
+    np.testing.assert_array_equal(iou_matrix(boxes, boxes), np.zeros((2, 2)))
+
+
+def test_bounding_boxes_match_bounding_box():
+    rng = np.random.default_rng(1)
+    kp = rng.uniform(0, 1280, (3, 50, 17, 2)).astype(np.float32)
+    kps = rng.random((3, 50, 17)).astype(np.float32)
+    kps[kps < 0.3] = 0
+    kps[0, 7] = 0
+    boxes = bounding_boxes(kp, kps)
+    assert boxes.shape == (3, 50, 4)
+    for m in range(3):
+        for t in range(50):
+            np.testing.assert_allclose(boxes[m, t], baseline.bounding_box(kp[m, t].T, kps[m, t]).reshape(-1), rtol=1e-6)
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from asdmotion.child_detector.detections import Detections, read_detections
+from asdmotion.utils import write_pkl
+
+COLUMNS = ['xcenter', 'ycenter', 'width', 'height', 'confidence', 'class']
+
+
+def dataframes(T=60, seed=0):
+    rng = np.random.default_rng(seed)
+    detections = []
+    for i in range(T):
+        n = int(rng.integers(0, 4))
+        detections.append((i, pd.DataFrame({'xcenter': rng.uniform(0, 640, n), 'ycenter': rng.uniform(0, 480, n), 'width': rng.uniform(10, 200, n),
+                                            'height': rng.uniform(10, 200, n), 'confidence': rng.random(n), 'class': rng.integers(0, 2, n),
+                                            'name': np.where(rng.random(n) < 0.5, 'child', 'adult')})))
+    return detections
+
+
+def assert_same_frames(expected, actual):
+    assert len(expected) == len(actual)
+    for (i, e), (j, a) in zip(expected, actual):
+        assert i == j
+        np.testing.assert_array_equal(e[COLUMNS].to_numpy(dtype=np.float64), a[COLUMNS].to_numpy(dtype=np.float64))
+
+
+def test_round_trip(tmp_path):
+    detections = Detections.from_dataframes(dataframes())
+    detections.save(str(tmp_path / 'a_detections.npz'))
+    loaded = read_detections(str(tmp_path / 'a_detections.npz'))
+    assert loaded.rows.dtype == detections.rows.dtype
+    np.testing.assert_array_equal(loaded.rows, detections.rows)
+    np.testing.assert_array_equal(loaded.frame_offsets, detections.frame_offsets)
+    assert_same_frames(dataframes(), loaded.to_dataframes())
+
+
+def test_reads_legacy_pickle(tmp_path):
+    write_pkl(dataframes(), str(tmp_path / 'a_detections.pkl'))
+    detections = read_detections(str(tmp_path / 'a_detections.npz'))
+    assert len(detections) == 60
+    assert_same_frames(dataframes(), detections.to_dataframes())
+
+
+def test_best_takes_the_most_confident_box_per_frame():
+    detections = Detections.from_dataframes(dataframes(T=200, seed=1))
+    best, rows = detections.best(1)
+    for i, df in dataframes(T=200, seed=1):
+        children = df[df['class'] == 1]
+        if children.shape[0] == 0:
+            assert best[i] == -1
+        else:
+            assert rows[best[i]]['confidence'] == children['confidence'].max()
+            assert rows[best[i]]['frame'] == i
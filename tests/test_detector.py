@@ -0,0 +1,148 @@
+import sys
+from os import path as osp
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from asdmotion.detector import detector
+from asdmotion.detector.inference_client import InferenceWorker
+from asdmotion.detector.results_store import ResultsStore
+from asdmotion.pipeline.window_dataset import WindowDataset, read_intervals
+
+FPS = 30
+LABELS = ['NoAction', 'Stereotypical']
+
+
+class FakeWorker(InferenceWorker):
+    # Serves deterministic random scores and records the size of every request.
+    requests = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, python_cmd=[sys.executable], fake_classes=2, **{k: v for k, v in kwargs.items() if k.startswith('tta')})
+
+    def predict(self, windows):
+        FakeWorker.requests.append(len(windows))
+        return super().predict(windows)
+
+
+@pytest.fixture
+def fake_worker(monkeypatch):
+    FakeWorker.requests = []
+    monkeypatch.setattr(detector, 'InferenceWorker', FakeWorker)
+    return FakeWorker
+
+
+def video_info(work_dir, name, T, child_frames, seed=0, step_size=30):
+    rng = np.random.default_rng(seed)
+    skeleton = {'keypoint': rng.random((2, T, 17, 2), dtype=np.float32), 'keypoint_score': rng.random((2, T, 17), dtype=np.float32), 'frame_dir': name,
+                'img_shape': (720, 1280), 'original_shape': (720, 1280), 'total_frames': T,
+                'child_ids': np.where(np.arange(T) < child_frames, 0, -1), 'child_detected': np.arange(T) < child_frames}
+    prefix = osp.join(work_dir, name)
+    WindowDataset.from_skeleton(skeleton, 200, step_size, 30, min_valid_ratio=0.5).save(f'{prefix}.windows')
+    return {'name': name, 'fullname': f'{name}.mp4', 'video_path': f'/videos/{name}.mp4', 'dataset_path': f'{prefix}.windows', 'binary_cfg_path': 'binary_cfg.py',
+            'properties': {'fps': FPS, 'length': T / FPS, 'frame_count': T, 'valid_frames': child_frames, 'last_valid_frame': child_frames},
+            'predictions_path': f'{prefix}_predictions.pkl', 'scores_path': f'{prefix}_scores.csv', 'annotations_path': f'{prefix}_annotations.csv',
+            'conclusion_path': f'{prefix}_conclusion.csv'}
+
+
+def predictor(work_dir, model='model', **kwargs):
+    return detector.Predictor(str(work_dir), model, 0.85, LABELS, None, None, inference_worker=True, **kwargs)
+
+
+def test_score_videos_sends_one_request(tmp_path, fake_worker):
+    (tmp_path / 'batched').mkdir()
+    (tmp_path / 'single').mkdir()
+    specs = [('a_1_2_3', 3000, 2500), ('b_1_2_3', 1000, 1000), ('c_1_2_3', 2000, 1200)]
+    p = predictor(tmp_path)
+    try:
+        batched = p.score_videos([video_info(str(tmp_path / 'batched'), *spec, seed=k) for k, spec in enumerate(specs)])
+    finally:
+        p.close()
+    assert len(fake_worker.requests) == 1
+
+    p = predictor(tmp_path)
+    try:
+        single = [p.score_videos([video_info(str(tmp_path / 'single'), *spec, seed=k)])[0] for k, spec in enumerate(specs)]
+    finally:
+        p.close()
+    assert len(fake_worker.requests) == 1 + len(specs)
+    assert fake_worker.requests[0] == sum(fake_worker.requests[1:])
+    for b, s in zip(batched, single):
+        np.testing.assert_allclose(b['stereotypical_score'].to_numpy(dtype=float), s['stereotypical_score'].to_numpy(dtype=float))
+        np.testing.assert_array_equal(b['start_frame'], s['start_frame'])
+        np.testing.assert_array_equal(b['movement'].astype(str), s['movement'].astype(str))
+
+
+def test_video_without_sequences_concludes_with_zeros(tmp_path, fake_worker):
+    info = video_info(str(tmp_path), 'a_1_2_3', 1500, 0)
+    p = predictor(tmp_path)
+    try:
+        annotations = p.annotate_video(info)
+    finally:
+        p.close()
+    assert fake_worker.requests == []
+    assert (annotations['movement'] == 'NoChild').all()
+    conclusion = pd.read_csv(info['conclusion_path'])
+    assert conclusion.shape[0] == 1
+    assert conclusion.loc[0, 'smm_count'] == 0 and conclusion.loc[0, 'skipped_frames'] == 1500
+
+
+def test_conclusions_share_the_store_assessment(tmp_path, fake_worker):
+    pytest.importorskip('pyarrow')
+    # The name has no assessment part, so every conclusion falls back to the store's partition name.
+    info = video_info(str(tmp_path), 'clip_1', 1500, 1500)
+    p = predictor(tmp_path, results_store_path=str(tmp_path / 'store'))
+    try:
+        p.annotate_video(info)
+        thresholds = p.conclude_thresholds(info, [0.5, 0.9])
+    finally:
+        p.close()
+    assert pd.read_csv(info['conclusion_path'])['assessment'].tolist() == ['unknown']
+    assert ResultsStore(str(tmp_path / 'store')).cohort_conclusions()['assessment'].tolist() == ['unknown']
+    assert thresholds['assessment'].tolist() == ['unknown', 'unknown']
+
+
+def test_adaptive_tta_requires_the_inference_worker(tmp_path):
+    with pytest.raises(ValueError):
+        detector.Predictor(str(tmp_path), 'model', 0.85, LABELS, None, None, inference_worker=False, adaptive_tta=True)
+
+
+def test_adaptive_tta_keeps_the_annotations(tmp_path, fake_worker):
+    annotations = {}
+    for adaptive in [False, True]:
+        work_dir = tmp_path / str(adaptive)
+        work_dir.mkdir()
+        p = predictor(work_dir, adaptive_tta=adaptive)
+        try:
+            annotations[adaptive] = p.annotate_videos([video_info(str(work_dir), 'a_1_2_3', 3000, 2500)])[0].drop(columns='calc_date')
+        finally:
+            p.close()
+    pd.testing.assert_frame_equal(annotations[True], annotations[False])
+    assert (annotations[True]['movement'] == 'Stereotypical').any()
+
+
+def test_score_cache_computes_only_missing_sequences(tmp_path, fake_worker, monkeypatch):
+    monkeypatch.setattr(detector, 'aggregate', lambda df, threshold: df)
+    model, cfg = tmp_path / 'model.pth', tmp_path / 'binary_cfg.py'
+    model.write_bytes(b'weights')
+    cfg.write_text("model = dict(type='Recognizer3D')\n")
+    for d in ['first', 'renamed', 'resplit']:
+        (tmp_path / d).mkdir()
+    p = predictor(tmp_path, model=str(model), score_cache_path=str(tmp_path / 'scores.sqlite'))
+    try:
+        first = dict(video_info(str(tmp_path / 'first'), 'a_1_2_3', 1000, 1000), binary_cfg_path=str(cfg))
+        expected = p.annotate_videos([first])[0]
+        assert fake_worker.requests == [len(read_intervals(first['dataset_path']))]
+        # The same recording under another name is served from the cache.
+        renamed = dict(video_info(str(tmp_path / 'renamed'), 'b_1_2_3', 1000, 1000), binary_cfg_path=str(cfg))
+        actual = p.annotate_videos([renamed])[0]
+        assert len(fake_worker.requests) == 1
+        np.testing.assert_array_equal(expected['stereotypical_score'].to_numpy(dtype=float), actual['stereotypical_score'].to_numpy(dtype=float))
+        # With another step size, only the sequences that were not scored before are sent.
+        resplit = dict(video_info(str(tmp_path / 'resplit'), 'c_1_2_3', 1000, 1000, step_size=45), binary_cfg_path=str(cfg))
+        p.annotate_videos([resplit])
+        seen = {tuple(x) for x in read_intervals(first['dataset_path'])[:, :2].tolist()}
+        assert fake_worker.requests[1:] == [sum(tuple(x) not in seen for x in read_intervals(resplit['dataset_path'])[:, :2].tolist())]
+    finally:
+        p.close()
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+
+import ffmpeg
+import numpy as np
+import pytest
+
+from asdmotion import utils
+from asdmotion.pipeline import frame_index as frame_index_module, openpose_executor
+from asdmotion.pipeline.frame_bus import FrameSubscription
+from asdmotion.pipeline.frame_index import FrameIndex
+from asdmotion.pipeline.openpose_executor import FramePipe, shard_ranges
+
+
+class FakeProcess:
+    def __init__(self, args):
+        self.args = args
+        self.killed = False
+
+    def kill(self):
+        self.killed = True
+
+    def wait(self):
+        return 0
+
+
+@pytest.fixture
+def ffmpeg_args(monkeypatch):
+    # Records the ffmpeg command of every pipe instead of running it.
+    commands = []
+
+    def run_async(stream, **kwargs):
+        commands.append(stream.get_args())
+        return FakeProcess(commands[-1])
+
+    monkeypatch.setattr(ffmpeg.nodes.OutputStream, 'run_async', run_async)
+    return commands
+
+
+def frame_index(num_frames=100, gop=12, fps=25):
+    return FrameIndex(np.arange(num_frames) / fps, np.arange(num_frames) * 1000, np.arange(num_frames) % gop == 0, fingerprint='x')
+
+
+def test_shard_ranges_cover_all_frames():
+    for frame_count, num_shards in [(100, 3), (7, 4), (3, 8), (1000, 1)]:
+        shards = shard_ranges(frame_count, num_shards)
+        assert shards[0][0] == 0 and shards[-1][1] == frame_count
+        assert all(t == s for (_, t), (s, _) in zip(shards[:-1], shards[1:]))
+
+
+def test_pipe_seeks_to_keyframe_and_trims_the_rest(tmp_path, ffmpeg_args):
+    with FramePipe('clip.mp4', str(tmp_path), name='shard', start_frame=30, end_frame=60, frame_index=frame_index()):
+        pass
+    args = ffmpeg_args[0]
+    # Frame 24 is the last keyframe before 30; the seek lands between frames 23 and 24.
+    assert float(args[args.index('-ss') + 1]) == pytest.approx((23 + 24) / 2 / 25)
+    assert args.index('-ss') < args.index('-i')
+    assert 'trim=end_frame=36:start_frame=6' in args[args.index('-filter_complex') + 1]
+    assert not os.path.exists(tmp_path / 'shard.y4m')
+
+
+
+def test_frame_count_is_read_from_the_persisted_index(tmp_path, monkeypatch):
+    calls = []
+
+    def read_video_packets(video_path, stream='v:0'):
+        calls.append(video_path)
+        index = frame_index(num_frames=37)
+        return index.pts, index.pos, index.keyframe
+
+    monkeypatch.setattr(frame_index_module, 'read_video_packets', read_video_packets)
+    video, index_path = tmp_path / 'clip.mp4', tmp_path / 'work' / 'clip_frames.npz'
+    video.write_bytes(b'packets')
+    assert utils._count_frames(str(video), str(index_path)) == 37
+    assert utils._count_frames(str(video), str(index_path)) == 37
+    assert len(calls) == 1 and index_path.exists()
+
+@pytest.mark.parametrize('start_frame, index', [(5, frame_index()), (30, None), (0, frame_index())])
+def test_pipe_trims_from_the_start_without_a_seek(tmp_path, ffmpeg_args, start_frame, index):
+    with FramePipe('clip.mp4', str(tmp_path), name='shard', start_frame=start_frame, end_frame=60, frame_index=index):
+        pass
+    args = ffmpeg_args[0]
+    assert '-ss' not in args
+    assert f'trim=end_frame=60:start_frame={start_frame}' in args[args.index('-filter_complex') + 1]
+
+
+@pytest.mark.parametrize('writer_delay', [0.0, 0.5])
+def test_pipe_error_does_not_hang_on_the_writer(tmp_path, monkeypatch, writer_delay):
+    # With a delay the writer opens the FIFO only after the error, without one it blocks writing frames nobody reads.
+    write_y4m = openpose_executor.write_y4m
+
+    def delayed(frames, path, fps):
+        time.sleep(writer_delay)
+        write_y4m(frames, path, fps)
+
+    monkeypatch.setattr(openpose_executor, 'write_y4m', delayed)
+    frames = FrameSubscription(4)
+    for _ in range(4):
+        frames.put(np.zeros((480, 640, 3), dtype=np.uint8))
+    pipe = FramePipe('clip.mp4', str(tmp_path), name='frames', frames=frames, fps=25)
+
+    def run():
+        with pytest.raises(RuntimeError):
+            with pipe:
+                raise RuntimeError('OpenPose failed')
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    t.join(10)
+    assert not t.is_alive()
+    assert not pipe.writer.is_alive()
+    assert not os.path.exists(tmp_path / 'frames.y4m')
+
+
+def test_pipe_without_frames_still_writes_the_header(tmp_path):
+    frames = FrameSubscription(4)
+    frames.close()
+    with FramePipe('clip.mp4', str(tmp_path), name='empty', frames=frames, fps=25, resolution=(641, 480)) as path:
+        with open(path, 'rb') as f:
+            data = f.read()
+    assert data == b'YUV4MPEG2 W642 H480 F25:1 Ip A1:1 C420jpeg\n'
@@ -0,0 +1,39 @@
+import sys
+
+import numpy as np
+import pytest
+
+from asdmotion.detector.inference_client import InferenceWorker
+
+
+def fake_worker(**kwargs):
+    # The worker process serves deterministic random scores per window instead of loading PoseC3D.
+    return InferenceWorker(None, None, None, python_cmd=[sys.executable], fake_classes=2, **kwargs)
+
+
+def windows(names):
+    return [{'segment_name': n, 'keypoint': np.zeros((1, 200, 17, 2), dtype=np.float32)} for n in names]
+
+
+def test_predict_many_matches_predict():
+    named = {'a': windows([f'a_{i}' for i in range(5)]), 'b': windows([f'b_{i}' for i in range(40)])}
+    with fake_worker() as worker:
+        separate = {n: worker.predict(w) for n, w in named.items()}
+        together = worker.predict_many(named)
+    assert list(together.keys()) == list(named.keys())
+    for n in named:
+        scores, clips = together[n]
+        np.testing.assert_allclose(np.array(scores).reshape(-1, 2), np.array(separate[n][0]).reshape(-1, 2))
+        assert clips == separate[n][1] == [10] * len(named[n])
+
+
+@pytest.mark.parametrize('threshold', [0.5, 0.85])
+def test_adaptive_tta_keeps_full_tta_scores(threshold):
+    w = windows([f'v_{i}' for i in range(500)])
+    with fake_worker() as worker:
+        full, _ = worker.predict(w)
+    with fake_worker(tta_threshold=threshold) as worker:
+        adaptive, clips = worker.predict(w)
+    np.testing.assert_array_equal(np.array(adaptive), np.array(full))
+    # Most classifications are settled well before the last clip.
+    assert np.mean(clips) < 10
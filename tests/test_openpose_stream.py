@@ -0,0 +1,84 @@
+import os
+import stat
+import sys
+import threading
+from os import path as osp
+
+import numpy as np
+import pytest
+
+import stub_openpose
+from asdmotion.pipeline import openpose_executor
+from asdmotion.pipeline.openpose_executor import OpenposeInitializer
+from asdmotion.pipeline.openpose_parser import OpenposeStreamConsumer, parse_openpose_dir, stitch_shards, shard_dirs
+
+FRAMES = 40
+
+
+def assert_same_sequence(expected, actual):
+    assert len(expected) == len(actual)
+    np.testing.assert_array_equal(expected.frame_offsets, actual.frame_offsets)
+    np.testing.assert_array_equal(expected.keypoints, actual.keypoints)
+    np.testing.assert_array_equal(expected.person_ids, actual.person_ids)
+
+
+@pytest.mark.parametrize('shards', [[(0, FRAMES - 1)], [(0, 14), (15, 29), (30, FRAMES - 1)]])
+def test_consumer_parses_while_openpose_writes(tmp_path, shards):
+    streamed, reference = str(tmp_path / 'streamed'), str(tmp_path / 'reference')
+    os.makedirs(streamed)
+
+    def out_dir(root, first):
+        return root if len(shards) == 1 else osp.join(root, f'shard_{first:09d}')
+
+    writers = [threading.Thread(target=stub_openpose.write_frames, args=(out_dir(streamed, s), s, t), kwargs={'delay': 0.01}) for s, t in shards]
+    consumer = OpenposeStreamConsumer(streamed, poll_interval=0.05).start()
+    for w in writers:
+        w.start()
+    for w in writers:
+        w.join()
+    consumed_while_writing = consumer.consumed
+    consumer.stop()
+    for s, t in shards:
+        stub_openpose.write_frames(out_dir(reference, s), s, t)
+    if len(shards) == 1:
+        expected = parse_openpose_dir(reference)
+    else:
+        expected = stitch_shards([(s, parse_openpose_dir(d)) for s, d in shard_dirs(reference)])
+
+    assert 0 < consumed_while_writing < FRAMES
+    assert consumer.consumed == FRAMES
+    assert_same_sequence(expected, consumer.result())
+    # Consumed files are deleted, so nothing is parsed twice.
+    assert all(len([f for f in files if f.endswith('.json')]) == 0 for _, _, files in os.walk(streamed))
+
+
+@pytest.fixture
+def stub_initializer(tmp_path, monkeypatch):
+    open_pose_path = tmp_path / 'openpose'
+    open_pose_path.mkdir()
+    launcher = open_pose_path / 'stub'
+    launcher.write_text(f'#!{sys.executable}\nimport sys\nsys.path.insert(0, {osp.dirname(osp.abspath(__file__))!r})\n'
+                        'import stub_openpose\nstub_openpose.main()\n')
+    launcher.chmod(launcher.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv(stub_openpose.FRAMES_ENV, str(FRAMES))
+    monkeypatch.setenv(stub_openpose.DELAY_ENV, '0.03')
+    monkeypatch.setattr(openpose_executor, 'get_video_properties', lambda *args, **kwargs: ((64, 48), 25.0, FRAMES, FRAMES / 25.0))
+    video_path = tmp_path / 'clip.mp4'
+    video_path.write_bytes(os.urandom(1024))
+
+    def build(**kwargs):
+        return OpenposeInitializer(200, 5, 3, str(open_pose_path), ingestion='video', openpose_bin='stub', **kwargs)
+
+    return build, str(video_path)
+
+
+@pytest.mark.parametrize('num_shards', [1, 2])
+def test_prepare_skeleton_streams_stub_openpose(stub_initializer, num_shards):
+    build, video_path = stub_initializer
+    streamed = build(num_shards=num_shards, stream_json=True).prepare_skeleton(video_path)
+    parsed = build(num_shards=num_shards).prepare_skeleton(video_path)
+    assert streamed['frame_count'] == FRAMES
+    assert_same_sequence(parsed['data'], streamed['data'])
+    assert len(streamed['data']) == FRAMES
+    runs_dir = osp.join(osp.dirname(video_path), 'openpose', 'runs')
+    assert not osp.exists(runs_dir) or len(os.listdir(runs_dir)) == 0
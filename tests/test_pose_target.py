@@ -0,0 +1,60 @@
+import hashlib
+from os import path as osp
+
+import numpy as np
+
+from asdmotion.pipeline.pose_target import PoseTargetGenerator
+
+LEFT_KP = [1, 3, 5, 7, 9, 11, 13, 15]
+RIGHT_KP = [2, 4, 6, 8, 10, 12, 14, 16]
+# Made with mmaction2 0.24 by data/make_pose_target_reference.py.
+REFERENCE = osp.join(osp.dirname(osp.abspath(__file__)), 'data', 'pose_target_reference.npz')
+
+
+def pipeline(clip_len=48, num_clips=10, size=56):
+    return [dict(type='ChildDetect'), dict(type='UniformSampleFrames', clip_len=clip_len, num_clips=num_clips, test_mode=True), dict(type='PoseDecode'),
+            dict(type='PoseCompact', hw_ratio=1., allow_imgpad=True), dict(type='Resize', scale=(-1, size)), dict(type='CenterCrop', crop_size=size),
+            dict(type='GeneratePoseTarget', sigma=0.6, use_score=True, with_kp=True, with_limb=False, double=True, left_kp=LEFT_KP, right_kp=RIGHT_KP),
+            dict(type='FormatShape', input_format='NCTHW'), dict(type='Collect', keys=['imgs', 'label'], meta_keys=[]), dict(type='ToTensor', keys=['imgs'])]
+
+
+def reference_windows(reference, name):
+    trials = sorted({int(k.split('_')[1]) for k in reference.files if k.startswith(f'{name}_')})
+    for trial in trials:
+        prefix = f'{name}_{trial}_'
+        kp = reference[prefix + 'keypoint']
+        yield prefix, dict(keypoint=kp, keypoint_score=reference[prefix + 'keypoint_score'], total_frames=kp.shape[1],
+                           img_shape=tuple(reference[prefix + 'img_shape'].tolist()), start_index=0, modality='Pose')
+
+
+def test_from_config_keeps_the_steps_before_sampling():
+    prefix, generator = PoseTargetGenerator.from_config(pipeline())
+    assert [p['type'] for p in prefix] == ['ChildDetect']
+    assert generator.clip_len == 48 and generator.num_clips == 10 and generator.double
+
+
+def test_clip_subset_matches_full_volume():
+    generator, rng = PoseTargetGenerator(), np.random.default_rng(1)
+    for T in [30, 60, 200]:
+        kp = np.stack([rng.uniform(0, 1280, (3, T, 17)), rng.uniform(0, 720, (3, T, 17))], -1).astype(np.float32)
+        window = dict(keypoint=kp, keypoint_score=rng.random((3, T, 17)).astype(np.float32), total_frames=T, img_shape=(720, 1280))
+        full = generator(window)
+        assert full.shape == (20, 17, 48, 56, 56)
+        for clips in [[0, 1], [4], [2, 3, 9]]:
+            expected = full[np.concatenate([clips, np.array(clips) + generator.num_clips])]
+            np.testing.assert_array_equal(generator(window, clips=np.array(clips)), expected)
+
+
+def test_matches_mmaction_pipeline():
+    with np.load(REFERENCE) as reference:
+        _, generator = PoseTargetGenerator.from_config(pipeline(clip_len=4, num_clips=2, size=12))
+        for prefix, window in reference_windows(reference, 'small'):
+            expected, actual = reference[prefix + 'imgs'], generator(window)
+            assert actual.dtype == expected.dtype
+            np.testing.assert_array_equal(actual, expected)
+        # The volumes of the model's own pipeline are too large to keep, so they are compared by digest.
+        _, generator = PoseTargetGenerator.from_config(pipeline())
+        for prefix, window in reference_windows(reference, 'model'):
+            actual = generator(window)
+            assert actual.shape == tuple(reference[prefix + 'shape'].tolist()) and actual.dtype == np.float32
+            assert hashlib.sha1(np.ascontiguousarray(actual).tobytes()).hexdigest() == str(reference[prefix + 'digest'])
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from asdmotion.detector.results_store import ResultsStore
+
+pytest.importorskip('pyarrow')
+
+
+def scores(video, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = np.arange(0, 600, 30)
+    return pd.DataFrame({'video': video, 'video_full_name': f'{video}.mp4', 'video_path': f'/videos/{video}.mp4', 'start_time': starts / 30,
+                         'end_time': (starts + 200) / 30, 'start_frame': starts, 'end_frame': starts + 200,
+                         'movement': [-1 if s < 300 else 'NoChild' for s in starts], 'calc_date': pd.Timestamp('2024-01-02 03:04:05'),
+                         'annotator': 'model', 'stereotypical_score': np.where(starts < 300, rng.random(starts.shape[0]), np.nan)})
+
+
+def conclusion(video, smm_count):
+    return pd.DataFrame({'video': [video], 'smm_length_minute': [0.5 * smm_count], 'smm_proportion': [0.1], 'smm_count': [smm_count], 'fps': [30.0],
+                         'video_length_minute': [10.0], 'video_frame_count': [18000], 'valid_frames': [17000], 'last_valid_frame': [17999],
+                         'skipped_frames': [1000], 'smm/min': [smm_count / 10], 'assessment': ['1_2']})
+
+
+def test_round_trip(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    expected = scores('a_1_2_3')
+    store.append_video('a_1_2_3', 'model', scores=expected, conclusion=conclusion('a_1_2_3', 3))
+    actual = store.read('scores')
+    assert set(actual['assessment']) == {'a_1'} and set(actual['model']) == {'model'}
+    for c in expected.columns:
+        if c == 'movement':
+            np.testing.assert_array_equal(actual[c].to_numpy(), expected[c].astype(str).to_numpy())
+        elif c == 'calc_date':
+            assert (pd.to_datetime(actual[c]) == expected[c]).all()
+        else:
+            np.testing.assert_array_equal(actual[c].to_numpy(), expected[c].to_numpy())
+    assert store.read('annotations').shape[0] == 0
+    assert list(store.read('scores', columns=['video', 'stereotypical_score']).columns) == ['video', 'stereotypical_score']
+
+
+def test_latest_write_wins(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    store.append_video('a_1_2_3', 'model', conclusion=conclusion('a_1_2_3', 3))
+    store.append_video('b_4_5_6', 'model', conclusion=conclusion('b_4_5_6', 1))
+    store.append_video('a_1_2_3', 'model', conclusion=conclusion('a_1_2_3', 7))
+    store.append_video('a_1_2_3', 'other', conclusion=conclusion('a_1_2_3', 2))
+    assert store.read('conclusions').shape[0] == 4
+    cohort = store.cohort_conclusions(metrics=['smm_count'])
+    assert list(cohort.columns) == ['video', 'assessment', 'model', 'smm_count']
+    assert cohort[['video', 'model', 'smm_count']].values.tolist() == [['a_1_2_3', 'model', 7], ['a_1_2_3', 'other', 2], ['b_4_5_6', 'model', 1]]
+    assert store.cohort_conclusions(assessments=['b_4'])['video'].tolist() == ['b_4_5_6']
+    assert store.cohort_conclusions(models=['other'])['smm_count'].tolist() == [2]
+
+
+def test_unknown_table(tmp_path):
+    with pytest.raises(ValueError):
+        ResultsStore(str(tmp_path)).append('segments', scores('a_1_2_3'), 'a', 'model')
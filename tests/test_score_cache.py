@@ -0,0 +1,79 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from asdmotion.detector import score_cache
+from asdmotion.detector.score_cache import ScoreCache, cfg_fingerprint, window_key
+from asdmotion.utils import file_fingerprint
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Every access gets its own time, so least recently used is well defined.
+    ticks = itertools.count()
+    monkeypatch.setattr(score_cache.time, 'time', lambda: float(next(ticks)))
+
+
+def scores(k):
+    return np.array([1 - k / 10, k / 10], dtype=np.float32)
+
+
+def test_hits_and_misses(tmp_path, clock):
+    cache = ScoreCache(str(tmp_path / 'scores.sqlite'))
+    try:
+        cache.put_many({'a': (scores(1), 10), 'b': (scores(2), None)})
+        found = cache.get_many(['a', 'b', 'c', 'a'])
+        assert set(found.keys()) == {'a', 'b'}
+        np.testing.assert_array_equal(found['a'][0], scores(1))
+        assert found['a'][1] == 10 and found['b'][1] is None
+    finally:
+        cache.close()
+    # Entries outlive the process that wrote them.
+    cache = ScoreCache(str(tmp_path / 'scores.sqlite'))
+    try:
+        assert len(cache) == 2
+    finally:
+        cache.close()
+
+
+def test_evicts_least_recently_used(tmp_path, clock):
+    cache = ScoreCache(str(tmp_path / 'scores.sqlite'), max_entries=3)
+    try:
+        cache.put_many({k: (scores(i), None) for i, k in enumerate('abc')})
+        cache.get_many(['a'])
+        cache.put_many({'d': (scores(4), None)})
+        assert len(cache) == 3
+        assert set(cache.get_many(list('abcd')).keys()) == {'a', 'c', 'd'}
+        cache.put_many({k: (scores(5), None) for k in 'efgh'})
+        assert set(cache.get_many(list('abcdefgh')).keys()) == {'f', 'g', 'h'}
+    finally:
+        cache.close()
+
+
+def window(seed, T=200):
+    rng = np.random.default_rng(seed)
+    return {'keypoint': rng.random((2, T, 17, 2), dtype=np.float32), 'keypoint_score': rng.random((2, T, 17), dtype=np.float32),
+            'img_shape': (720, 1280), 'original_shape': (720, 1280), 'total_frames': T, 'frame_dir': f'a_{seed}', 'segment_name': f'a_{seed}_0_200'}
+
+
+def test_keys_follow_window_content_model_and_cfg(tmp_path):
+    model, cfg = tmp_path / 'model.pth', tmp_path / 'cfg.py'
+    model.write_bytes(b'weights')
+    cfg.write_text("model = dict(type='Recognizer3D')\nann_file = 'a.pkl'\nwork_dir = 'a'\n")
+
+    def key(w):
+        return window_key(w, f'{file_fingerprint(str(model))}:{cfg_fingerprint(str(cfg))}')
+
+    key0 = key(window(0))
+    # Names and offsets are not part of the key; the skeleton is.
+    assert key(dict(window(0), frame_dir='b_0', segment_name='b_0_30_230')) == key0
+    assert key(window(1)) != key0
+    # Per-video cfg lines do not invalidate the cache, any other change does.
+    cfg.write_text("model = dict(type='Recognizer3D')\nann_file = 'b.pkl'\nwork_dir = 'b'\n")
+    assert key(window(0)) == key0
+    cfg.write_text("model = dict(type='Recognizer3D', cls_head=None)\nann_file = 'b.pkl'\nwork_dir = 'b'\n")
+    key1 = key(window(0))
+    assert key1 != key0
+    model.write_bytes(b'other weights')
+    assert key(window(0)) not in (key0, key1)
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import baseline
+from asdmotion.child_detector.skeleton_matcher import SkeletonMatcher
+
+
+def random_video(rng, T=300):
+    M = int(rng.integers(1, 5))
+    kp = rng.uniform(0, 300, (M, T, 17, 2)).astype(np.float32)
+    kps = rng.uniform(0, 1, (M, T, 17)).astype(np.float32)
+    kps[:, rng.integers(0, T, 30)] = 0
+    detections, p = [], rng.uniform(0.05, 0.6)
+    for i in range(T - int(rng.integers(0, 5))):
+        n = rng.integers(1, 5) if rng.random() < p else rng.integers(0, 2)
+        cls = rng.integers(0, 2, n) if rng.random() < p else np.zeros(n, dtype=int)
+        detections.append((i, pd.DataFrame({'xcenter': rng.uniform(50, 250, n).round(), 'ycenter': rng.uniform(50, 250, n).round(),
+                                            'width': rng.uniform(20, 300, n).round(), 'height': rng.uniform(20, 300, n).round(),
+                                            'confidence': rng.uniform(0, 1, n).round(1), 'class': cls})))
+    return {'keypoint': kp, 'keypoint_score': kps}, detections
+
+
+def tracked_video(rng, T=400):
+    # Detections follow the people's own boxes, but the child is detected only now and then, so most child frames come
+    # from gap filling. An adult close to the child competes for the same person.
+    M = 3
+    centers = rng.uniform(150, 450, (M, 1, 1, 2)) + np.cumsum(rng.normal(0, 2, (M, T, 1, 2)), axis=1)
+    kp = (centers + rng.uniform(-60, 60, (M, T, 17, 2))).astype(np.float32)
+    kps = rng.uniform(0.2, 1, (M, T, 17)).astype(np.float32)
+    kps[rng.integers(0, M, 20), rng.integers(0, T, 20)] = 0
+    boxes = baseline.bounding_box
+    detections = []
+    for i in range(T):
+        rows = []
+        if rng.random() < 0.15:
+            x, y, w, h = boxes(kp[0, i].T, kps[0, i]).reshape(-1)
+            rows.append([x + rng.normal(0, 3), y + rng.normal(0, 3), max(w, 8), max(h, 8), round(rng.uniform(0, 1), 2), 1])
+        for m in range(1, M):
+            if rng.random() < 0.7:
+                x, y, w, h = boxes(kp[m, i].T, kps[m, i]).reshape(-1)
+                rows.append([x, y, max(w, 8), max(h, 8), 0.8, 0])
+        detections.append((i, pd.DataFrame(rows, columns=['xcenter', 'ycenter', 'width', 'height', 'confidence', 'class'])))
+    return {'keypoint': kp, 'keypoint_score': kps}, detections
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_gap_filling_matches_baseline(seed):
+    rng = np.random.default_rng(seed)
+    skeleton, detections = tracked_video(rng)
+    for grace_distance in [1, 5, 20, 100]:
+        params = dict(iou_threshold=0.1, conf_threshold=0.5, similarity_threshold=0.85, grace_distance=grace_distance, tolerance=100)
+        expected = baseline.SkeletonMatcher(**params).match_skeleton(skeleton, detections)
+        actual = SkeletonMatcher(**params).match_skeleton(skeleton, detections)
+        for k in ['child_ids', 'child_detected', 'child_bbox']:
+            np.testing.assert_array_equal(expected[k], actual[k])
+        if grace_distance > 5:
+            assert ((actual['child_ids'] >= 0) & (actual['child_detected'] <= 0.5)).sum() > 0
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_match_skeleton_matches_baseline(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(6):
+        skeleton, detections = random_video(rng)
+        params = dict(iou_threshold=rng.choice([0.01, 0.1, 0.3]), conf_threshold=rng.choice([0.1, 0.5]), similarity_threshold=rng.choice([0.3, 0.85]),
+                      grace_distance=int(rng.integers(1, 40)), tolerance=100)
+        expected = baseline.SkeletonMatcher(**params).match_skeleton(skeleton, detections)
+        actual = SkeletonMatcher(**params).match_skeleton(skeleton, detections)
+        for k in ['child_ids', 'child_detected', 'child_bbox']:
+            np.testing.assert_array_equal(expected[k], actual[k])
+
+
+def test_match_skeleton_length_mismatch():
+    skeleton, detections = random_video(np.random.default_rng(0), T=50)
+    with pytest.raises(IndexError):
+        SkeletonMatcher(0.1, 0.5, 10, 0.85, tolerance=5).match_skeleton(skeleton, detections[:40])
@@ -0,0 +1,43 @@
+import numpy as np
+
+from asdmotion.pipeline.skeleton_store import read_skeleton, read_skeleton_meta, resolve_skeleton_path, write_skeleton
+from asdmotion.utils import write_pkl
+
+
+def skeleton(T=500, M=3):
+    rng = np.random.default_rng(0)
+    return {'keypoint': rng.uniform(0, 1280, (M, T, 17, 2)).astype(np.float32), 'keypoint_score': rng.random((M, T, 17), dtype=np.float32),
+            'child_ids': np.where(rng.random(T) < 0.8, rng.integers(0, M, T), -1).astype(np.float32),
+            'child_detected': rng.random(T, dtype=np.float32), 'child_bbox': rng.uniform(0, 720, (T, 4)).astype(np.float32),
+            'frame_dir': 'a_1_2_3', 'img_shape': (720, 1280), 'original_shape': (720, 1280), 'total_frames': T, 'label': -1, 'fps': np.float64(29.97)}
+
+
+def test_memmap_read_matches_pickle(tmp_path):
+    s = skeleton()
+    write_pkl(s, str(tmp_path / 'a.pkl'))
+    write_skeleton(s, str(tmp_path / 'a.skeleton'))
+    legacy, columns = read_skeleton(str(tmp_path / 'a.pkl')), read_skeleton(str(tmp_path / 'a.skeleton'))
+    assert set(legacy.keys()) == set(columns.keys())
+    for k, v in legacy.items():
+        if isinstance(v, np.ndarray):
+            assert isinstance(columns[k], np.memmap)
+            assert columns[k].dtype == v.dtype and columns[k].shape == v.shape
+            assert columns[k].tobytes() == v.tobytes()
+        else:
+            assert np.all(np.asarray(columns[k]) == np.asarray(v))
+    assert read_skeleton_meta(str(tmp_path / 'a.skeleton'))['meta']['total_frames'] == 500
+
+
+def test_read_selected_columns(tmp_path):
+    write_skeleton(skeleton(), str(tmp_path / 'a.skeleton'))
+    s = read_skeleton(str(tmp_path / 'a.skeleton'), mmap=False, columns=['child_ids'])
+    assert not isinstance(s['child_ids'], np.memmap)
+    assert 'keypoint' not in s and s['frame_dir'] == 'a_1_2_3'
+
+
+def test_resolve_falls_back_to_the_pickle(tmp_path):
+    assert resolve_skeleton_path(str(tmp_path / 'a.skeleton')) is None
+    write_pkl(skeleton(T=10), str(tmp_path / 'a.pkl'))
+    assert resolve_skeleton_path(str(tmp_path / 'a.skeleton')) == str(tmp_path / 'a.pkl')
+    write_skeleton(skeleton(T=10), str(tmp_path / 'a.skeleton'))
+    assert resolve_skeleton_path(str(tmp_path / 'a.skeleton')) == str(tmp_path / 'a.skeleton')
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+from asdmotion.pipeline.stage_graph import Stage, StageGraph
+
+
+class StubStage:
+    # Sleeps for `duration`, records which jobs ran and how many ran at once, and fails for the jobs in `fail`.
+    def __init__(self, name, duration=0.0, fail=()):
+        self.name = name
+        self.duration = duration
+        self.fail = set(fail)
+        self.calls = []
+        self.batches = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def _enter(self, jobs):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.calls += jobs
+            self.batches.append(len(jobs))
+        time.sleep(self.duration)
+        with self.lock:
+            self.active -= 1
+
+    def __call__(self, state):
+        self._enter([state['input']])
+        if state['input'] in self.fail:
+            raise RuntimeError(f'{self.name} failed')
+        return f"{self.name}:{state['input']}"
+
+    def batch(self, states):
+        self._enter([s['input'] for s in states])
+        return [RuntimeError(f'{self.name} failed') if s['input'] in self.fail else f"{self.name}:{s['input']}" for s in states]
+
+
+def video_graph(stubs, workers=None):
+    workers = workers or {}
+    after = {'probe': [], 'pose': ['probe'], 'detection': ['probe'], 'dataset': ['pose', 'detection'], 'inference': ['dataset'], 'aggregation': ['inference']}
+    return StageGraph([Stage(n, stubs[n], workers.get(n, 1), after=after[n]) for n in after])
+
+
+def test_jobs_overlap_across_stages():
+    stubs = {n: StubStage(n, d) for n, d in [('probe', .01), ('pose', .1), ('detection', .08), ('dataset', .02), ('inference', .05), ('aggregation', .01)]}
+    s = time.time()
+    results = video_graph(stubs, workers={'probe': 4, 'dataset': 2, 'aggregation': 2}).run(range(8))
+    elapsed = time.time() - s
+    assert elapsed < 0.75 * 8 * sum(stub.duration for stub in stubs.values())
+    assert [state['aggregation'] for state, _ in results] == [f'aggregation:{i}' for i in range(8)]
+    assert all(e is None for _, e in results)
+    assert stubs['pose'].peak == 1 and stubs['detection'].peak == 1
+
+
+def test_failure_skips_dependent_stages():
+    stubs = {n: StubStage(n) for n in ['probe', 'pose', 'detection', 'dataset', 'inference', 'aggregation']}
+    stubs['detection'].fail = {3}
+    results = video_graph(stubs).run(range(6))
+    state, error = results[3]
+    assert isinstance(error, RuntimeError)
+    assert 'detection' not in state and 'dataset' not in state
+    assert 3 not in stubs['dataset'].calls and 3 not in stubs['aggregation'].calls
+    assert all(e is None for i, (_, e) in enumerate(results) if i != 3)
+
+
+def test_batches_jobs_that_are_ready_together():
+    upstream, batched = StubStage('upstream'), StubStage('batched', 0.05)
+    graph = StageGraph([Stage('upstream', upstream, workers=4), Stage('batched', batched.batch, after=['upstream'], batch=4)])
+    results = graph.run(range(10))
+    assert [state['batched'] for state, _ in results] == [f'batched:{i}' for i in range(10)]
+    assert sorted(batched.calls) == list(range(10))
+    assert max(batched.batches) > 1 and max(batched.batches) <= 4
+
+
+def test_batch_output_error_fails_only_its_job():
+    batched, downstream = StubStage('batched', fail=[2]), StubStage('downstream')
+    graph = StageGraph([Stage('batched', batched.batch, batch=8), Stage('downstream', downstream, after=['batched'])])
+    results = graph.run(range(5))
+    assert isinstance(results[2][1], RuntimeError)
+    assert sorted(downstream.calls) == [0, 1, 3, 4]
+
+
+def test_raised_batch_error_fails_the_batch():
+    def fail(states):
+        raise RuntimeError('batch failed')
+
+    results = StageGraph([Stage('batched', fail, batch=8)]).run(range(3))
+    assert all(isinstance(e, RuntimeError) for _, e in results)
+
+
+def test_empty_input():
+    assert StageGraph([Stage('a', StubStage('a'))]).run([]) == []
+
+
+@pytest.mark.parametrize('stages', [[Stage('a', None, after=['b']), Stage('b', None, after=['a'])],
+                                    [Stage('a', None, after=['missing'])],
+                                    [Stage('a', None), Stage('a', None)]])
+def test_invalid_graphs(stages):
+    with pytest.raises(ValueError):
+        StageGraph(stages)
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+import baseline
+from asdmotion.pipeline.window_dataset import WindowDataset, read_intervals, read_skipped, split_intervals, write_annotations
+from asdmotion.utils import read_pkl, write_pkl
+
+
+def skeleton(T, matched=True, seed=0):
+    rng = np.random.default_rng(seed)
+    s = {'keypoint': rng.uniform(0, 1280, (2, T, 17, 2)).astype(np.float32), 'keypoint_score': rng.random((2, T, 17), dtype=np.float32),
+         'frame_dir': 'a_1_2_3.mp4', 'img_shape': (720, 1280), 'original_shape': (720, 1280), 'total_frames': T, 'label': -1, 'fps': 30.0}
+    if matched:
+        s['child_ids'] = np.where(rng.random(T) < 0.7, 0, -1).astype(np.float32)
+        s['child_detected'] = rng.random(T, dtype=np.float32)
+    return s
+
+
+def old_annotations(s, sequence_length, step_size):
+    dataset = baseline.Splitter(s, sequence_length=sequence_length, step_size=step_size, min_length=step_size * 2).collect()
+    return {'split': {'test1': [f'{x["frame_dir"]}' for x in dataset]}, 'annotations': dataset}
+
+
+def assert_same_windows(expected, actual):
+    assert expected['split'] == actual['split']
+    assert len(expected['annotations']) == len(actual['annotations'])
+    for e, a in zip(expected['annotations'], actual['annotations']):
+        assert e.keys() == a.keys()
+        for k, v in e.items():
+            if isinstance(v, np.ndarray):
+                np.testing.assert_array_equal(v, a[k])
+            else:
+                assert np.all(np.asarray(v) == np.asarray(a[k])), k
+
+
+def test_split_matches_splitter():
+    for T in [1, 29, 30, 59, 60, 199, 200, 201, 1000, 1234]:
+        for sequence_length, step_size in [(200, 30), (200, 60), (100, 100), (200, 250), (60, 30)]:
+            s = {'keypoint': np.zeros((1, T, 17, 2)), 'keypoint_score': np.zeros((1, T, 17)), 'frame_dir': 'a'}
+            intervals = split_intervals(T, sequence_length, step_size, step_size * 2)
+            assert intervals.dtype == np.int64 and intervals.shape[1] == 3
+            assert [tuple(x) for x in intervals[:, :2].tolist()] == baseline.Splitter(s, sequence_length, step_size, step_size * 2).intervals
+            np.testing.assert_array_equal(intervals[:, 2], np.arange(intervals.shape[0]))
+
+
+@pytest.mark.parametrize('matched', [True, False])
+def test_saved_dataset_matches_per_window_pickle(tmp_path, matched):
+    s = skeleton(1000, matched=matched)
+    write_pkl(old_annotations(s, 200, 30), str(tmp_path / 'a_dataset_200.pkl'))
+    WindowDataset.from_skeleton(s, 200, 30, 60).save(str(tmp_path / 'a_dataset_200.windows'))
+    write_annotations(str(tmp_path / 'a_dataset_200.windows'), str(tmp_path / 'materialized.pkl'))
+    assert_same_windows(read_pkl(str(tmp_path / 'a_dataset_200.pkl')), read_pkl(str(tmp_path / 'materialized.pkl')))
+    np.testing.assert_array_equal(read_intervals(str(tmp_path / 'a_dataset_200.pkl')), read_intervals(str(tmp_path / 'a_dataset_200.windows')))
+
+
+def test_loaded_windows_are_views_of_one_copy(tmp_path):
+    WindowDataset.from_skeleton(skeleton(500), 200, 30, 60).save(str(tmp_path / 'a.windows'))
+    dataset = WindowDataset.load(str(tmp_path / 'a.windows'))
+    assert dataset.params == {'sequence_length': 200, 'step_size': 30, 'min_length': 60, 'min_valid_ratio': 0.0}
+    w = dataset[3]
+    assert w['start'] == 90 and w['end'] == 290 and w['segment_name'] == 'a_1_2_3_90_290'
+    assert np.shares_memory(w['keypoint'], dataset.skeleton['keypoint'])
+
+
+def test_windows_without_the_child_are_dropped(tmp_path):
+    s = skeleton(1000)
+    s['child_ids'][:] = 0
+    s['child_ids'][300:700] = -1
+    dataset = WindowDataset.from_skeleton(s, 200, 30, 60, min_valid_ratio=0.5)
+    ratios = [(w['child_ids'] != -1).mean() for w in WindowDataset.from_skeleton(s, 200, 30, 60)]
+    assert len(dataset) == sum(r >= 0.5 for r in ratios)
+    # The frames that only dropped windows cover are reported as skipped.
+    np.testing.assert_array_equal(dataset.skipped, [[380, 600]])
+    dataset.save(str(tmp_path / 'a.windows'))
+    np.testing.assert_array_equal(read_skipped(str(tmp_path / 'a.windows')), dataset.skipped)
+    np.testing.assert_array_equal(read_intervals(str(tmp_path / 'a.windows')), dataset.intervals)
+
+
+def test_windows_where_the_child_is_not_detected_are_dropped():
+    s = skeleton(1000)
+    s['child_ids'][:] = 0
+    s['child_detected'][:] = 1
+    s['child_detected'][300:700] = 0
+    dataset = WindowDataset.from_skeleton(s, 200, 30, 60, min_valid_ratio=0.5)
+    np.testing.assert_array_equal(dataset.skipped, [[380, 600]])
+    # Without recorded detections, the matched person alone decides.
+    del s['child_detected']
+    dataset = WindowDataset.from_skeleton(s, 200, 30, 60, min_valid_ratio=0.5)
+    assert dataset.skipped.shape[0] == 0 and len(dataset) == len(WindowDataset.from_skeleton(s, 200, 30, 60))